@@ -0,0 +1,3 @@
+# -*- coding: utf-8 -*-
+# 精煉引擎離線基準測試：合成倉庫產生器 + 分段計時
+from benchmarks.synthetic_warehouse import build_warehouse, MARKET_PROFILES
@@ -0,0 +1,194 @@
+# -*- coding: utf-8 -*-
+"""
+精煉引擎離線基準測試 (不需雲端 .db)：
+
+    python -m benchmarks.run_benchmark --market CN --symbols 500 --days 750
+    python -m benchmarks.run_benchmark --market TW --workers 4 --compare benchmarks/results/TW_base.json
+
+流程：建立 (或沿用快取的) 合成倉庫 -> 計時 MarketRuleRouter.apply -> 計時 AlphaCoreEngine 各階段，
+結果以 JSON 寫入 benchmarks/results/，可用 --compare 與先前的結果逐項比較。
+"""
+import argparse
+import contextlib
+import io
+import json
+import os
+import platform
+import shutil
+import sqlite3
+import subprocess
+import sys
+import tempfile
+import time
+
+import numpy as np
+import pandas as pd
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if ROOT not in sys.path:
+    sys.path.insert(0, ROOT)
+
+from core_engine import AlphaCoreEngine
+from market_rules import MarketRuleRouter
+from benchmarks.synthetic_warehouse import build_warehouse
+
+# 合成倉庫可達數百 MB，快取放在暫存目錄 (不寫進 repo)；BENCHMARK_CACHE_DIR 可改指定位置
+CACHE_DIR = os.environ.get("BENCHMARK_CACHE_DIR") or os.path.join(tempfile.gettempdir(), "alpha_benchmark_cache")
+RESULTS_DIR = os.path.join(ROOT, "benchmarks", "results")
+
+# ==========================================
+# 合成倉庫 (依參數快取，避免每次重建)
+# ==========================================
+def warehouse_path(args):
+    os.makedirs(CACHE_DIR, exist_ok=True)
+    name = f"{args.market}_{args.symbols}s_{args.days}d_lu{args.limit_up_rate}_pp{args.pingpong_rate}_seed{args.seed}.db"
+    path = os.path.join(CACHE_DIR, name)
+    if not os.path.exists(path):
+        print(f"🏗️ 建立合成倉庫 {name} ...")
+        build_warehouse(path, market=args.market, n_symbols=args.symbols, n_days=args.days,
+                        limit_up_rate=args.limit_up_rate, pingpong_rate=args.pingpong_rate, seed=args.seed)
+    return path
+
+# ==========================================
+# 計時項目
+# ==========================================
+def time_rules(db_path, market, repeat):
+    """ 以引擎實際讀入的原始數據計時 MarketRuleRouter.apply (取多次中的最佳值) """
+    conn = sqlite3.connect(db_path)
+    try:
+        loader = AlphaCoreEngine(conn, None, market)
+        loader._load_raw_data(AlphaCoreEngine.START_DATE)
+        raw = loader.df
+    finally:
+        conn.close()
+
+    router = MarketRuleRouter.get_rules(market)
+    best_wall, best_cpu = None, None
+    for _ in range(repeat):
+        df = raw.copy()
+        wall, cpu = time.perf_counter(), time.process_time()
+        router.apply(df)
+        wall, cpu = time.perf_counter() - wall, time.process_time() - cpu
+        if best_wall is None or wall < best_wall:
+            best_wall, best_cpu = wall, cpu
+    # 鍵名沿用 rules.market_rules，與先前的結果檔仍可 --compare
+    return {"rules.market_rules": {'wall_s': best_wall, 'cpu_s': best_cpu, 'rows': len(raw)}}
+
+
+def time_engine(db_path, market, repeat, verbose=False, **engine_kwargs):
+    """ 每次在倉庫副本上完整執行引擎；各階段取多次中的最佳牆鐘時間 """
+    best = {}
+    for _ in range(repeat):
+        with tempfile.TemporaryDirectory() as tmp:
+            work_db = os.path.join(tmp, "bench.db")
+            shutil.copy(db_path, work_db)
+            conn = sqlite3.connect(work_db)
+            try:
+                engine = AlphaCoreEngine(conn, MarketRuleRouter.get_rules(market), market,
+                                         **engine_kwargs)
+                out = sys.stdout if verbose else io.StringIO()
+                wall = time.perf_counter()
+                with contextlib.redirect_stdout(out):
+                    engine.execute()
+                total = time.perf_counter() - wall
+            finally:
+                conn.close()
+        runs = {f"engine.{name}": dict(stats) for name, stats in engine.profiler.stages.items()}
+        runs['engine.total'] = {'wall_s': total, 'cpu_s': None, 'rows': None}
+        for name, stats in runs.items():
+            if name not in best or stats['wall_s'] < best[name]['wall_s']:
+                best[name] = stats
+    return best
+
+# ==========================================
+# 結果紀錄與比較
+# ==========================================
+def environment():
+    try:
+        commit = subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=ROOT, capture_output=True,
+                                text=True).stdout.strip() or None
+    except OSError:
+        commit = None
+    return {
+        'git_commit': commit,
+        'python': platform.python_version(),
+        'pandas': pd.__version__,
+        'numpy': np.__version__,
+        'platform': platform.platform(),
+        'cpu_count': os.cpu_count(),
+        'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S'),
+    }
+
+
+def print_results(results, baseline=None):
+    base = (baseline or {}).get('results', {})
+    header = f"{'項目':<36}{'牆鐘(s)':>10}{'CPU(s)':>10}{'列數':>12}"
+    if base:
+        header += f"{'基準(s)':>10}{'變化':>9}"
+    print(header)
+    for name, stats in results.items():
+        cpu = f"{stats['cpu_s']:.3f}" if stats.get('cpu_s') is not None else "-"
+        rows = f"{stats['rows']:,}" if stats.get('rows') is not None else "-"
+        line = f"{name:<36}{stats['wall_s']:>10.3f}{cpu:>10}{rows:>12}"
+        if base:
+            ref = base.get(name, {}).get('wall_s')
+            if ref:
+                line += f"{ref:>10.3f}{stats['wall_s'] / ref - 1:>+9.0%}"
+            else:
+                line += f"{'-':>10}{'新增':>9}"
+        print(line)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="AlphaCoreEngine 離線基準測試")
+    parser.add_argument("--market", default="CN", choices=["CN", "TW", "US", "JP", "KR", "HK"])
+    parser.add_argument("--symbols", type=int, default=500)
+    parser.add_argument("--days", type=int, default=750)
+    parser.add_argument("--limit-up-rate", type=float, default=0.03)
+    parser.add_argument("--pingpong-rate", type=float, default=0.0002)
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--workers", type=int, default=1)
+    parser.add_argument("--memory-mb", type=float, default=None)
+    parser.add_argument("--compact", action="store_true")
+    parser.add_argument("--skip-engine", action="store_true", help="只計時 MarketRuleRouter.apply")
+    parser.add_argument("--output", default=None, help="結果 JSON 路徑 (預設 benchmarks/results/)")
+    parser.add_argument("--compare", default=None, help="與先前的結果 JSON 比較")
+    parser.add_argument("--verbose", action="store_true", help="顯示引擎執行時的輸出")
+    args = parser.parse_args(argv)
+    args.market = args.market.upper()
+
+    db_path = warehouse_path(args)
+    with sqlite3.connect(db_path) as conn:
+        n_rows = conn.execute("SELECT COUNT(*) FROM stock_prices").fetchone()[0]
+    print(f"📦 {args.market} 合成倉庫：{args.symbols} 檔 x {args.days} 日 = {n_rows:,} 列")
+
+    engine_kwargs = {'workers': args.workers, 'memory_budget_mb': args.memory_mb, 'compact': args.compact}
+    results = time_rules(db_path, args.market, args.repeat)
+    if not args.skip_engine:
+        results.update(time_engine(db_path, args.market, args.repeat, verbose=args.verbose, **engine_kwargs))
+
+    report = {
+        'meta': dict(environment(), market=args.market, symbols=args.symbols, days=args.days, rows=n_rows,
+                     limit_up_rate=args.limit_up_rate, pingpong_rate=args.pingpong_rate, seed=args.seed,
+                     repeat=args.repeat, engine=engine_kwargs),
+        'results': results,
+    }
+    baseline = None
+    if args.compare:
+        with open(args.compare, encoding="utf-8") as f:
+            baseline = json.load(f)
+    print_results(results, baseline)
+
+    output = args.output
+    if output is None:
+        os.makedirs(RESULTS_DIR, exist_ok=True)
+        output = os.path.join(RESULTS_DIR, f"{args.market}_{time.strftime('%Y%m%d_%H%M%S')}.json")
+    with open(output, "w", encoding="utf-8") as f:
+        json.dump(report, f, ensure_ascii=False, indent=2)
+    print(f"💾 結果已寫入 {output}")
+    return report
+
+
+if __name__ == "__main__":
+    main()
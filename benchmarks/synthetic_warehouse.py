@@ -0,0 +1,120 @@
+# -*- coding: utf-8 -*-
+import os
+import sqlite3
+import numpy as np
+import pandas as pd
+
+# ==========================================
+# 各市場代號樣式與漲停幅度
+# ==========================================
+# 每個市場：[(板別, 權重, 代號產生器, 漲停幅度, MarketType)]；代號產生器接收序號回傳 symbol
+MARKET_PROFILES = {
+    'CN': [
+        ('滬主板', 0.35, lambda i: f"60{i:04d}.SS", 0.10, '主板'),
+        ('深主板', 0.30, lambda i: f"00{i:04d}.SZ", 0.10, '主板'),
+        ('創業板', 0.20, lambda i: f"30{i:04d}.SZ", 0.20, '創業板'),
+        ('科創板', 0.15, lambda i: f"68{i:04d}.SS", 0.20, '科創板'),
+    ],
+    'TW': [
+        ('上市', 0.55, lambda i: f"{1101 + i}.TW", 0.10, '上市'),
+        ('上櫃', 0.30, lambda i: f"{3101 + i}.TWO", 0.10, '上櫃'),
+        ('ETF', 0.10, lambda i: f"00{50 + i:02d}.TW", 0.10, 'ETF'),
+        ('興櫃', 0.05, lambda i: f"{6501 + i}.TWO", 0.10, '興櫃'),
+    ],
+    'US': [('NASDAQ', 1.0, lambda i: f"SYN{i:05d}", 0.10, 'NASDAQ')],
+    'JP': [('東證', 1.0, lambda i: f"{1301 + i}.T", 0.08, '東證')],
+    'KR': [('KOSPI', 1.0, lambda i: f"{5930 + i:06d}.KS", 0.30, 'KOSPI')],
+    'HK': [('主板', 1.0, lambda i: f"{1 + i:04d}.HK", 0.10, '主板')],
+}
+SECTORS = ['半導體', '電子零組件', '生技醫療', '金融', '航運', '鋼鐵', '汽車', '軟體服務', '能源', '食品']
+
+
+def _symbols(market, n_symbols):
+    """ 依板別權重分配代號，回傳 (symbols, 漲停幅度陣列, MarketType 陣列) """
+    profile = MARKET_PROFILES[market]
+    weights = np.array([p[1] for p in profile])
+    counts = np.floor(weights / weights.sum() * n_symbols).astype(int)
+    counts[0] += n_symbols - counts.sum()
+    symbols, limits, boards = [], [], []
+    for (_, _, make_id, limit, board), n in zip(profile, counts):
+        symbols += [make_id(i) for i in range(n)]
+        limits += [limit] * n
+        boards += [board] * n
+    return symbols, np.array(limits), boards
+
+
+def build_warehouse(path, market="CN", n_symbols=500, n_days=750, start_date="2023-01-02",
+                    limit_up_rate=0.03, streak_rate=0.35, pingpong_rate=0.0002, seed=42):
+    """
+    建立合成的 stock_prices / stock_info 倉庫 (欄位與雲端 .db 相同)。
+    1. 每檔隨機延後上市日，模擬新股與長短不一的歷史。
+    2. 每日以 limit_up_rate 機率漲停 (幅度依板別)，前一日漲停時以 streak_rate 機率續板；半數漲停收在最高。
+    3. 以 pingpong_rate 機率注入單日收盤翻倍的乒乓異常 (次日回落)，供清洗器剔除。
+    回傳 stock_prices 的列數。
+    """
+    market = market.upper()
+    rng = np.random.default_rng(seed)
+    symbols, limits, boards = _symbols(market, n_symbols)
+    n_symbols = len(symbols)
+    dates = pd.bdate_range(start_date, periods=n_days)
+
+    # 逐日向量化產生報酬 (每天一次處理所有股票)
+    rets = rng.normal(0.0003, 0.022, size=(n_days, n_symbols))
+    limit_hits = np.zeros((n_days, n_symbols), dtype=bool)
+    prev_hit = np.zeros(n_symbols, dtype=bool)
+    for d in range(n_days):
+        p = np.where(prev_hit, streak_rate, limit_up_rate)
+        hit = rng.random(n_symbols) < p
+        limit_hits[d] = hit
+        prev_hit = hit
+    rets = np.where(limit_hits, limits, np.clip(rets, -limits, limits * 0.9))
+
+    base = rng.uniform(5, 300, size=n_symbols)
+    close = base * np.cumprod(1 + rets, axis=0)
+    prev_close = np.vstack([base, close[:-1]])
+    open_ = prev_close * (1 + rng.normal(0, 0.01, size=close.shape))
+    high = np.maximum(open_, close) * (1 + np.abs(rng.normal(0, 0.01, size=close.shape)))
+    low = np.minimum(open_, close) * (1 - np.abs(rng.normal(0, 0.01, size=close.shape)))
+    # 半數漲停收在最高 (日本規則需要 收盤 == 最高)
+    at_high = limit_hits & (rng.random(close.shape) < 0.5)
+    high = np.where(at_high, close, high)
+
+    # 乒乓異常：收盤翻倍一天 (當日 +100%、次日 -50%)
+    spikes = rng.random(close.shape) < pingpong_rate
+    spikes[-1] = False
+    close = np.where(spikes, close * 2.0, close)
+    high = np.maximum(high, close)
+
+    volume = rng.integers(1_000, 5_000_000, size=close.shape)
+
+    # 上市日：約三成股票在區間內才上市
+    listed_from = np.where(rng.random(n_symbols) < 0.3, rng.integers(0, max(1, n_days // 2), n_symbols), 0)
+    listed = np.arange(n_days)[:, None] >= listed_from[None, :]
+
+    day_idx, sym_idx = np.nonzero(listed)
+    prices = pd.DataFrame({
+        'date': dates.strftime('%Y-%m-%d')[day_idx],
+        'symbol': np.array(symbols, dtype=object)[sym_idx],
+        'open': open_[day_idx, sym_idx].round(2),
+        'high': high[day_idx, sym_idx].round(2),
+        'low': low[day_idx, sym_idx].round(2),
+        'close': close[day_idx, sym_idx].round(2),
+        'volume': volume[day_idx, sym_idx],
+    })
+    info = pd.DataFrame({
+        'symbol': symbols,
+        'name': [f"合成{market}{i:05d}" for i in range(n_symbols)],
+        'sector': [SECTORS[i % len(SECTORS)] for i in range(n_symbols)],
+        'market': boards,
+    })
+
+    if os.path.exists(path):
+        os.remove(path)
+    conn = sqlite3.connect(path)
+    try:
+        prices.to_sql('stock_prices', conn, index=False, chunksize=100_000)
+        info.to_sql('stock_info', conn, index=False)
+        conn.commit()
+    finally:
+        conn.close()
+    return len(prices)
@@ -0,0 +1,145 @@
+# -*- coding: utf-8 -*-
+"""
+SQL 精煉路徑與 pandas 路徑的逐欄比對 (不需雲端 .db)：
+
+    python -m benchmarks.verify_sql_backend --market TW
+    python -m benchmarks.verify_sql_backend --market CN --db my_warehouse.db
+
+流程：同一倉庫各複製一份 -> 分別以 backend="pandas" / "sql" 完整精煉 ->
+cleaned_daily_base 逐欄比對 (整數/文字須完全相同，浮點容許 --rtol / --atol 的誤差)，
+清洗明細、族群日報、個股行為統計、最新快照整表比對。任一項不符時以非零代碼結束。
+"""
+import argparse
+import contextlib
+import io
+import os
+import shutil
+import sqlite3
+import sys
+import tempfile
+import time
+
+import numpy as np
+import pandas as pd
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if ROOT not in sys.path:
+    sys.path.insert(0, ROOT)
+
+from core_engine import AlphaCoreEngine
+from market_rules import MarketRuleRouter
+from benchmarks.run_benchmark import warehouse_path
+
+SIDE_TABLES = ['cleaning_audit', 'sector_daily', 'stock_behavior_stats', 'cleaned_latest']
+
+
+def refine(db_path, work_db, market, backend):
+    """ 在倉庫副本上執行引擎，回傳 (耗時秒數, 摘要訊息) """
+    shutil.copy(db_path, work_db)
+    conn = sqlite3.connect(work_db)
+    try:
+        engine = AlphaCoreEngine(conn, MarketRuleRouter.get_rules(market), market, backend=backend)
+        wall = time.perf_counter()
+        with contextlib.redirect_stdout(io.StringIO()):
+            msg = engine.execute()
+        return time.perf_counter() - wall, msg
+    finally:
+        conn.close()
+
+# ==========================================
+# 比對
+# ==========================================
+def compare_columns(expected, actual, rtol, atol):
+    """ 回傳 [(欄位, 結果說明)]；結果以 OK / CLOSE 開頭者視為一致 """
+    report = []
+    missing = [c for c in expected.columns if c not in actual.columns]
+    extra = [c for c in actual.columns if c not in expected.columns]
+    for c in missing:
+        report.append((c, "DIFF 欄位缺少"))
+    for c in extra:
+        report.append((c, "DIFF 多出欄位"))
+    for c in expected.columns:
+        if c in missing:
+            continue
+        u, v = expected[c], actual[c]
+        both_na = (u.isna() & v.isna()).to_numpy()
+        if u.dtype.kind == 'f' or v.dtype.kind == 'f':
+            u, v = u.astype(float).to_numpy(), v.astype(float).to_numpy()
+            if ((u == v) | both_na).all():
+                report.append((c, "OK"))
+            elif np.allclose(u, v, rtol=rtol, atol=atol, equal_nan=True):
+                report.append((c, f"CLOSE 最大誤差 {np.nanmax(np.abs(u - v)):.1e}"))
+            else:
+                n_diff = (~np.isclose(u, v, rtol=rtol, atol=atol, equal_nan=True)).sum()
+                report.append((c, f"DIFF {n_diff:,} 列"))
+        else:
+            same = ((u == v).to_numpy() | both_na).all()
+            report.append((c, "OK" if same else f"DIFF {int((~((u == v).to_numpy() | both_na)).sum()):,} 列"))
+    return report
+
+
+def compare_tables(conn_a, conn_b, table, rtol, atol):
+    exists = "SELECT 1 FROM sqlite_master WHERE type='table' AND name=?"
+    has_a, has_b = conn_a.execute(exists, (table,)).fetchone(), conn_b.execute(exists, (table,)).fetchone()
+    if not has_a and not has_b:
+        return "OK (兩邊皆無)"
+    if not has_a or not has_b:
+        return "DIFF 只有一邊有此表"
+    a, b = pd.read_sql(f"SELECT * FROM [{table}]", conn_a), pd.read_sql(f"SELECT * FROM [{table}]", conn_b)
+    try:
+        pd.testing.assert_frame_equal(a, b, check_dtype=False, rtol=rtol, atol=atol)
+    except AssertionError as e:
+        return f"DIFF {str(e).splitlines()[0]}"
+    return "OK"
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="SQL 精煉路徑逐欄驗證")
+    parser.add_argument("--market", default="CN", choices=["CN", "TW", "US", "JP", "KR", "HK"])
+    parser.add_argument("--db", default=None, help="要驗證的倉庫 .db (預設使用合成倉庫)")
+    parser.add_argument("--symbols", type=int, default=250)
+    parser.add_argument("--days", type=int, default=750)
+    parser.add_argument("--limit-up-rate", type=float, default=0.03)
+    parser.add_argument("--pingpong-rate", type=float, default=0.0002)
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--rtol", type=float, default=1e-9, help="浮點欄位容許的相對誤差")
+    # 接近全平的窗口 (例如連續漲停) 波動率趨近 0，平方和公式的抵銷誤差約 1e-11
+    parser.add_argument("--atol", type=float, default=1e-9, help="浮點欄位容許的絕對誤差")
+    args = parser.parse_args(argv)
+    args.market = args.market.upper()
+
+    db_path = args.db or warehouse_path(args)
+    with tempfile.TemporaryDirectory() as tmp:
+        db_pandas, db_sql = os.path.join(tmp, "pandas.db"), os.path.join(tmp, "sql.db")
+        t_pandas, _ = refine(db_path, db_pandas, args.market, "pandas")
+        t_sql, _ = refine(db_path, db_sql, args.market, "sql")
+        print(f"⏱️ pandas {t_pandas:.2f}s / sql {t_sql:.2f}s")
+
+        conn_a, conn_b = sqlite3.connect(db_pandas), sqlite3.connect(db_sql)
+        try:
+            schema = "SELECT sql FROM sqlite_master WHERE name='cleaned_daily_base'"
+            same_schema = conn_a.execute(schema).fetchone() == conn_b.execute(schema).fetchone()
+            expected = pd.read_sql("SELECT * FROM cleaned_daily_base", conn_a)
+            actual = pd.read_sql("SELECT * FROM cleaned_daily_base", conn_b)
+            print(f"📋 cleaned_daily_base：pandas {len(expected):,} 列 / sql {len(actual):,} 列，"
+                  f"結構{'相同' if same_schema else '不同'}")
+            ok = same_schema and len(expected) == len(actual)
+            if len(expected) == len(actual):
+                for col, result in compare_columns(expected, actual, args.rtol, args.atol):
+                    if not result.startswith("OK"):
+                        print(f"   {col:<28}{result}")
+                    ok &= not result.startswith("DIFF")
+            for table in SIDE_TABLES:
+                result = compare_tables(conn_a, conn_b, table, args.rtol, args.atol)
+                print(f"   {table:<28}{result}")
+                ok &= not result.startswith("DIFF")
+        finally:
+            conn_a.close()
+            conn_b.close()
+
+    print("✅ SQL 路徑與 pandas 路徑一致" if ok else "❌ SQL 路徑與 pandas 路徑不一致")
+    return 0 if ok else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,108 @@
+# -*- coding: utf-8 -*-
+import os
+import shutil
+import pandas as pd
+
+# pyarrow 為選用套件：未安裝時精煉流程照常執行，只是不輸出列式副本
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+    HAS_PYARROW = True
+except ImportError:
+    pa = pq = None
+    HAS_PYARROW = False
+
+DATE_COLS = ('日期', 'Seq_LU_Start')  # 以 TEXT 存在 SQLite 的日期欄位，輸出時轉為 timestamp
+ROW_GROUP_SIZE = 131072  # 依日期排序寫入，每個 row group 的 min/max 統計可用來跳過不相關日期
+READ_CHUNK_ROWS = 200000  # 自 SQLite 串流讀取的批次大小，避免整年載入記憶體
+
+# ==========================================
+# 列式副本輸出 (market=XX/year=YYYY 分區 Parquet)
+# ==========================================
+def _arrow_schema(conn, table):
+    """ 依 SQLite 宣告型別建立固定 schema，確保各批次/各年份檔案型別一致 """
+    fields = []
+    for _, name, decl, *_ in conn.execute(f"PRAGMA table_info([{table}])").fetchall():
+        decl = (decl or "").upper()
+        if name in DATE_COLS:
+            typ = pa.timestamp('ms')
+        elif decl == "INTEGER":
+            typ = pa.int64()
+        elif decl == "REAL":
+            typ = pa.float64()
+        else:
+            typ = pa.string()
+        fields.append(pa.field(name, typ))
+    return pa.schema(fields)
+
+
+def export_columnar(conn, root, market, since=None, table="cleaned_daily_base", compression="zstd"):
+    """
+    將精煉表輸出為 root/market=XX/year=YYYY/part-0.parquet。
+    1. since 未指定：清空該市場分區後全部重寫。
+    2. since 指定 (增量模式)：只重寫 since 所在年份及之後的年份。
+    每個年份先寫入暫存檔再原子替換；回傳寫出的列數，未安裝 pyarrow 而略過時回傳 None (與「0 筆」區分)。
+    """
+    if not HAS_PYARROW:
+        print(f"⚠️ 未安裝 pyarrow，略過列式副本輸出 ({root} 未更新；pip install pyarrow)")
+        return None
+
+    market_dir = os.path.join(root, f"market={market.upper()}")
+    if since is None and os.path.isdir(market_dir):
+        shutil.rmtree(market_dir)
+    first_year = int(str(since)[:4]) if since else None
+
+    years = [int(y) for (y,) in conn.execute(
+        f"SELECT DISTINCT substr(日期, 1, 4) FROM [{table}] ORDER BY 1").fetchall() if y]
+    schema = _arrow_schema(conn, table)
+    total = 0
+    for year in years:
+        if first_year and year < first_year:
+            continue
+        year_dir = os.path.join(market_dir, f"year={year}")
+        os.makedirs(year_dir, exist_ok=True)
+        target = os.path.join(year_dir, "part-0.parquet")
+        tmp_path = target + ".tmp"
+
+        writer = pq.ParquetWriter(tmp_path, schema, compression=compression, write_statistics=True)
+        try:
+            chunks = pd.read_sql(
+                f"SELECT * FROM [{table}] WHERE 日期 >= ? AND 日期 < ? ORDER BY 日期, StockID",
+                conn, params=(f"{year}-01-01", f"{year + 1}-01-01"), chunksize=READ_CHUNK_ROWS)
+            for chunk in chunks:
+                for col in DATE_COLS:
+                    if col in chunk.columns:
+                        chunk[col] = pd.to_datetime(chunk[col], errors='coerce')
+                writer.write_table(pa.Table.from_pandas(chunk, schema=schema, preserve_index=False),
+                                   row_group_size=ROW_GROUP_SIZE)
+                total += len(chunk)
+        finally:
+            writer.close()
+        os.replace(tmp_path, target)
+    return total
+
+# ==========================================
+# 列式副本讀取 (欄位裁剪 + 日期範圍 + memory map)
+# ==========================================
+def read_columnar(root, market, columns=None, start=None, end=None):
+    """
+    讀取列式副本，只載入指定欄位與日期區間 (含頭尾)。
+    分區欄位 (market/year) 先裁掉不相關的檔案，row group 統計再跳過不相關日期；
+    檔案以 memory map 開啟，不需先整份複製進記憶體。
+    """
+    if not HAS_PYARROW:
+        raise ImportError("read_columnar 需要 pyarrow：pip install pyarrow")
+
+    filters = [('market', '=', market.upper())]
+    if start is not None:
+        start = pd.Timestamp(start)
+        filters += [('year', '>=', start.year), ('日期', '>=', start)]
+    if end is not None:
+        end = pd.Timestamp(end)
+        filters += [('year', '<=', end.year), ('日期', '<=', end)]
+    if columns is not None:
+        columns = list(dict.fromkeys(columns))
+
+    table = pq.read_table(root, columns=columns, filters=filters, memory_map=True,
+                          partitioning="hive")
+    return table.to_pandas()
@@ -3,169 +3,781 @@ import pandas as pd
 import numpy as np
 import sqlite3
 import os
+from concurrent.futures import ProcessPoolExecutor
+from rolling_kernels import SegmentedRolling
+from db_writer import BulkTableWriter
+from columnar_store import export_columnar
+from metric_registry import METRICS
+from stage_profiler import StageProfiler
+from sql_backend import SqlWindowRefiner
 
 # ==========================================
-# 1. 市場規則路由類別 (整合至此避免匯入錯誤)
-# ==========================================
-class MarketRuleRouter:
-    def __init__(self, market_type="TW"):
-        self.market_type = market_type.upper()
-        self.PINGPONG_THRESHOLD = 0.40  # 40% 門檻，僅剔除異常數據，不傷及漲停板
-
-    @classmethod
-    def get_rules(cls, market_abbr):
-        return cls(market_type=market_abbr)
-
-    def apply(self, df):
-        if df.empty: return df
-        df = df.sort_values(['StockID', '日期']).reset_index(drop=True)
-        
-        # 建立前日收盤
-        df['Prev_Close'] = df.groupby('StockID')['收盤'].shift(1)
-
-        # 執行乒乓異常數據清洗 (確保數據不汙染 AI)
-        df = self._clean_pingpong_data(df)
-
-        # 根據市場應用漲停規則
-        if self.market_type == "TW":
-            return self._apply_taiwan_rules(df)
-        elif self.market_type == "US":
-            return self._apply_us_rules(df)
-        elif self.market_type == "CN":
-            return self._apply_china_rules(df)
-        elif self.market_type == "KR":
-            return self._apply_korea_rules(df)
-        elif self.market_type == "JP":
-            return self._apply_japan_rules(df)
-        else:
-            return self._apply_generic_rules(df)
-
-    def _clean_pingpong_data(self, df):
-        df['temp_ret'] = (df['收盤'] / df['Prev_Close']) - 1
-        prev_ret = df['temp_ret']
-        next_ret = df.groupby('StockID')['temp_ret'].shift(-1)
-        mask_pingpong = (prev_ret.abs() > self.PINGPONG_THRESHOLD) & \
-                        (next_ret.abs() > self.PINGPONG_THRESHOLD) & \
-                        (prev_ret * next_ret < 0)
-        df = df[~mask_pingpong].copy()
-        df.drop(columns=['temp_ret'], inplace=True)
-        return df
-
-    def _apply_taiwan_rules(self, df):
-        is_etf = df['StockID'].str.startswith('00')
-        is_rotc = df['MarketType'].isin(['興櫃', 'ROTC']) if 'MarketType' in df.columns else False
-        df['is_limit_up'] = 0
-        mask_lu = (~is_etf) & (~is_rotc) & (df['收盤'] >= df['Prev_Close'] * 1.095)
-        df.loc[mask_lu, 'is_limit_up'] = 1
-        df['failed_lu_threshold'] = 0.095
-        return df
-
-    def _apply_us_rules(self, df):
-        df['is_limit_up'] = ((df['收盤'] / df['Prev_Close'] - 1) >= 0.098).astype(int)
-        df['failed_lu_threshold'] = 0.095
-        return df
-
-    def _apply_china_rules(self, df):
-        is_20pct = df['StockID'].str.startswith(('30', '68'))
-        df['is_limit_up'] = 0
-        mask_20 = is_20pct & (df['收盤'] >= df['Prev_Close'] * 1.195)
-        mask_10 = (~is_20pct) & (df['收盤'] >= df['Prev_Close'] * 1.095)
-        df.loc[mask_20 | mask_10, 'is_limit_up'] = 1
-        df['failed_lu_threshold'] = 0.095
-        df.loc[is_20pct, 'failed_lu_threshold'] = 0.195
-        return df
-
-    def _apply_japan_rules(self, df):
-        df['is_limit_up'] = ((df['收盤'] / df['Prev_Close'] - 1 >= 0.08) & (df['收盤'] == df['最高'])).astype(int)
-        df['failed_lu_threshold'] = 0.075
-        return df
-
-    def _apply_korea_rules(self, df):
-        df['is_limit_up'] = (df['收盤'] >= df['Prev_Close'] * 1.295).astype(int)
-        df['failed_lu_threshold'] = 0.295
-        return df
-
-    def _apply_generic_rules(self, df):
-        df['is_limit_up'] = ((df['收盤'] / df['Prev_Close'] - 1) >= 0.095).astype(int)
-        df['failed_lu_threshold'] = 0.095
-        return df
-
-# ==========================================
-# 2. 核心精煉引擎類別
+# 核心精煉引擎類別
 # ==========================================
 class AlphaCoreEngine:
-    def __init__(self, conn, rules, market_abbr):
+    START_DATE = '2023-01-01'     # 原始數據讀取起點
+    LOOKBACK_DAYS = METRICS.lookback()    # 註冊表中最長的回看鏈 (目前為年初至今漲跌幅)
+    LOOKBACK_BUFFER = 10                  # 額外緩衝，吸收乒乓清洗剔除的列
+    FORWARD_HORIZON = METRICS.forward()   # 前瞻欄位 (Next_*) 需回補的列數 (目前為 Next_10D_Ret)
+    # 各股改寫列數：最後幾列在下一筆數據進來後才能判定是否為乒乓異常，剔除後其前 FORWARD_HORIZON 列的前瞻欄位跟著移位
+    REWRITE_ROWS = max(FORWARD_HORIZON, 1) + LOOKBACK_BUFFER
+    # 增量/指定範圍重跑的各股窗口 (以各股自己的加工列計算)，放在附加的記憶體資料庫，不寫入 .db
+    WINDOWS_DB = "refine_plan"
+    WINDOWS_TABLE = "refine_plan.windows"
+    IDLE_DATE = '9999-12-31'      # 增量模式：沒有新數據的股票 (停牌、下市) 窗口設為此日，不讀也不改寫
+    BYTES_PER_ROW = 2048          # 串流模式估算：精煉過程每列的峰值記憶體 (含排序/清洗副本)
+    # 儀表板查詢模式對應的索引 {表: [(名稱, 欄位)]}；缺少欄位的索引自動略過
+    MANAGED_INDEXES = {
+        'cleaned_daily_base': [
+            ('idx_cleaned_stock_date', ('StockID', '日期')),      # 個股歷史 / Deep_Scan 統計
+            ('idx_cleaned_date_lu', ('日期', 'is_limit_up')),     # MAX(日期) 與當日漲停篩選
+        ],
+        'stock_info': [
+            ('idx_info_symbol', ('symbol', 'name', 'sector', 'market')),  # 覆蓋名稱/產業關聯查詢
+            ('idx_info_sector', ('sector', 'symbol', 'name')),            # 同產業聯動
+        ],
+        'stock_prices': [
+            ('idx_prices_date', ('date',)),  # MAX(date) 與增量模式的交易日查詢
+        ],
+        'cleaned_latest': [
+            ('idx_latest_stock', ('StockID',)),
+        ],
+        'sector_daily': [
+            ('idx_sector_daily_date', ('日期', 'Sector')),  # 當日產業視圖與多日產業趨勢
+        ],
+    }
+    ANALYSIS_LIMIT = 1000  # ANALYZE 每個索引的取樣列數上限，避免大表全掃
+
+    # 個股股性統計 (stock_behavior_stats) 的可加總欄位；平均值由加總/個數推導，方便增量更新
+    # 炸板 = 盤中最高觸及該列的炸板門檻 (failed_lu_threshold 依市場/板別) 但收盤未漲停
+    BEHAVIOR_AGGREGATES_SQL = """
+        SELECT StockID,
+               COUNT(*) AS trading_days,
+               SUM(is_limit_up) AS lu_count,
+               SUM(CASE WHEN is_limit_up = 0 AND Ret_High > failed_lu_threshold THEN 1 ELSE 0 END) AS failed_lu_count,
+               SUM(CASE WHEN Prev_LU = 0 AND is_limit_up = 0 AND Ret_High > failed_lu_threshold THEN 1 ELSE 0 END) AS failed_first_lu_count,
+               SUM(CASE WHEN Prev_LU = 1 THEN 1 ELSE 0 END) AS post_lu_days,
+               SUM(CASE WHEN Prev_LU = 1 AND Ret_Day < 0 THEN 1 ELSE 0 END) AS post_lu_loss_days,
+               TOTAL(CASE WHEN Prev_LU = 1 THEN Overnight_Alpha END) AS post_lu_overnight_sum,
+               COUNT(CASE WHEN Prev_LU = 1 THEN Overnight_Alpha END) AS post_lu_overnight_n,
+               TOTAL(CASE WHEN Prev_LU = 1 THEN Next_1D_Max END) AS post_lu_next_max_sum,
+               COUNT(CASE WHEN Prev_LU = 1 THEN Next_1D_Max END) AS post_lu_next_max_n,
+               MAX(Max_Seq_LU_Count) AS max_streak,
+               MAX(日期) AS last_date
+        FROM cleaned_daily_base {where}
+        GROUP BY StockID
+    """
+
+    # 每日產業彙總 (sector_daily)：每個交易日 x 產業一列
+    SECTOR_DAILY_SQL = """
+        SELECT p.日期 AS 日期, {sector_sql} AS Sector,
+               COUNT(*) AS stock_count,
+               SUM(p.is_limit_up) AS lu_count,
+               AVG(CASE WHEN p.is_limit_up = 1 THEN p.Seq_LU_Count END) AS avg_seq_lu,
+               SUM(CASE WHEN p.Ret_Day >= 0.1 THEN 1 ELSE 0 END) AS strong_count,
+               AVG(p.Ret_Day) AS avg_ret_day,
+               AVG(p.volatility_20d) AS avg_volatility_20d,
+               AVG(p.drawdown_after_high_20d) AS avg_drawdown_20d,
+               AVG(CASE WHEN p.Ret_Day > 0 THEN 1.0 WHEN p.Ret_Day <= 0 THEN 0.0 END) AS breadth
+        FROM cleaned_daily_base p {join_sql} {where}
+        GROUP BY p.日期, {sector_sql}
+    """
+    # 精簡型別模式只做無損轉型 (寫入的數值與預設模式相同)；float64 比率不降為 float32，
+    # 否則 0.1 會以 0.10000000149 寫進 cleaned_daily_base (SQLite REAL 一律 8 bytes，也不會省空間)
+    CATEGORY_COLS = ['StockID', 'MarketType']
+    FLAG_COLS = ['is_limit_up', 'Prev_LU']
+    COUNT_COLS = ['Seq_LU_Count', 'Max_Seq_LU_Count']
+
+    def __init__(self, conn, rules, market_abbr, incremental=False, memory_budget_mb=None, workers=1,
+                 compact=False, columnar_dir=None, metrics=None, start_date=None, end_date=None, symbols=None,
+                 backend="pandas"):
+        if metrics is not None:
+            if incremental:
+                raise ValueError("增量模式會改寫整列，需計算全部衍生欄位 (metrics=None)")
+            METRICS.resolve(metrics) # 提早檢查欄位名稱是否已註冊
+        if incremental and (start_date or end_date):
+            raise ValueError("增量模式自動決定改寫起點，不能同時指定 start_date / end_date")
+        if backend not in ("pandas", "sql"):
+            raise ValueError(f"未知的精煉路徑：{backend} (可用 pandas / sql)")
+        if backend == "sql" and (metrics is not None or compact or memory_budget_mb or (workers or 1) > 1):
+            raise ValueError("SQL 路徑在資料庫內一次完成，不支援 metrics / compact / memory_budget_mb / workers")
+        start_date = str(pd.Timestamp(start_date).date()) if start_date else None
+        end_date = str(pd.Timestamp(end_date).date()) if end_date else None
+        if start_date and end_date and start_date > end_date:
+            raise ValueError(f"start_date ({start_date}) 晚於 end_date ({end_date})")
         self.conn = conn
-        self.rules = rules # 傳入上面的 MarketRuleRouter 物件
+        self.rules = rules # 傳入 market_rules.MarketRuleRouter 物件
         self.market_abbr = market_abbr.upper()
+        self.incremental = incremental
+        self.memory_budget_mb = memory_budget_mb # 設定後改為依股票代號分批串流精煉
+        self.workers = max(1, int(workers or 1)) # > 1 時依 StockID 分片平行精煉
+        self.compact = compact # 類別/int8/int16 精簡型別 (無損)，降低峰值記憶體
+        self.dtype_report = {} # {欄位: [原位元組, 精簡後位元組]}，跨批累加
+        self.cleaning_audit = [] # 乒乓清洗剔除明細 (每批/每分片一個 DataFrame)
+        self.columnar_dir = columnar_dir # 設定後另輸出 market/year 分區的 Parquet 列式副本 (需 pyarrow)
+        self.metrics = metrics # 只計算指定的衍生欄位 (含相依欄位)，既有加工表只更新這些欄位；None = 註冊表全部
+        # 指定重跑範圍：只讀取 (含回看/前瞻緩衝) 並改寫 [start_date, end_date] x symbols 的列
+        self.start_date = start_date
+        self.end_date = end_date # 之後的列不改寫；修正會影響其後的回看欄位 (例如 Ret_20D) 時請留空
+        self.symbols = sorted(set(symbols)) if symbols else None
+        self.backend = backend # "sql" = 以 SQLite 視窗函數在資料庫內精煉 (sql_backend.SqlWindowRefiner)
+        self.profiler = StageProfiler() # 各階段的牆鐘/CPU/峰值記憶體/列數
+        self._pool = None
+        self._windows = False           # 已建立各股窗口表 (refine_plan.windows)
+        self._stock_write_from = None   # 各股改寫起點 {StockID: 'YYYY-MM-DD'}；None = 全部股票共用 write_from
+        self._write_floor = None        # 各股改寫起點中最早的一天 (改寫範圍查詢的索引下限)
         self.df = None
 
     def execute(self):
-        print(f"--- 🚀 啟動 {self.market_abbr} 數據精煉 (完整功能版) ---")
-        
-        # 讀取原始數據
-        query = "SELECT date as 日期, symbol as StockID, open as 開盤, high as 最高, low as 最低, close as 收盤, volume as 成交量 FROM stock_prices WHERE date >= '2023-01-01'"
-        self.df = pd.read_sql(query, self.conn)
-        if self.df.empty: return "Error: No data"
+        try:
+            return self._execute()
+        finally:
+            self._drop_windows()
+
+    def _execute(self):
+        # 增量模式：只重讀回看窗口，並只改寫新日期 (含需回補前瞻欄位的列)
+        prof = self.profiler
+        with prof.stage("plan"):
+            plan = self._plan_incremental() if self.incremental else self._plan_rerun()
+            # 以下日期是沒有既有加工列的股票所用的預設值；其餘股票依各自的窗口 (_build_windows)
+            read_from, write_from = plan if plan else (self.START_DATE, None)
+            read_to, write_to = None, self.end_date
+            # 串流模式：依記憶體預算把股票代號切成數個區間，逐批讀取 -> 精煉 -> 寫出
+            chunks = self._plan_chunks(read_from, read_to) if self.memory_budget_mb else [None]
+        scope = self._scope_where(write_from, write_to) # 本次改寫的 cleaned_daily_base 範圍
+        scope_label = f"{write_from or '最早'} ~ {write_to or '最新'}"
+        if self.symbols:
+            scope_label += f"，{len(self.symbols)} 檔"
+
+        if self.incremental and plan:
+            mode_label = "增量模式"
+        elif scope:
+            mode_label = f"指定範圍重跑：{scope_label}"
+        else:
+            mode_label = "完整功能版"
+        if self.memory_budget_mb:
+            mode_label += f"，串流 {len(chunks)} 批"
+        if self.workers > 1:
+            mode_label += f"，{self.workers} 行程"
+        if self.compact:
+            mode_label += "，精簡型別"
+        if self.backend == "sql":
+            mode_label += "，SQL 視窗函數"
+        if self.metrics is not None:
+            mode_label += f"，只更新 {len(self.metrics)} 個欄位"
+        print(f"--- 🚀 啟動 {self.market_abbr} 數據精煉 ({mode_label}) ---")
+        with prof.stage("ensure_indexes"):
+            self._ensure_indexes(['stock_prices', 'stock_info'])
+
+        # 增量模式：先記下改寫窗口內的舊統計，寫入後以差額更新股性統計表
+        prior_window = None
+        if self.incremental and plan and self._table_exists('stock_behavior_stats'):
+            with prof.stage("behavior_stats") as rec:
+                prior_window = self._behavior_aggregates(*scope)
+                rec['rows'] = len(prior_window)
+
+        # 完整模式寫入暫存表後原子替換；增量/指定範圍刪除改寫範圍後附加 (同一交易 upsert)；
+        # 只計算部分欄位時依 (StockID, 日期) 只更新這些欄位，其餘欄位與列保持不動
+        if self.metrics is not None and self._table_exists('cleaned_daily_base'):
+            self._ensure_indexes(['cleaned_daily_base'])
+            writer = BulkTableWriter(self.conn, "cleaned_daily_base", mode="update", key=('StockID', '日期'))
+        elif scope and self._table_exists('cleaned_daily_base'):
+            writer = BulkTableWriter(self.conn, "cleaned_daily_base", mode="append", delete_where=scope)
+        else:
+            writer = BulkTableWriter(self.conn, "cleaned_daily_base")
+
+        # 行程池在各批之間共用，避免每批重新啟動子行程
+        if self.workers > 1:
+            self._pool = ProcessPoolExecutor(max_workers=self.workers)
+        try:
+            if self.backend == "sql":
+                loaded_any, written = SqlWindowRefiner(self).run((read_from, read_to), (write_from, write_to), writer)
+            else:
+                loaded_any, written = self._run_chunks(chunks, (read_from, read_to), (write_from, write_to), writer)
+        except Exception:
+            writer.rollback()
+            raise
+        finally:
+            if self._pool is not None:
+                self._pool.shutdown()
+                self._pool = None
+        if not loaded_any:
+            writer.rollback()
+            return "Error: No data"
+        if self.compact:
+            self._print_dtype_report()
+
+        with prof.stage("commit_indexes", rows=written):
+            writer.commit(indexes=self._existing_indexes('cleaned_daily_base', writer.columns))
+        write_floor = self._written_floor(write_from, scope)
+        with prof.stage("cleaning_audit") as rec:
+            rec['rows'] = self._write_cleaning_audit(write_from, write_to, scope)
+        with prof.stage("latest_snapshot"):
+            self._build_latest_snapshot()
+        if self.metrics is None:
+            # 股性/產業彙總依賴完整衍生欄位，只計算部分欄位時略過
+            with prof.stage("behavior_stats"):
+                self._update_behavior_stats(write_from, prior_window)
+            with prof.stage("sector_daily"):
+                self._build_sector_daily(write_floor, write_to)
+        with prof.stage("analyze"):
+            self._analyze()
+        columnar_note = ""
+        if self.columnar_dir:
+            with prof.stage("columnar_export") as rec:
+                exported = export_columnar(self.conn, self.columnar_dir, self.market_abbr, since=write_floor)
+                rec['rows'] = exported or 0
+            if exported is None:
+                # 摘要也要註明，避免被誤認為已輸出 0 筆
+                columnar_note = f"\n⚠️ 未安裝 pyarrow，列式副本未輸出 ({self.columnar_dir})"
+            else:
+                print(f"🗂️ 列式副本已輸出 {exported} 筆至 {self.columnar_dir}")
+        print(prof.format_table())
+        if self.incremental and plan:
+            summary = f"✅ {self.market_abbr} 增量精煉完成，自 {write_floor} 起更新 {written} 筆！"
+        elif writer.mode == "update":
+            summary = f"✅ {self.market_abbr} 指定欄位重算完成 ({', '.join(self.metrics)})，更新 {writer.rows_written} 筆！"
+        elif scope:
+            summary = f"✅ {self.market_abbr} 指定範圍重跑完成 ({scope_label})，改寫 {written} 筆！"
+        else:
+            summary = f"✅ {self.market_abbr} 數據精煉完成，所有欄位已對接！"
+        return summary + columnar_note
+
+    def _run_chunks(self, chunks, read_window, write_window, writer):
+        """ 逐批讀取 -> 精煉 -> 寫出，回傳 (是否讀到資料, 寫出列數) """
+        (read_from, read_to), (write_from, write_to) = read_window, write_window
+        loaded_any, written = False, 0
+        for symbol_range in chunks:
+            self._load_raw_data(read_from, symbol_range, read_to)
+            if self.df.empty: continue
+            loaded_any = True
+            self._refine()
+
+            # 存檔 (只保留改寫範圍；回看/前瞻緩衝列僅供計算)
+            if write_to:
+                self.df = self.df[self.df['日期'] <= pd.Timestamp(f"{write_to} 23:59:59")].reset_index(drop=True)
+            if write_from:
+                with self.profiler.stage("carry_over"):
+                    self.df = self.df[self._write_from_mask(self.df, write_from)].reset_index(drop=True)
+                    self._carry_over_running_stats(write_from, symbol_range)
+            if writer.mode == "update":
+                self.df = self.df[list(writer.key) + [c for c in self.metrics if c not in writer.key]]
+            with self.profiler.stage("format_dates", rows=len(self.df)):
+                self._format_date_columns()
+            with self.profiler.stage("write_sqlite", rows=len(self.df)):
+                writer.write(self.df)
+            written += len(self.df)
+        return loaded_any, written
+
+    def _existing_indexes(self, table, columns):
+        """ 只保留欄位皆存在的索引定義 """
+        return [(name, cols) for name, cols in self.MANAGED_INDEXES[table] if set(cols) <= set(columns)]
+
+    def _ensure_indexes(self, tables):
+        """ 為原始表建立查詢索引 (已存在則略過) """
+        cursor = self.conn.cursor()
+        for table in tables:
+            columns = [c[1] for c in cursor.execute(f"PRAGMA table_info([{table}])").fetchall()]
+            if not columns:
+                continue
+            for name, cols in self._existing_indexes(table, columns):
+                col_sql = ", ".join(f"[{c}]" for c in cols)
+                cursor.execute(f"CREATE INDEX IF NOT EXISTS [{name}] ON [{table}] ({col_sql})")
+        self.conn.commit()
+
+    def _info_join_sql(self):
+        """ 依 stock_info 實際欄位組出 (名稱, 產業, JOIN) 片段；舊版資料庫缺欄位時以 NULL 代替 """
+        info_cols = {c[1] for c in self.conn.execute("PRAGMA table_info(stock_info)").fetchall()}
+        name_sql = "i.name" if 'name' in info_cols else "NULL"
+        sector_sql = "i.sector" if 'sector' in info_cols else "NULL"
+        join_sql = "LEFT JOIN stock_info i ON p.StockID = i.symbol" if 'symbol' in info_cols else ""
+        return name_sql, sector_sql, join_sql
+
+    def _scope_where(self, write_from=None, write_to=None, symbols=True, alias="", by_stock=True):
+        """
+        改寫範圍 -> (SQL 條件, 參數)，適用於含 日期/StockID 欄位的加工表；無任何限制時回傳 None。
+        by_stock=True 時改寫起點依各股窗口 (只以日期為鍵的彙總表如 sector_daily 應傳 False)。
+        """
+        conds, params = [], []
+        if write_from:
+            cond, cond_params = self._write_from_cond(">=", write_from, alias) if by_stock \
+                else (f"{alias}日期 >= ?", [f"{write_from} 00:00:00"])
+            conds.append(cond)
+            params += cond_params
+        if write_to:
+            conds.append(f"{alias}日期 <= ?")
+            params.append(f"{write_to} 23:59:59")
+        if symbols and self.symbols:
+            conds.append(f"{alias}StockID IN ({', '.join('?' * len(self.symbols))})")
+            params += self.symbols
+        return (" AND ".join(conds), tuple(params)) if conds else None
+
+    def _raw_filters(self, read_from, read_to=None, symbol_range=None):
+        """ stock_prices 的讀取條件 (日期區間 + 股票清單/區間 皆下推至 SQL；有各股窗口時逐檔套用) """
+        where, params = "date >= ?", [read_from]
+        if read_to:
+            where += " AND date <= ?"
+            params.append(f"{read_to} 23:59:59")
+        if self._windows:
+            # 窗口表沒有的股票 (新股) 沿用上面的預設區間
+            where += f" AND date >= COALESCE((SELECT read_from FROM {self.WINDOWS_TABLE} WHERE code = symbol), ?)"
+            params.append(read_from)
+            if self.end_date:
+                where += (f" AND date <= COALESCE((SELECT read_to FROM {self.WINDOWS_TABLE} WHERE code = symbol),"
+                          f" '9999-12-31') || ' 23:59:59'")
+        if self.symbols:
+            where += f" AND symbol IN ({', '.join('?' * len(self.symbols))})"
+            params += self.symbols
+        if symbol_range:
+            where += " AND symbol BETWEEN ? AND ?"
+            params += list(symbol_range)
+        return where, params
+
+    def _table_exists(self, table):
+        row = self.conn.execute("SELECT name FROM sqlite_master WHERE type='table' AND name=?", (table,)).fetchone()
+        return row is not None
+
+    def _build_latest_snapshot(self):
+        """ 最新交易日快照 cleaned_latest：每檔一列，預先關聯名稱與產業，供各頁主查詢使用 """
+        cursor = self.conn.cursor()
+        name_sql, sector_sql, join_sql = self._info_join_sql()
+        self.conn.commit()
+        cursor.execute("BEGIN")
+        cursor.execute("DROP TABLE IF EXISTS cleaned_latest")
+        cursor.execute(f"""
+            CREATE TABLE cleaned_latest AS
+            SELECT p.*, {name_sql} AS Name, {sector_sql} AS Sector
+            FROM cleaned_daily_base p {join_sql}
+            WHERE p.日期 = (SELECT MAX(日期) FROM cleaned_daily_base)
+            ORDER BY p.StockID
+        """)
+        for name, cols in self.MANAGED_INDEXES['cleaned_latest']:
+            cursor.execute(f"CREATE INDEX [{name}] ON cleaned_latest ({', '.join(f'[{c}]' for c in cols)})")
+        self.conn.commit()
+
+    def _build_sector_daily(self, write_from=None, write_to=None):
+        """
+        每日產業彙總 sector_daily：漲停家數、平均連板、平均漲跌、平均波動/回撤與上漲家數比 (breadth)。
+        完整模式整表重建；增量/指定範圍只刪除並重算改寫窗口內的交易日 (該日所有股票)。
+        """
+        cursor = self.conn.cursor()
+        _, sector_sql, join_sql = self._info_join_sql()
+        scope = self._scope_where(write_from, write_to, symbols=False, by_stock=False)
+        incremental = scope is not None and self._table_exists('sector_daily')
+        where, params = self._scope_where(write_from, write_to, symbols=False, alias="p.",
+                                          by_stock=False) if incremental else ("", ())
+        select_sql = self.SECTOR_DAILY_SQL.format(sector_sql=sector_sql, join_sql=join_sql,
+                                                  where=f"WHERE {where}" if where else "")
+        self.conn.commit()
+        cursor.execute("BEGIN")
+        if incremental:
+            cursor.execute(f"DELETE FROM sector_daily WHERE {scope[0]}", scope[1])
+            cursor.execute(f"INSERT INTO sector_daily {select_sql}", params)
+        else:
+            cursor.execute("DROP TABLE IF EXISTS sector_daily")
+            cursor.execute(f"CREATE TABLE sector_daily AS {select_sql}")
+            for name, cols in self.MANAGED_INDEXES['sector_daily']:
+                cursor.execute(f"CREATE INDEX [{name}] ON sector_daily ({', '.join(f'[{c}]' for c in cols)})")
+        self.conn.commit()
+
+    def _behavior_aggregates(self, where=None, params=()):
+        """ 依 StockID 彙總可加總的股性欄位 (where 指定時只彙總該範圍) """
+        sql = self.BEHAVIOR_AGGREGATES_SQL.format(where=f"WHERE {where}" if where else "")
+        return pd.read_sql(sql, self.conn, params=params).set_index('StockID')
+
+    def _update_behavior_stats(self, write_from, prior_window):
+        """
+        維護 stock_behavior_stats (每檔一列，主鍵 StockID)：
+        完整模式整表重算；增量模式 = 既有統計 - 窗口舊值 + 窗口新值；
+        指定股票重跑時只重算這些股票的整段歷史 (上游修正後最長連板也可能下修)。
+        """
+        if prior_window is None and self.symbols and self._table_exists('stock_behavior_stats'):
+            stats = pd.read_sql("SELECT * FROM stock_behavior_stats", self.conn).set_index('StockID')
+            rerun = self._behavior_aggregates(*self._scope_where(symbols=True))
+            stats = pd.concat([stats.drop(index=self.symbols, errors='ignore'), rerun]).sort_index()
+            stats.index.name = 'StockID'
+        elif prior_window is None:
+            stats = self._behavior_aggregates()
+        else:
+            stats = pd.read_sql("SELECT * FROM stock_behavior_stats", self.conn).set_index('StockID')
+            new_window = self._behavior_aggregates(*self._scope_where(write_from))
+            additive = [c for c in new_window.columns if c not in ('max_streak', 'last_date')]
+            stats = stats.reindex(stats.index.union(new_window.index))
+            delta = new_window[additive].sub(prior_window[additive], fill_value=0)
+            stats[additive] = stats[additive].fillna(0).add(delta, fill_value=0)
+            # 最長連板已是「至今」累計值，取較大者即可
+            stats['max_streak'] = np.fmax(stats['max_streak'], new_window['max_streak'].reindex(stats.index))
+            stats['last_date'] = new_window['last_date'].reindex(stats.index).fillna(stats['last_date'])
+
+        stats['avg_overnight_after_lu'] = stats['post_lu_overnight_sum'] / stats['post_lu_overnight_n'].replace(0, np.nan)
+        stats['avg_next_max_after_lu'] = stats['post_lu_next_max_sum'] / stats['post_lu_next_max_n'].replace(0, np.nan)
+        stats['next_day_loss_rate'] = stats['post_lu_loss_days'] / stats['post_lu_days'].replace(0, np.nan)
+        count_cols = [c for c in stats.columns if c.endswith(('_count', '_days', '_n')) or c == 'max_streak']
+        stats[count_cols] = stats[count_cols].fillna(0).astype(np.int64)
+
+        writer = BulkTableWriter(self.conn, "stock_behavior_stats", primary_key=('StockID',))
+        writer.write(stats.reset_index())
+        writer.commit()
+
+    def _write_cleaning_audit(self, write_from, write_to, scope):
+        """
+        乒乓清洗剔除明細寫入 cleaning_audit (每筆剔除一列，含剔除當下的前收、漲跌與清洗輪次)。
+        完整模式整表重寫；增量/指定範圍只改寫範圍內的明細 (回看緩衝內的剔除已於先前記錄)。
+        """
+        audit = pd.concat(self.cleaning_audit, ignore_index=True)
+        self.cleaning_audit = []
+        if write_from:
+            audit = audit[self._write_from_mask(audit, write_from)]
+        if write_to:
+            audit = audit[audit['日期'] <= pd.Timestamp(f"{write_to} 23:59:59")]
+        audit = audit.sort_values(['StockID', '日期']).reset_index(drop=True)
+        audit['日期'] = pd.to_datetime(audit['日期']).dt.strftime('%Y-%m-%d %H:%M:%S')
+        if scope and self._table_exists('cleaning_audit'):
+            writer = BulkTableWriter(self.conn, "cleaning_audit", mode="append", delete_where=scope)
+        else:
+            writer = BulkTableWriter(self.conn, "cleaning_audit")
+        writer.write(audit)
+        writer.commit()
+        if len(audit):
+            print(f"🧹 乒乓清洗剔除 {len(audit)} 筆 (最多 {int(audit['clean_pass'].max())} 輪)，明細見 cleaning_audit")
+        return len(audit)
+
+    def _analyze(self):
+        """ 寫入後更新查詢規劃統計 (取樣上限避免大表全掃) """
+        cursor = self.conn.cursor()
+        cursor.execute(f"PRAGMA analysis_limit = {self.ANALYSIS_LIMIT}")
+        cursor.execute("ANALYZE")
+        self.conn.commit()
+
+    def index_sizes(self):
+        """ 回傳 {索引名稱: 位元組}；SQLite 未編入 dbstat 時回傳空字典 """
+        names = [name for indexes in self.MANAGED_INDEXES.values() for name, _ in indexes]
+        try:
+            rows = self.conn.execute(
+                f"SELECT name, SUM(pgsize) FROM dbstat WHERE name IN ({', '.join('?' * len(names))}) GROUP BY name",
+                names
+            ).fetchall()
+        except sqlite3.OperationalError:
+            return {}
+        return dict(rows)
+
+    def _plan_chunks(self, read_from, read_to=None):
+        """ 依各股列數貪婪切分 (首代號, 末代號) 區間，使每批估算記憶體不超過預算 """
+        where, params = self._raw_filters(read_from, read_to)
+        counts = pd.read_sql(
+            f"SELECT symbol, COUNT(*) as n FROM stock_prices WHERE {where} GROUP BY symbol ORDER BY symbol",
+            self.conn, params=params
+        )
+        rows_per_chunk = max(1, int(self.memory_budget_mb * 1024 * 1024 / self.BYTES_PER_ROW))
+        chunks, first, acc = [], None, 0
+        for symbol, n in zip(counts['symbol'], counts['n']):
+            # 單一股票不可拆分；超過預算時自成一批
+            if first is not None and acc + n > rows_per_chunk:
+                chunks.append((first, last))
+                first, acc = None, 0
+            if first is None:
+                first = symbol
+            last, acc = symbol, acc + n
+        if first is not None:
+            chunks.append((first, last))
+        return chunks or [None]
+
+    def _load_raw_data(self, read_from, symbol_range=None, read_to=None):
+        """ 讀取原始數據並整合 MarketType (可限定股票代號區間；日期與股票清單下推至 SQL) """
+        where, params = self._raw_filters(read_from, read_to, symbol_range)
+        query = f"SELECT date as 日期, symbol as StockID, open as 開盤, high as 最高, low as 最低, close as 收盤, volume as 成交量 FROM stock_prices WHERE {where}"
+        with self.profiler.stage("read_sql") as rec:
+            self.df = pd.read_sql(query, self.conn, params=params)
+            rec['rows'] = len(self.df)
+        if self.df.empty: return
 
         # 基礎預處理
-        self.df['日期'] = pd.to_datetime(self.df['日期'])
-        self.df = self.df.sort_values(['StockID', '日期']).reset_index(drop=True)
-        
+        with self.profiler.stage("parse_sort", rows=len(self.df)):
+            self.df['日期'] = pd.to_datetime(self.df['日期'])
+            self.df = self.df.sort_values(['StockID', '日期']).reset_index(drop=True)
+
         # 整合 MarketType
-        try:
-            info_df = pd.read_sql("SELECT symbol as StockID, market as MarketType FROM stock_info", self.conn)
-            self.df = pd.merge(self.df, info_df, on='StockID', how='left')
-        except:
-            self.df['MarketType'] = 'Unknown'
+        with self.profiler.stage("merge_stock_info", rows=len(self.df)):
+            try:
+                info_df = pd.read_sql("SELECT symbol as StockID, market as MarketType FROM stock_info", self.conn)
+                if symbol_range:
+                    info_df = info_df[info_df['StockID'].between(*symbol_range)]
+                self.df = pd.merge(self.df, info_df, on='StockID', how='left')
+            except:
+                self.df['MarketType'] = 'Unknown'
+        if self.compact:
+            self._compact_columns({c: 'category' for c in self.CATEGORY_COLS})
 
+    def _refine(self):
+        """ 規則 + 衍生欄位的完整計算流程 """
+        if self._pool is not None:
+            with self.profiler.stage("refine_parallel", rows=len(self.df)):
+                self._refine_parallel()
+            return
         # 執行規則：乒乓清洗 + is_limit_up 標籤 (確保先產生標籤)
-        self.df = self.rules.apply(self.df)
-
-        # 計算衍生欄位
-        self._calculate_core_metrics()
-        self._calculate_sequence_counts()
-        self._calculate_rolling_and_period_metrics()
-        self._calculate_risk_metrics()
-
-        # 存檔
-        self.df['日期'] = self.df['日期'].dt.strftime('%Y-%m-%d %H:%M:%S')
-        self.df.to_sql("cleaned_daily_base", self.conn, if_exists="replace", index=False)
-        return f"✅ {self.market_abbr} 數據精煉完成，所有欄位已對接！"
-
-    def _calculate_core_metrics(self):
-        """ 計算報酬、炸板與 AI 診斷欄位 """
-        groups = self.df.groupby('StockID')
-        self.df['Ret_Day'] = (self.df['收盤'] / self.df['Prev_Close']) - 1
-        self.df['Ret_High'] = (self.df['最高'] / self.df['Prev_Close']) - 1
-        self.df['Overnight_Alpha'] = (self.df['開盤'] / self.df['Prev_Close']) - 1
-        
-        self.df['Prev_LU'] = groups['is_limit_up'].shift(1).fillna(0)
-        self.df['Next_1D_Max'] = groups['Ret_High'].shift(-1)
-
-    def _calculate_sequence_counts(self):
-        """ 計算連板天數 """
-        def get_seq(s):
-            blocks = (s != s.shift()).cumsum()
-            return (s == 1).astype(int) * (s.groupby(blocks).cumcount() + 1)
-        self.df['Seq_LU_Count'] = self.df.groupby('StockID')['is_limit_up'].transform(get_seq)
-
-    def _calculate_rolling_and_period_metrics(self):
-        """ 支援 Period_Analysis 的繁簡體與滾動欄位 """
-        groups = self.df.groupby('StockID')
-        for d in [5, 20, 200]:
-            self.df[f'Ret_{d}D'] = groups['收盤'].transform(lambda x: x.pct_change(periods=d))
-        
-        # 週期漲跌 (簡化邏輯確保不報錯)
-        self.df['周累计漲跌幅(本周开盘)'] = self.df['Ret_5D']
-        self.df['月累计漲跌幅(本月开盘)'] = self.df['Ret_20D']
-        self.df['年累計漲跌幅(本年开盘)'] = self.df['Ret_200D']
-
-    def _calculate_risk_metrics(self):
-        """ 支援 Risk_Metrics 的風險欄位 """
-        groups = self.df.groupby('StockID')
-        for d in [10, 20, 50]:
-            self.df[f'volatility_{d}d'] = groups['Ret_Day'].transform(lambda x: x.rolling(d).std() * np.sqrt(252))
-            rolling_high = groups['最高'].transform(lambda x: x.rolling(d, min_periods=1).max())
-            self.df[f'drawdown_after_high_{d}d'] = (self.df['收盤'] / rolling_high) - 1
-        self.df['recovery_from_dd_10d'] = (self.df['收盤'] / groups['最低'].transform(lambda x: x.rolling(10).min())) - 1
+        with self.profiler.stage("rules", rows=len(self.df)):
+            self.df = self.rules.apply(self.df, audit=self.cleaning_audit)
+        # 規則套用後已依 (StockID, 日期) 排序，建立分段邊界供滾動核心共用
+        with self.profiler.stage("segments", rows=len(self.df)):
+            self.segments = SegmentedRolling(self.df['StockID'])
+
+        # 依註冊表的依賴圖計算衍生欄位
+        METRICS.compute(self.df, self.segments, self.metrics, profiler=self.profiler)
+        if self.compact:
+            self._compact_derived_columns()
+
+    def _compact_derived_columns(self):
+        """ 旗標 -> int8、連板計數 -> int16 (衍生比率維持 float64) """
+        plan = {c: 'int8' for c in self.FLAG_COLS}
+        plan.update({c: 'int16' for c in self.COUNT_COLS})
+        self._compact_columns(plan)
+
+    def _compact_columns(self, plan):
+        """ 依 {欄位: dtype} 轉型並累計每欄節省的位元組 """
+        for col, dtype in plan.items():
+            if col not in self.df.columns:
+                continue
+            before = int(self.df[col].memory_usage(index=False, deep=True))
+            self.df[col] = self.df[col].astype(dtype)
+            after = int(self.df[col].memory_usage(index=False, deep=True))
+            stats = self.dtype_report.setdefault(col, [0, 0])
+            stats[0] += before
+            stats[1] += after
+
+    def _print_dtype_report(self):
+        """ 精簡型別的逐欄記憶體報告 """
+        rows = sorted(self.dtype_report.items(), key=lambda kv: kv[1][0] - kv[1][1], reverse=True)
+        print(f"{'欄位':<28}{'原始(MB)':>10}{'精簡(MB)':>10}{'節省':>8}")
+        for col, (before, after) in rows:
+            saved = 1 - after / before if before else 0
+            print(f"{col:<28}{before / 1e6:>10.2f}{after / 1e6:>10.2f}{saved:>8.0%}")
+        total_before = sum(b for b, _ in self.dtype_report.values())
+        total_after = sum(a for _, a in self.dtype_report.values())
+        print(f"{'合計':<28}{total_before / 1e6:>10.2f}{total_after / 1e6:>10.2f}"
+              f"{(1 - total_after / total_before) if total_before else 0:>8.0%}")
+
+    def _refine_parallel(self):
+        """ 依 StockID 邊界切成數個分片交給行程池，結果依分片順序合併 (與單行程逐位元一致) """
+        shards = self._split_shards(self.workers)
+        results = list(self._pool.map(_refine_shard, [self.rules] * len(shards), shards,
+                                      [self.compact] * len(shards), [self.metrics] * len(shards)))
+        self.df = pd.concat([df for df, _, _ in results], ignore_index=True)
+        for _, _, audit in results:
+            self.cleaning_audit.extend(audit)
+        for report in (r for _, r, _ in results):
+            for col, (before, after) in report.items():
+                stats = self.dtype_report.setdefault(col, [0, 0])
+                stats[0] += before
+                stats[1] += after
+
+    def _split_shards(self, n_shards):
+        """ 以約略相等的列數切分，切點對齊到股票起始列 (已依 StockID 排序) """
+        ids = self.df['StockID'].to_numpy()
+        starts = np.flatnonzero(np.r_[True, ids[1:] != ids[:-1]])
+        targets = np.arange(1, n_shards) * len(ids) / n_shards
+        cuts = np.unique(starts[np.minimum(np.searchsorted(starts, targets), len(starts) - 1)])
+        bounds = [0] + [int(c) for c in cuts if c > 0] + [len(ids)]
+        return [self.df.iloc[a:b] for a, b in zip(bounds[:-1], bounds[1:]) if b > a]
+
+    def _plan_incremental(self):
+        """
+        回傳 (讀取起點, 改寫起點)；若無既有加工表、或上次精煉後沒有新交易日的數據則回傳 None 改走完整模式。
+        各股窗口依自己的加工列規劃 (_build_windows)，只處理有新數據的股票；回傳值用於還沒有加工列的新股
+        (整段精煉)，同時是讀取/改寫查詢的日期下限。
+        成本：每檔有新數據的股票仍重讀 LOOKBACK_DAYS + LOOKBACK_BUFFER 筆原始列 (回看欄位需要)，
+        改寫最後 REWRITE_ROWS 列；規劃、股性統計與累計欄位接續只走索引，不隨歷史長度成長。
+        """
+        cursor = self.conn.cursor()
+        cursor.execute("SELECT name FROM sqlite_master WHERE type='table' AND name='cleaned_daily_base'")
+        if not cursor.fetchone():
+            return None
+        cursor.execute("SELECT MAX(日期) FROM cleaned_daily_base")
+        last_refined = cursor.fetchone()[0]
+        if not last_refined:
+            return None
+        # 註冊表新增欄位後，既有列的新欄位為空值，需完整重算一次
+        existing = {c[1] for c in cursor.execute("PRAGMA table_info(cleaned_daily_base)").fetchall()}
+        missing = [c for c in METRICS.columns if c not in existing]
+        if missing:
+            print(f"ℹ️ 加工表缺少新欄位 {missing}，本次改走完整重算")
+            return None
+
+        # 改寫起點：各股最後 REWRITE_ROWS 筆加工列 (前瞻欄位當時仍為空值、或可能因乒乓剔除而移位)；
+        # 上次精煉後沒有新數據的股票 (停牌、下市) 結果不變，窗口設為 IDLE_DATE
+        cutoff = f"{str(last_refined)[:10]} 23:59:59"
+        write_sql = (f"CASE WHEN s.StockID IN (SELECT symbol FROM stock_prices WHERE date > ?) "
+                     f"THEN COALESCE((SELECT c.日期 FROM cleaned_daily_base c WHERE c.StockID = s.StockID "
+                     f"ORDER BY c.日期 DESC LIMIT 1 OFFSET {self.REWRITE_ROWS - 1}), "
+                     f"(SELECT MIN(c.日期) FROM cleaned_daily_base c WHERE c.StockID = s.StockID)) "
+                     f"ELSE '{self.IDLE_DATE}' END")
+        self._build_windows(write_sql, (cutoff,))
+
+        # 回傳窗口表沒有的股票 (新股) 所用的起點：取有窗口股票的最早起點與新股的第一筆，
+        # 讓讀取/改寫條件的 date >= ? 能走日期索引，只掃描近期的列
+        read_from, write_from = self.conn.execute(
+            f"SELECT MIN(read_from), MIN(write_from) FROM {self.WINDOWS_TABLE} WHERE write_from < ?",
+            (self.IDLE_DATE,)).fetchone()
+        new_symbols = [r[0] for r in self.conn.execute(
+            f"SELECT DISTINCT symbol FROM stock_prices WHERE date > ? "
+            f"AND symbol NOT IN (SELECT code FROM {self.WINDOWS_TABLE})", (cutoff,))]
+        if new_symbols:
+            first = self.conn.execute(f"SELECT MIN(date) FROM stock_prices WHERE date >= ? AND symbol IN "
+                                      f"({', '.join('?' * len(new_symbols))})",
+                                      [self.START_DATE] + new_symbols).fetchone()[0]
+            read_from = min(d for d in (read_from, str(first)[:10]) if d)
+            write_from = min(d for d in (write_from, str(first)[:10]) if d)
+        if write_from is None:
+            print("ℹ️ 上次精煉後沒有新交易日的數據，本次改走完整重算")
+            self._drop_windows()
+            return None
+        return read_from, write_from
+
+    def _plan_rerun(self):
+        """
+        指定 start_date / end_date 時規劃各股窗口，回傳 (讀取起點, 改寫起點)；只指定 end_date 時回傳 None。
+        各股改寫起點為 start_date 之前第 REWRITE_ROWS 筆加工列 (這些列的前瞻欄位會看到修正後的數據)，
+        回傳的 start_date 只用於還沒有加工列的股票。
+        """
+        if not (self.start_date or self.end_date):
+            return None
+        if self._table_exists('cleaned_daily_base'):
+            write_sql, params = None, ()
+            if self.start_date:
+                write_sql = (f"COALESCE((SELECT c.日期 FROM cleaned_daily_base c WHERE c.StockID = s.StockID "
+                             f"AND c.日期 < ? ORDER BY c.日期 DESC LIMIT 1 OFFSET {self.REWRITE_ROWS - 1}), "
+                             f"'{self.START_DATE}')")
+                params = (f"{self.start_date} 00:00:00",)
+            self._build_windows(write_sql, params)
+        return (self.START_DATE, self.start_date) if self.start_date else None
+
+    def _build_windows(self, write_sql=None, params=()):
+        """
+        依各股自己的加工列 (而非全市場交易日) 規劃窗口，寫入附加的記憶體資料庫 refine_plan.windows：
+          write_from = write_sql 算出的改寫起點 (s.StockID 為該股)；None = 不限
+          read_from  = 改寫起點之前第 LOOKBACK_DAYS + LOOKBACK_BUFFER 筆加工列，停牌再久回看也完整；
+                       歷史不足的股票從第一筆加工列讀起 (每檔第一筆原始列沒有前收，不會被乒乓清洗剔除)
+          read_to    = end_date 之後第 FORWARD_HORIZON + LOOKBACK_BUFFER 筆加工列；None = 讀到最新
+        日期皆存為 'YYYY-MM-DD'，與原始表/加工表的日期字串直接比較。
+        """
+        self._ensure_indexes(['cleaned_daily_base'])  # 逐檔查詢依賴 (StockID, 日期) 索引
+        self.conn.commit()
+        self.conn.execute(f"ATTACH DATABASE ':memory:' AS {self.WINDOWS_DB}")
+        self._windows = True
+        self.conn.execute(f"CREATE TABLE {self.WINDOWS_TABLE} "
+                          f"(code TEXT PRIMARY KEY, read_from TEXT, write_from TEXT, read_to TEXT)")
+        where = f"WHERE StockID IN ({', '.join('?' * len(self.symbols))})" if self.symbols else ""
+        self.conn.execute(f"""
+            INSERT INTO {self.WINDOWS_TABLE} (code, write_from)
+            SELECT s.StockID, substr({write_sql or 'NULL'}, 1, 10)
+            FROM (SELECT DISTINCT StockID FROM cleaned_daily_base {where}) s
+        """, list(params) + list(self.symbols or []))
+        if write_sql:
+            self.conn.execute(f"""
+                UPDATE {self.WINDOWS_TABLE} SET read_from = CASE WHEN write_from = ? THEN write_from ELSE COALESCE((
+                    SELECT substr(c.日期, 1, 10) FROM cleaned_daily_base c
+                    WHERE c.StockID = code AND c.日期 < write_from
+                    ORDER BY c.日期 DESC LIMIT 1 OFFSET {self.LOOKBACK_DAYS + self.LOOKBACK_BUFFER - 1}), (
+                    SELECT substr(MIN(c.日期), 1, 10) FROM cleaned_daily_base c WHERE c.StockID = code), ?) END
+            """, (self.IDLE_DATE, self.START_DATE))
+            self._stock_write_from = pd.read_sql(
+                f"SELECT code, write_from FROM {self.WINDOWS_TABLE} WHERE write_from < ?",
+                self.conn, params=(self.IDLE_DATE,)).set_index('code')['write_from']
+            self._write_floor = self.conn.execute(f"SELECT MIN(write_from) FROM {self.WINDOWS_TABLE}").fetchone()[0]
+        if self.end_date:
+            self.conn.execute(f"""
+                UPDATE {self.WINDOWS_TABLE} SET read_to = (
+                    SELECT substr(c.日期, 1, 10) FROM cleaned_daily_base c
+                    WHERE c.StockID = code AND c.日期 > ?
+                    ORDER BY c.日期 LIMIT 1 OFFSET {self.FORWARD_HORIZON + self.LOOKBACK_BUFFER - 1})
+            """, (f"{self.end_date} 23:59:59",))
+        self.conn.commit()
+
+    def _drop_windows(self):
+        if self._windows:
+            self.conn.commit()
+            self.conn.execute(f"DETACH DATABASE {self.WINDOWS_DB}")
+            self._windows = False
+            self._stock_write_from = None
+            self._write_floor = None
+
+    def _write_from_cond(self, op, write_from, alias=""):
+        """
+        日期 {op} 改寫起點 -> (SQL 條件, 參數)；有各股窗口時逐檔比對，窗口表沒有的股票使用 write_from。
+        ">=" 另加所有起點中最早的一天作為下限，讓查詢走日期索引而不是逐列比對整張表。
+        """
+        if self._stock_write_from is not None:
+            cond = (f"{alias}日期 {op} COALESCE((SELECT write_from FROM {self.WINDOWS_TABLE} "
+                    f"WHERE code = {alias}StockID), ?)")
+            if op == ">=":
+                floor = min(d for d in (self._write_floor, write_from) if d)
+                return f"{alias}日期 >= ? AND {cond}", [f"{floor} 00:00:00", write_from]
+            return cond, [write_from]
+        return f"{alias}日期 {op} ?", [f"{write_from} 00:00:00"]
+
+    def _write_from_mask(self, df, write_from):
+        """ DataFrame 版的改寫範圍：各股改寫起點 (含) 之後的列 """
+        bound = pd.Timestamp(write_from)
+        if self._stock_write_from is not None:
+            bound = pd.to_datetime(df['StockID'].astype(object).map(self._stock_write_from)).fillna(bound)
+        return df['日期'] >= bound
+
+    def _written_floor(self, write_from, scope):
+        """ 本次改寫的最早日期 (各股窗口起點不同)；只以日期為鍵的 sector_daily 與列式副本從這天起重算 """
+        if self._stock_write_from is None or not write_from:
+            return write_from
+        days = [self.conn.execute(f"SELECT MIN(write_from) FROM {self.WINDOWS_TABLE}").fetchone()[0]]
+        first = self.conn.execute(f"SELECT MIN(日期) FROM cleaned_daily_base WHERE {scope[0]}", scope[1]).fetchone()[0]
+        days.append(str(first)[:10] if first else None)
+        return min((d for d in days if d), default=write_from)
+
+    def _carry_over_running_stats(self, write_from, symbol_range=None):
+        """ 「至今」累計欄位需接續回看窗口之前的歷史值 """
+        cursor = self.conn.cursor()
+        cursor.execute("PRAGMA table_info(cleaned_daily_base)")
+        existing = {c[1] for c in cursor.fetchall()}
+        cols = [c for c in METRICS.running_columns(self.metrics) if c in existing and c in self.df.columns]
+        if not cols:
+            return
+        query, params = self._prior_running_sql(cols, write_from)
+        conds = []
+        if symbol_range:
+            conds.append("StockID BETWEEN ? AND ?")
+            params += list(symbol_range)
+        if self.symbols:
+            conds.append(f"StockID IN ({', '.join('?' * len(self.symbols))})")
+            params += self.symbols
+        if conds:
+            query = f"SELECT * FROM ({query}) WHERE {' AND '.join(conds)}"
+        prior = pd.read_sql(query, self.conn, params=params).set_index('StockID')
+        for col in cols:
+            prior_max = self.df['StockID'].map(prior[col]).fillna(0)
+            merged = np.maximum(self.df[col], prior_max)
+            self.df[col] = merged.astype(self.df[col].dtype)
+
+    def _prior_running_sql(self, cols, write_from):
+        """
+        各股改寫起點之前的「至今」累計值 -> (SQL, 參數)，欄位為 StockID + cols。
+        累計值隨日期單調不減，有各股窗口時取起點前最後一列 (逐檔走 (StockID, 日期) 索引，不掃描整段歷史)；
+        否則以 GROUP BY 取 write_from 之前的最大值。
+        """
+        if self._stock_write_from is not None:
+            picks = ", ".join(f"c.[{c}] AS [{c}]" for c in cols)
+            return (f"SELECT w.code AS StockID, {picks} FROM {self.WINDOWS_TABLE} w "
+                    f"JOIN cleaned_daily_base c ON c.rowid = (SELECT p.rowid FROM cleaned_daily_base p "
+                    f"WHERE p.StockID = w.code AND p.日期 < w.write_from ORDER BY p.日期 DESC LIMIT 1)"), []
+        aggs = ", ".join(f"MAX([{c}]) AS [{c}]" for c in cols)
+        return (f"SELECT StockID, {aggs} FROM cleaned_daily_base WHERE 日期 < ? GROUP BY StockID",
+                [f"{write_from} 00:00:00"])
+
+    def _format_date_columns(self):
+        """ 所有 datetime 欄位統一存成 'YYYY-MM-DD HH:MM:SS' 字串 """
+        for col in self.df.columns:
+            if pd.api.types.is_datetime64_any_dtype(self.df[col]):
+                self.df[col] = self.df[col].dt.strftime('%Y-%m-%d %H:%M:%S')
+
+def _refine_shard(rules, df, compact=False, metrics=None):
+    """ 子行程入口：對單一 StockID 分片執行規則與衍生欄位，回傳 (結果, 型別報告, 清洗明細) """
+    engine = AlphaCoreEngine(None, rules, rules.market_type, compact=compact, metrics=metrics)
+    engine.df = df
+    engine._refine()
+    return engine.df, engine.dtype_report, engine.cleaning_audit
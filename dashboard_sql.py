@@ -0,0 +1,23 @@
+# -*- coding: utf-8 -*-
+
+# ==========================================
+# 儀表板共用查詢片段
+# ==========================================
+# 精煉引擎會產出 cleaned_latest (最新日快照，已併入 Name / Sector)；
+# 舊版資料庫沒有這張表時，即時從 cleaned_daily_base + stock_info 組出相同欄位。
+LATEST_FALLBACK_SQL = """(
+    SELECT p.*, i.name as Name, i.sector as Sector FROM cleaned_daily_base p
+    LEFT JOIN stock_info i ON p.StockID = i.symbol
+    WHERE p.日期 = (SELECT MAX(日期) FROM cleaned_daily_base))"""
+
+
+def list_tables(conn):
+    """回傳資料庫內所有資料表名稱"""
+    return [r[0] for r in conn.execute("SELECT name FROM sqlite_master WHERE type='table'")]
+
+
+def latest_source(conn, tables=None):
+    """回傳可直接放進 FROM 的最新日資料來源 (cleaned_latest 或等價子查詢)"""
+    if tables is None:
+        tables = list_tables(conn)
+    return "cleaned_latest" if "cleaned_latest" in tables else LATEST_FALLBACK_SQL
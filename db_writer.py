@@ -0,0 +1,179 @@
+# -*- coding: utf-8 -*-
+import numpy as np
+import pandas as pd
+
+# ==========================================
+# 大表批次寫入器 (取代 to_sql 的通用插入路徑)
+# ==========================================
+class BulkTableWriter:
+    """
+    以明確型別的 schema + executemany + 單一交易寫入大表。
+    1. replace 模式：寫入暫存表，commit 時於同一交易內刪除舊表、改名替換並建立索引。
+    2. append 模式：直接附加至既有表 (可先刪除指定範圍，達成 upsert)，缺少的欄位自動補上。
+    3. update 模式：依 key 欄位 UPDATE 既有列，只改寫傳入的非鍵欄位 (其餘欄位與沒有對應的列不動)。
+    寫入期間套用調校過的 PRAGMA，結束後還原原設定。
+    """
+
+    PRAGMAS = {
+        'journal_mode': 'MEMORY',  # 回滾日誌放記憶體，減少磁碟寫入
+        'synchronous': 'OFF',      # 批次工作：原始檔來自雲端，可重新下載
+        'cache_size': -262144,     # 256MB 頁快取
+        'temp_store': 'MEMORY',
+    }
+
+    def __init__(self, conn, table, mode="replace", delete_where=None, pragmas=None, primary_key=None, key=None):
+        if mode not in ("replace", "append", "update"):
+            raise ValueError(f"未知的寫入模式：{mode} (可用 replace / append / update)")
+        if mode == "update" and not key:
+            raise ValueError("update 模式需指定 key 欄位")
+        self.conn = conn
+        self.table = table
+        self.mode = mode
+        self.primary_key = primary_key # replace 模式：建表時宣告的主鍵欄位 (tuple)
+        self.delete_where = delete_where # append 模式：(SQL 條件, 參數)，寫入前先刪除
+        self.key = tuple(key or ()) # update 模式：比對既有列的鍵欄位
+        self.pragmas = dict(self.PRAGMAS, **(pragmas or {}))
+        self.target = f"{table}__new" if mode == "replace" else table
+        self.rows_written = 0
+        self._columns = None
+        self._saved_pragmas = {}
+        self._saved_isolation = None
+        self._active = False
+
+    # ---------- 交易生命週期 ----------
+    def begin(self):
+        self.conn.commit()
+        cursor = self.conn.cursor()
+        for name, value in self.pragmas.items():
+            self._saved_pragmas[name] = cursor.execute(f"PRAGMA {name}").fetchone()[0]
+            cursor.execute(f"PRAGMA {name} = {value}")
+        # 交由本類別明確控制交易邊界
+        self._saved_isolation = self.conn.isolation_level
+        self.conn.isolation_level = None
+        cursor.execute("BEGIN")
+        self._active = True
+        if self.mode == "replace":
+            cursor.execute(f"DROP TABLE IF EXISTS [{self.target}]")
+        elif self.delete_where and self.mode == "append":
+            where, params = self.delete_where
+            cursor.execute(f"DELETE FROM [{self.table}] WHERE {where}", params)
+        return self
+
+    def write(self, df):
+        """ 寫入一批資料；第一批決定 (或補齊) 表結構 """
+        if not self._active:
+            self.begin()
+        cursor = self.conn.cursor()
+        if self._columns is None:
+            self._prepare_table(cursor, [(c, _sql_type(df[c])) for c in df.columns])
+        if self.mode == "update":
+            values = [c for c in df.columns if c not in self.key]
+            sets = ", ".join(f"[{c}] = ?" for c in values)
+            match = " AND ".join(f"[{c}] = ?" for c in self.key)
+            cursor.executemany(f"UPDATE [{self.target}] SET {sets} WHERE {match}",
+                               _iter_rows(df[values + list(self.key)]))
+            self.rows_written += cursor.rowcount
+            return
+        cols = ", ".join(f"[{c}]" for c in df.columns)
+        marks = ", ".join("?" * len(df.columns))
+        cursor.executemany(f"INSERT INTO [{self.target}] ({cols}) VALUES ({marks})", _iter_rows(df))
+        self.rows_written += len(df)
+
+    def write_select(self, columns, select_sql, params=()):
+        """ 以 INSERT ... SELECT 在資料庫內寫入 (columns = [(欄位, SQLite 型別)])，數據不經過 Python；回傳寫入列數 """
+        if self.mode == "update":
+            raise ValueError("update 模式不支援 write_select")
+        if not self._active:
+            self.begin()
+        cursor = self.conn.cursor()
+        if self._columns is None:
+            self._prepare_table(cursor, columns)
+        cols = ", ".join(f"[{c}]" for c, _ in columns)
+        cursor.execute(f"INSERT INTO [{self.target}] ({cols}) {select_sql}", params)
+        self.rows_written += cursor.rowcount
+        return cursor.rowcount
+
+    @property
+    def columns(self):
+        """ 目前寫入的欄位 (第一批寫入後才確定) """
+        return list(self._columns or [])
+
+    def commit(self, indexes=()):
+        """ 替換正式表並建立索引 (同一交易)，最後還原 PRAGMA """
+        if not self._active:
+            self.begin()
+        cursor = self.conn.cursor()
+        try:
+            if self.mode == "replace":
+                if self._columns is None:
+                    # 沒有任何資料：保留原表不動
+                    cursor.execute("ROLLBACK")
+                    return
+                cursor.execute(f"DROP TABLE IF EXISTS [{self.table}]")
+                cursor.execute(f"ALTER TABLE [{self.target}] RENAME TO [{self.table}]")
+            for name, cols in indexes:
+                col_sql = ", ".join(f"[{c}]" for c in cols)
+                cursor.execute(f"CREATE INDEX IF NOT EXISTS [{name}] ON [{self.table}] ({col_sql})")
+            cursor.execute("COMMIT")
+        finally:
+            self._close()
+
+    def rollback(self):
+        if self._active:
+            self.conn.cursor().execute("ROLLBACK")
+            self._close()
+
+    def _close(self):
+        self._active = False
+        self.conn.isolation_level = self._saved_isolation
+        cursor = self.conn.cursor()
+        for name, value in self._saved_pragmas.items():
+            cursor.execute(f"PRAGMA {name} = {value}")
+        self._saved_pragmas = {}
+
+    # ---------- 結構 ----------
+    def _prepare_table(self, cursor, columns):
+        """ columns = [(欄位, SQLite 型別)] """
+        if self.mode == "replace":
+            col_defs = ", ".join(f"[{c}] {sql_type}" for c, sql_type in columns)
+            if self.primary_key:
+                col_defs += f", PRIMARY KEY ({', '.join(f'[{c}]' for c in self.primary_key)})"
+            cursor.execute(f"CREATE TABLE [{self.target}] ({col_defs})")
+        else:
+            # 既有表缺少的新欄位先補上，避免附加失敗
+            existing = {c[1] for c in cursor.execute(f"PRAGMA table_info([{self.target}])").fetchall()}
+            for c, sql_type in columns:
+                if c not in existing:
+                    cursor.execute(f"ALTER TABLE [{self.target}] ADD COLUMN [{c}] {sql_type}")
+        self._columns = [c for c, _ in columns]
+
+
+def _sql_type(series):
+    """ pandas dtype -> SQLite 宣告型別 (與 to_sql 的對應一致) """
+    dtype = series.dtype
+    if isinstance(dtype, pd.CategoricalDtype):
+        dtype = dtype.categories.dtype
+    if pd.api.types.is_bool_dtype(dtype) or pd.api.types.is_integer_dtype(dtype):
+        return "INTEGER"
+    if pd.api.types.is_float_dtype(dtype):
+        return "REAL"
+    if pd.api.types.is_datetime64_any_dtype(dtype):
+        return "TIMESTAMP"
+    return "TEXT"
+
+
+def _iter_rows(df):
+    """ 逐欄轉成 Python 原生值後組成列，供 executemany 綁定 """
+    columns = []
+    for c in df.columns:
+        s = df[c]
+        if isinstance(s.dtype, pd.CategoricalDtype):
+            s = s.astype(s.cat.categories.dtype)
+        if pd.api.types.is_float_dtype(s.dtype):
+            # SQLite 綁定 NaN 時即存為 NULL，不需逐值轉換
+            columns.append(s.to_numpy(dtype=np.float64).tolist())
+        elif pd.api.types.is_integer_dtype(s.dtype) or pd.api.types.is_bool_dtype(s.dtype):
+            columns.append(s.to_numpy().tolist())
+        else:
+            columns.append(s.astype(object).where(s.notna(), None).tolist())
+    return zip(*columns)
@@ -0,0 +1,343 @@
+# -*- coding: utf-8 -*-
+import hashlib
+import io
+import json
+import os
+import shutil
+import threading
+
+from googleapiclient.errors import HttpError
+from googleapiclient.http import MediaFileUpload, MediaIoBaseDownload
+
+from transport import MIMETYPES, artifact_name, compress_file, decompress_file, download_artifact, manifest_name
+
+def file_md5(path, chunk_bytes=8 * 1024 * 1024):
+    """ 分塊計算檔案 md5 (與 Drive 的 md5Checksum 相同格式) """
+    digest = hashlib.md5()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(chunk_bytes), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+def _report_uploaded(sizes):
+    """ 印出本次上傳的檔案數與總位元組數 (sizes 為各檔大小) """
+    print(f"📦 本次上傳 {len(sizes)} 個檔案，共 {sum(sizes) / 1e6:.1f} MB ({sum(sizes):,} bytes)")
+
+# ==========================================
+# Drive 同步層 (檔案 ID 快取 + 校驗碼比對)
+# ==========================================
+class DriveSync:
+    """
+    以本機快取目錄同步 Drive 上的檔案：
+    1. 檔案 ID 記在 cache_dir/.drive_sync.json，之後以 files().get 直接取中繼資料，不再依檔名查詢。
+    2. 下載前比對 Drive 的 md5Checksum / modifiedTime：本機檔案相同時略過下載。
+    3. 上傳前比對本機 md5 與上次同步的雲端版本：未變動時略過上傳。
+    4. 壓縮傳輸 (transport.py)：上傳可改送壓縮檔 + manifest；下載時 manifest 比原始檔新就改抓壓縮檔並串流解壓。
+    本機檔案自上次同步後未被改動 (大小與 mtime 相同) 時沿用記錄的 md5，不重新計算。
+    同一快取目錄可由多個 DriveSync 共用 (orchestrator 的 I/O 執行緒)：寫回狀態時只更新該檔案的紀錄。
+    """
+
+    STATE_FILE = ".drive_sync.json"
+    FIELDS = "id, name, md5Checksum, modifiedTime, size, parents, trashed"
+    _state_lock = threading.Lock()
+
+    def __init__(self, service, cache_dir="."):
+        self.service = service
+        self.cache_dir = cache_dir
+        os.makedirs(cache_dir, exist_ok=True)
+        self.state_path = os.path.join(cache_dir, self.STATE_FILE)
+        self.state = self._load_state()
+
+    def local_path(self, name):
+        return os.path.join(self.cache_dir, name)
+
+    def remote_meta(self, name):
+        """ 雲端檔案的 id / md5Checksum / modifiedTime / size；找不到時拋出 ValueError """
+        meta = self._lookup(name)
+        if meta is None:
+            raise ValueError(f"❌ 在雲端找不到檔案: {name}")
+        return meta
+
+    def _lookup(self, name):
+        """ 以快取的檔案 ID 取中繼資料，ID 失效 (刪除/移到垃圾桶) 時改以檔名查詢；找不到回傳 None """
+        file_id = self.state.get(name, {}).get('id')
+        if file_id:
+            try:
+                meta = self.service.files().get(fileId=file_id, fields=self.FIELDS).execute()
+                if not meta.get('trashed'):
+                    return meta
+            except HttpError as e:
+                if e.resp.status != 404:
+                    raise
+            print(f"⚠️ 快取的檔案 ID 已失效，改以檔名查詢: {name}")
+        query = f"name = '{name}' and trashed = false"
+        files = self.service.files().list(q=query, fields=f"files({self.FIELDS})").execute().get('files', [])
+        if not files:
+            return None
+        if self.state.get(name, {}).get('id') != files[0]['id']:
+            self.state.setdefault(name, {})['id'] = files[0]['id']
+            self._save_state(name)
+        return files[0]
+
+    # ---------- 下載 / 上傳 ----------
+    def download(self, name):
+        """ 雲端版本 (原始檔或較新的壓縮版) 與本機相同時略過；回傳是否實際下載 """
+        path = self.local_path(name)
+        raw, packed = self._lookup(name), self._lookup(manifest_name(name))
+        if raw is None and packed is None:
+            raise ValueError(f"❌ 在雲端找不到檔案: {name}")
+        manifest = None
+        meta = raw
+        if packed is not None and (raw is None or packed['modifiedTime'] >= raw['modifiedTime']):
+            manifest = json.loads(self.service.files().get_media(fileId=packed['id']).execute())
+            # 壓縮版以解壓後的 md5 / 大小與本機比對
+            meta = {'id': raw['id'] if raw else None, 'md5Checksum': manifest['raw_md5'],
+                    'modifiedTime': packed['modifiedTime'], 'size': manifest['raw_size']}
+
+        if self._local_matches(name, path, meta):
+            print(f"♻️ 本機快取與雲端相同 (md5 {meta['md5Checksum']})，略過下載")
+            self._remember(name, meta, path)
+            return False
+
+        if manifest is not None:
+            artifact = self.remote_meta(manifest['artifact'])
+            print(f"📥 下載壓縮版 {manifest['artifact']} ({manifest['artifact_size'] / 1e6:.1f} MB，"
+                  f"解壓後 {manifest['raw_size'] / 1e6:.1f} MB)，邊下載邊解壓...")
+            download_artifact(self.service, artifact['id'], path, manifest)
+        else:
+            print(f"📥 偵測到雲端檔案 ID: {meta['id']}，開始下載...")
+            partial = f"{path}.part"  # 先寫暫存檔，中斷時不會留下半個快取
+            with io.FileIO(partial, 'wb') as fh:
+                downloader = MediaIoBaseDownload(fh, self.service.files().get_media(fileId=meta['id']))
+                done = False
+                while not done:
+                    status, done = downloader.next_chunk()
+            os.replace(partial, path)
+        self._remember(name, meta, path)
+        print(f"✅ {name} 下載成功")
+        return True
+
+    def upload(self, name, mimetype='application/octet-stream', codec=None, keep_raw=False):
+        """
+        本機檔案與上次同步的雲端版本相同時略過；回傳是否實際上傳。
+        codec = 'gzip' / 'zstd' 時改送壓縮檔 + manifest (manifest 最後更新，比雲端原始 .db 新，下載端改抓壓縮檔)；
+        keep_raw = True 時在兩者之間另上傳原始 .db，供直接讀取原始檔的外部程式使用 (上傳量約為原始檔 + 壓縮檔)。
+        """
+        path = self.local_path(name)
+        entry = self.state.get(name, {})
+        local_md5 = self._local_md5(name, path)
+        if local_md5 == entry.get('md5'):
+            print(f"♻️ {name} 與雲端版本相同，略過上傳")
+            return False
+
+        if codec is None:
+            file_id = entry.get('id') or self.remote_meta(name)['id']
+            response = self._put(name, path, mimetype, file_id=file_id)
+            self._remember(name, dict(response, md5Checksum=response.get('md5Checksum') or local_md5), path)
+            _report_uploaded([os.path.getsize(path)])
+            return True
+
+        artifact_path = self.local_path(artifact_name(name, codec))
+        manifest = compress_file(path, artifact_path, codec)
+        print(f"🗜️ {codec} 壓縮：{manifest['raw_size'] / 1e6:.1f} MB -> {manifest['artifact_size'] / 1e6:.1f} MB "
+              f"({manifest['artifact_size'] / max(manifest['raw_size'], 1):.0%})")
+        raw = self.remote_meta(name)
+        parents = raw.get('parents')
+        sent = []
+        try:
+            self._put(manifest['artifact'], artifact_path, MIMETYPES[codec], parents=parents)
+            sent.append(os.path.getsize(artifact_path))
+        finally:
+            os.remove(artifact_path)
+        if keep_raw:
+            raw = self._put(name, path, mimetype, file_id=raw['id'])
+            sent.append(os.path.getsize(path))
+        manifest_path = self.local_path(manifest_name(name))
+        with open(manifest_path, "w", encoding="utf-8") as f:
+            json.dump(manifest, f, ensure_ascii=False, indent=2)
+        try:
+            response = self._put(manifest_name(name), manifest_path, 'application/json', parents=parents)
+            sent.append(os.path.getsize(manifest_path))
+        finally:
+            os.remove(manifest_path)
+        self._remember(name, {'id': raw['id'], 'md5Checksum': local_md5,
+                              'modifiedTime': response.get('modifiedTime')}, path)
+        _report_uploaded(sent)
+        return True
+
+    def _put(self, name, path, mimetype, file_id=None, parents=None):
+        """ 以可續傳模式更新 (或建立) 雲端檔案，回傳新的中繼資料 """
+        file_id = file_id or (self._lookup(name) or {}).get('id')
+        media = MediaFileUpload(path, mimetype=mimetype, resumable=True)
+        if file_id:
+            request = self.service.files().update(fileId=file_id, media_body=media, fields=self.FIELDS)
+        else:
+            body = {'name': name, 'parents': parents} if parents else {'name': name}
+            request = self.service.files().create(body=body, media_body=media, fields=self.FIELDS)
+        print(f"📤 正在同步 {name} 回雲端 (可續傳模式)...")
+        response = None
+        while response is None:
+            status, response = request.next_chunk()
+            if status:
+                print(f"   > 進度: {int(status.progress() * 100)}%")
+        if self.state.get(name, {}).get('id') != response['id']:
+            self.state.setdefault(name, {})['id'] = response['id']
+            self._save_state(name)
+        return response
+
+    # ---------- 本機狀態 ----------
+    def _local_matches(self, name, path, meta):
+        if not os.path.exists(path) or not meta.get('md5Checksum'):
+            return False
+        entry = self.state.get(name, {})
+        if entry.get('modifiedTime') == meta.get('modifiedTime') and entry.get('md5') == meta['md5Checksum']:
+            if self._unchanged_since_sync(entry, path):
+                return True
+        if meta.get('size') is not None and os.path.getsize(path) != int(meta['size']):
+            return False
+        return self._local_md5(name, path) == meta['md5Checksum']
+
+    def _local_md5(self, name, path):
+        entry = self.state.get(name, {})
+        if entry.get('md5') and self._unchanged_since_sync(entry, path):
+            return entry['md5']
+        return file_md5(path)
+
+    @staticmethod
+    def _unchanged_since_sync(entry, path):
+        stat = os.stat(path)
+        return entry.get('size') == stat.st_size and entry.get('mtime_ns') == stat.st_mtime_ns
+
+    def _remember(self, name, meta, path):
+        """ 記錄雲端版本 (id / md5 / modifiedTime) 與同步當下的本機檔案大小、mtime """
+        stat = os.stat(path)
+        self.state[name] = {'id': meta.get('id'), 'md5': meta.get('md5Checksum'),
+                            'modifiedTime': meta.get('modifiedTime'), 'size': stat.st_size, 'mtime_ns': stat.st_mtime_ns}
+        self._save_state(name)
+
+    def _save_state(self, name):
+        """ 重新讀取狀態檔後只覆寫 name 的紀錄，不蓋掉其他實例同時寫入的檔案 """
+        with self._state_lock:
+            state = self._load_state()
+            state[name] = self.state[name]
+            partial = f"{self.state_path}.part"
+            with open(partial, "w", encoding="utf-8") as f:
+                json.dump(state, f, ensure_ascii=False, indent=2)
+            os.replace(partial, self.state_path)
+
+    def _load_state(self):
+        if not os.path.exists(self.state_path):
+            return {}
+        try:
+            with open(self.state_path, encoding="utf-8") as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            print(f"⚠️ 同步狀態檔無法讀取，將重新比對: {self.state_path}")
+            return {}
+
+# ==========================================
+# 本機目錄同步層 (離線重跑 / 測試 / orchestrator 本機模式)
+# ==========================================
+class LocalDirSync:
+    """
+    以本機 (或掛載的) 目錄 root 代替 Drive，介面與 DriveSync 相同 (local_path / download / upload)：
+    1. root 內放原始 .db 或壓縮檔 + manifest (格式同 transport.py)；下載時取 mtime 較新者。
+    2. 本機快取與 root 內的版本 md5 相同時略過複製；壓縮版以 manifest 的 raw_md5 比對。
+    3. root 與 cache_dir 相同時直接就地精煉，不複製。
+    """
+
+    def __init__(self, root, cache_dir="."):
+        if not os.path.isdir(root):
+            raise ValueError(f"❌ 同步目錄不存在: {root}")
+        self.root = root
+        self.cache_dir = cache_dir
+        os.makedirs(cache_dir, exist_ok=True)
+
+    def local_path(self, name):
+        return os.path.join(self.cache_dir, name)
+
+    def remote_path(self, name):
+        return os.path.join(self.root, name)
+
+    def download(self, name):
+        """ root 內的版本與本機相同時略過；回傳是否實際複製 """
+        path = self.local_path(name)
+        raw, packed = self.remote_path(name), self.remote_path(manifest_name(name))
+        has_raw, has_packed = os.path.exists(raw), os.path.exists(packed)
+        if not has_raw and not has_packed:
+            raise ValueError(f"❌ 在同步目錄找不到檔案: {raw}")
+        manifest = None
+        if has_packed and (not has_raw or os.path.getmtime(packed) >= os.path.getmtime(raw)):
+            with open(packed, encoding="utf-8") as f:
+                manifest = json.load(f)
+        elif self._same_file(path, raw):
+            return False
+
+        expected = manifest['raw_md5'] if manifest else None
+        if os.path.exists(path):
+            size = manifest['raw_size'] if manifest else os.path.getsize(raw)
+            if os.path.getsize(path) == size and file_md5(path) == (expected or file_md5(raw)):
+                print(f"♻️ 本機快取與同步目錄相同，略過複製: {name}")
+                return False
+
+        if manifest is not None:
+            print(f"📥 解壓 {manifest['artifact']} ({manifest['artifact_size'] / 1e6:.1f} MB，"
+                  f"解壓後 {manifest['raw_size'] / 1e6:.1f} MB)...")
+            decompress_file(self.remote_path(manifest['artifact']), path, manifest)
+        else:
+            print(f"📥 從同步目錄複製 {name}...")
+            self._copy(raw, path)
+        print(f"✅ {name} 下載成功")
+        return True
+
+    def upload(self, name, mimetype='application/octet-stream', codec=None, keep_raw=False):
+        """
+        root 內已是相同內容時略過；回傳是否實際寫入。
+        codec = 'gzip' / 'zstd' 時改寫壓縮檔 + manifest；keep_raw = True 時另同步原始 .db (順序同 DriveSync.upload)。
+        """
+        path = self.local_path(name)
+        target = self.remote_path(name)
+        if codec is None:
+            if self._same_file(path, target):
+                return False
+            if os.path.exists(target) and os.path.getsize(target) == os.path.getsize(path) \
+                    and file_md5(target) == file_md5(path):
+                print(f"♻️ {name} 與同步目錄版本相同，略過上傳")
+                return False
+            print(f"📤 正在同步 {name} 至 {self.root}...")
+            self._copy(path, target)
+            _report_uploaded([os.path.getsize(path)])
+            return True
+
+        manifest_path = self.remote_path(manifest_name(name))
+        if os.path.exists(manifest_path):
+            with open(manifest_path, encoding="utf-8") as f:
+                current = json.load(f)
+            if current.get('codec') == codec and current.get('raw_md5') == file_md5(path):
+                print(f"♻️ {name} 與同步目錄版本相同，略過上傳")
+                return False
+        manifest = compress_file(path, self.remote_path(artifact_name(name, codec)), codec)
+        print(f"🗜️ {codec} 壓縮：{manifest['raw_size'] / 1e6:.1f} MB -> {manifest['artifact_size'] / 1e6:.1f} MB "
+              f"({manifest['artifact_size'] / max(manifest['raw_size'], 1):.0%})")
+        sent = [manifest['artifact_size']]
+        if keep_raw and not self._same_file(path, target):
+            print(f"📤 正在同步 {name} 至 {self.root}...")
+            self._copy(path, target)
+            sent.append(manifest['raw_size'])
+        partial = f"{manifest_path}.part"
+        with open(partial, "w", encoding="utf-8") as f:
+            json.dump(manifest, f, ensure_ascii=False, indent=2)
+        os.replace(partial, manifest_path)
+        sent.append(os.path.getsize(manifest_path))
+        _report_uploaded(sent)
+        return True
+
+    @staticmethod
+    def _same_file(a, b):
+        return os.path.exists(a) and os.path.exists(b) and os.path.samefile(a, b)
+
+    @staticmethod
+    def _copy(src, dst):
+        partial = f"{dst}.part"  # 先寫暫存檔，中斷時不會留下半個檔案
+        shutil.copyfile(src, partial)
+        os.replace(partial, dst)
@@ -1,23 +1,66 @@
 # -*- coding: utf-8 -*-
 import os
 import sqlite3
+import numpy as np
 import pandas as pd
 from googleapiclient.discovery import build
-from googleapiclient.http import MediaFileUpload, MediaIoBaseDownload
 from google.oauth2.service_account import Credentials
-import io
 import json
+import hashlib
+import zlib
 
 # 導入自定義模組
 from market_rules import MarketRuleRouter
 from core_engine import AlphaCoreEngine
+from drive_sync import DriveSync, LocalDirSync
+from transport import check_codec
+from metric_registry import METRICS
+from stage_profiler import StageProfiler
+
+def _text_crc32(value):
+    """ 指紋用：文字值完整內容的 CRC32 """
+    return zlib.crc32(str(value).encode("utf-8"))
+
 
 class AlphaDataPipeline:
-    def __init__(self, market_abbr):
+    STATE_TABLE = "refine_state"      # 精煉狀態 (原始數據指紋) 隨 .db 一起上傳
+    FINGERPRINT_WEIGHT_MOD = 65521    # 指紋的列位權重 (rowid 取餘數)：同樣的值換到別列也會改變加總
+
+    def __init__(self, market_abbr, incremental=False, memory_budget_mb=None, workers=1, compact=False,
+                 columnar_dir=None, start_date=None, end_date=None, symbols=None, backend="pandas", force=False,
+                 cache_dir=".", transport=None, keep_raw=False, storage=None):
         self.market_abbr = market_abbr.upper()
+        self.incremental = incremental
+        self.memory_budget_mb = memory_budget_mb
+        self.workers = workers
+        self.compact = compact
+        self.columnar_dir = columnar_dir
+        # 指定重跑範圍 (上游修正個股/區間時只改寫受影響的列)
+        self.start_date = start_date
+        self.end_date = end_date
+        self.symbols = symbols
+        self.backend = backend
+        self.force = force # True = 原始數據未變動也照常精煉與上傳
+        self.transport = transport # None = 只上傳原始 .db；'gzip' / 'zstd' = 改上傳壓縮檔 + manifest (transport.py)
+        self.keep_raw = keep_raw # 壓縮傳輸時是否仍同步原始 .db (供直接讀原始檔的外部程式；上傳量增加)
+        if transport:
+            check_codec(transport) # 無效或缺少套件時在下載/精煉前就報錯
         self.db_name = f"{self.market_abbr.lower()}_stock_warehouse.db"
-        self.creds = self._load_credentials()
-        self.service = build('drive', 'v3', credentials=self.creds)
+        self.db_path = os.path.join(cache_dir, self.db_name) # 本機工作檔 (快取目錄內，與雲端版本比對後沿用)
+        self.summary_stem = f"summary_{self.db_name.replace('.db', '')}"
+        self.profiler = StageProfiler()
+        self.cache_dir = cache_dir
+        # 同步後端 (DriveSync / LocalDirSync)；None = 第一次下載/上傳時才以服務帳號連線 Drive，
+        # 只做精煉的子行程 (orchestrator) 不需要憑證
+        self._sync = storage
+
+    @property
+    def sync(self):
+        if self._sync is None:
+            self.creds = self._load_credentials()
+            self.service = build('drive', 'v3', credentials=self.creds)
+            self._sync = DriveSync(self.service, self.cache_dir)
+        return self._sync
 
     def _load_credentials(self):
         creds_json = os.environ.get("GDRIVE_SERVICE_ACCOUNT")
@@ -26,23 +69,11 @@ class AlphaDataPipeline:
         return Credentials.from_service_account_info(json.loads(creds_json))
 
     def find_file_id_by_name(self, filename):
-        query = f"name = '{filename}' and trashed = false"
-        results = self.service.files().list(q=query, fields="files(id, name)").execute()
-        files = results.get('files', [])
-        if not files:
-            raise ValueError(f"❌ 在雲端找不到檔案: {filename}")
-        return files[0]['id']
+        return self.sync.remote_meta(filename)['id']
 
     def download_db(self):
-        file_id = self.find_file_id_by_name(self.db_name)
-        print(f"📥 偵測到雲端檔案 ID: {file_id}，開始下載...")
-        request = self.service.files().get_media(fileId=file_id)
-        fh = io.FileIO(self.db_name, 'wb')
-        downloader = MediaIoBaseDownload(fh, request)
-        done = False
-        while not done:
-            status, done = downloader.next_chunk()
-        print(f"✅ {self.db_name} 下載成功")
+        """ 雲端版本與本機快取相同時略過下載 """
+        return self.sync.download(self.db_name)
 
     def _ensure_schema_upgraded(self, conn):
         cursor = conn.cursor()
@@ -57,27 +88,133 @@ class AlphaDataPipeline:
             except Exception as e:
                 print(f"⚠️ 欄位新增異常 (可能已存在): {e}")
 
+    def _format_index_sizes(self, sizes):
+        """ 索引大小摘要 (顯示上傳體積的取捨) """
+        if not sizes:
+            return "📐 索引大小：無法取得 (SQLite 未支援 dbstat)"
+        db_size = os.path.getsize(self.db_path)
+        total = sum(sizes.values())
+        for name, size in sorted(sizes.items()):
+            print(f"   > {name}: {size / 1e6:.1f} MB")
+        return f"📐 索引大小：{total / 1e6:.1f} MB (佔資料庫 {total / db_size:.0%})"
+
     def upload_db(self):
-        file_id = self.find_file_id_by_name(self.db_name)
-        media = MediaFileUpload(self.db_name, mimetype='application/octet-stream', resumable=True)
-        request = self.service.files().update(fileId=file_id, media_body=media)
-        
-        print(f"📤 正在同步回雲端 (可續傳模式)...")
-        response = None
-        while response is None:
-            status, response = request.next_chunk()
-            if status:
-                print(f"   > 進度: {int(status.progress() * 100)}%")
-        print(f"✅ {self.market_abbr} 雲端同步成功")
+        """ 本機檔案與上次同步的雲端版本相同時略過上傳 """
+        if self.sync.upload(self.db_name, codec=self.transport, keep_raw=self.keep_raw):
+            print(f"✅ {self.market_abbr} 雲端同步成功")
+
+    # ---------- 原始數據指紋 ----------
+    def _raw_fingerprint(self, conn):
+        """
+        原始數據的指紋，在 SQLite 內以單一彙總查詢算出 (數據不經過 Python)：
+        stock_prices 的列數、最新日期、最大 rowid，以及逐欄加總 / rowid 加權加總 (與列順序無關)；
+        文字欄 (代號) 依相異值分組，每個值只在 Python 算一次完整內容的 CRC32，
+        再乘上該組列數 / 權重和 (代號中段改一碼也會改變指紋)；
+        stock_info 的雜湊 (MarketType、產業會影響漲停判定與產業彙總)；
+        另含衍生欄位清單，註冊表變動時視為不同 (需重新精煉)。
+        """
+        columns = conn.execute("PRAGMA table_info(stock_prices)").fetchall()
+        weight = f"(rowid % {self.FINGERPRINT_WEIGHT_MOD} + 1)"
+        sums, texts = [], []
+        for _, name, decl_type, *_ in columns:
+            if decl_type.upper() in ("REAL", "INTEGER", "FLOAT", "NUMERIC"):
+                value = f"[{name}]"
+            elif name == "date":
+                value = "julianday([date])"
+            else:
+                texts.append(f"[{name}]")
+                continue
+            sums += [f"TOTAL({value})", f"TOTAL({value} * {weight})"]
+        group_by = f" GROUP BY {', '.join(texts)}" if texts else ""
+        groups = conn.execute(f"SELECT COUNT(*), MAX(date), MAX(rowid), SUM({weight}), {', '.join(texts + sums)} "
+                              f"FROM stock_prices{group_by}").fetchall()
+        rows = sum(g[0] for g in groups)
+        max_date = max((g[1] for g in groups if g[1] is not None), default=None)
+        max_rowid = max((g[2] for g in groups if g[2] is not None), default=None)
+        n_texts = len(texts)
+        totals = [sum(g[4 + n_texts + i] for g in groups) for i in range(len(sums))]
+        for i in range(n_texts):
+            hashed = [(_text_crc32(g[4 + i]), g) for g in groups if g[4 + i] is not None]
+            totals += [sum(h * g[0] for h, g in hashed), sum(h * g[3] for h, g in hashed)]
+        checksum = hashlib.md5(json.dumps([repr(v) for v in totals]).encode("utf-8")).hexdigest()[:16]
+        metrics = hashlib.md5(json.dumps(METRICS.columns, ensure_ascii=False).encode("utf-8")).hexdigest()[:12]
+        return {'rows': rows, 'max_date': max_date, 'max_rowid': max_rowid, 'checksum': checksum,
+                'info': self._info_fingerprint(conn), 'metrics': metrics}
+
+    @staticmethod
+    def _info_fingerprint(conn):
+        """ stock_info 的內容雜湊 (表小，整表讀出)；沒有此表時回傳 None """
+        if not conn.execute("SELECT name FROM sqlite_master WHERE type='table' AND name='stock_info'").fetchone():
+            return None
+        info = pd.read_sql("SELECT * FROM stock_info", conn)
+        info = info[sorted(info.columns)]
+        checksum = int(pd.util.hash_pandas_object(info, index=False).to_numpy().sum(dtype=np.uint64))
+        return f"{checksum:016x}"
+
+    def _stored_fingerprint(self, conn):
+        """ 上次完整精煉時記錄的指紋；沒有狀態表或加工表時回傳 None """
+        tables = {r[0] for r in conn.execute("SELECT name FROM sqlite_master WHERE type='table'")}
+        if self.STATE_TABLE not in tables or 'cleaned_daily_base' not in tables:
+            return None
+        row = conn.execute(f"SELECT value FROM {self.STATE_TABLE} WHERE key = 'raw_fingerprint'").fetchone()
+        return json.loads(row[0]) if row else None
+
+    def _save_fingerprint(self, conn, fingerprint):
+        conn.execute(f"CREATE TABLE IF NOT EXISTS {self.STATE_TABLE} (key TEXT PRIMARY KEY, value TEXT)")
+        conn.execute(f"INSERT OR REPLACE INTO {self.STATE_TABLE} (key, value) VALUES ('raw_fingerprint', ?)",
+                     (json.dumps(fingerprint),))
+        conn.commit()
+
+    def _write_summary(self, summary_msg):
+        summary_file = f"{self.summary_stem}.txt"
+        with open(summary_file, "w", encoding="utf-8") as f:
+            f.write(str(summary_msg))
+        print(f"📄 摘要報告已生成: {summary_file}")
+
+    def _write_profile(self, status):
+        """ 分段計時以 JSON 存在 summary_*.txt 旁，並印出精簡表格 """
+        profile_file = f"{self.summary_stem}.json"
+        db_size = os.path.getsize(self.db_path) if os.path.exists(self.db_path) else None
+        self.profiler.write_json(profile_file, market=self.market_abbr, status=status,
+                                 incremental=self.incremental, workers=self.workers, db_bytes=db_size)
+        # 引擎分段已由 engine.execute() 印出，這裡只列 pipeline 層級的階段
+        print(self.profiler.format_table(skip_prefix="engine."))
+        print(f"⏱️ 分段計時已寫入: {profile_file}")
 
     def run_process(self):
         """
         🚀 整合後的執行流程：下載 -> 偵察日期 -> 計算 -> 上傳
+        (多市場交錯執行見 orchestrator.py，各階段沿用 download_db / refine / upload_db)
         """
+        prof = self.profiler
         # 1. 下載雲端 DB
-        self.download_db()
-        
-        conn = sqlite3.connect(self.db_name)
+        with prof.stage("download"):
+            self.download_db()
+
+        try:
+            status, summary_msg = self.refine()
+            # 5. 同步上傳回雲端 (略過精煉時雲端版本不變，不需上傳)
+            if status == "ok":
+                with prof.stage("upload"):
+                    self.upload_db()
+        except Exception as e:
+            print(f"❌ 流程執行失敗: {e}")
+            self._write_profile("failed")
+            raise e
+
+        # 6. 生成摘要報告
+        self._write_summary(summary_msg)
+        self._write_profile(status)
+        return summary_msg
+
+    def refine(self):
+        """
+        在已下載的本機 .db 上偵察日期、比對指紋並精煉，回傳 (狀態, 摘要)：
+        狀態 'ok' = 已精煉需上傳；'skipped' = 原始數據未變動，略過精煉與上傳
+        """
+        prof = self.profiler
+        conn = sqlite3.connect(self.db_path)
+        engine = None
         try:
             # 💡 [新增] 資料狀態偵察：檢查原始資料 vs 加工資料
             cursor = conn.cursor()
@@ -112,40 +249,100 @@ class AlphaDataPipeline:
                 print(f"🚀 偵測到日期差！準備將加工表更新至 {raw_date}")
             print("="*50 + "\n")
 
-            # 2. 自動升級資料庫結構
-            self._ensure_schema_upgraded(conn)
+            # 2. 原始數據與上次完整精煉時相同 -> 略過精煉與上傳 (指定範圍重跑或 force 時一律執行)
+            targeted = bool(self.start_date or self.end_date or self.symbols)
+            with prof.stage("fingerprint") as rec:
+                fingerprint = self._raw_fingerprint(conn)
+                rec['rows'] = fingerprint['rows']
+            if not targeted and not self.force and fingerprint == self._stored_fingerprint(conn):
+                conn.close()
+                summary_msg = (f"⏭️ {self.market_abbr} 原始數據未變動 ({fingerprint['rows']:,} 列，"
+                               f"最新 {fingerprint['max_date']})，略過精煉與上傳")
+                print(summary_msg)
+                return "skipped", summary_msg
+
+            # 3. 自動升級資料庫結構
+            with prof.stage("schema_upgrade"):
+                self._ensure_schema_upgraded(conn)
 
-            # 3. 執行核心精煉引擎 (計算技術指標、Alpha 標籤等)
+            # 4. 執行核心精煉引擎 (計算技術指標、Alpha 標籤等)
             print(f"⚙️  啟動 AlphaCoreEngine 進行數據精煉...")
             rules = MarketRuleRouter.get_rules(self.market_abbr)
-            engine = AlphaCoreEngine(conn, rules, self.market_abbr)
-            summary_msg = engine.execute()
+            engine = AlphaCoreEngine(conn, rules, self.market_abbr, incremental=self.incremental,
+                                     memory_budget_mb=self.memory_budget_mb, workers=self.workers,
+                                     compact=self.compact, columnar_dir=self.columnar_dir,
+                                     start_date=self.start_date, end_date=self.end_date, symbols=self.symbols,
+                                     backend=self.backend)
+            with prof.stage("engine"):
+                summary_msg = engine.execute()
+            prof.merge(engine.profiler, prefix="engine.")
+            summary_msg = f"{summary_msg}\n{self._format_index_sizes(engine.index_sizes())}"
+            if not targeted:
+                self._save_fingerprint(conn, fingerprint)
             
             # 重要：先關閉連線，確保檔案未被鎖定，才能順利上傳
             conn.close()
-            
-            # 4. 同步上傳回雲端
-            self.upload_db()
-            
-            # 5. 生成摘要報告
-            summary_file = f"summary_{self.db_name.replace('.db', '')}.txt"
-            with open(summary_file, "w", encoding="utf-8") as f:
-                f.write(str(summary_msg))
-            
-            print(f"📄 摘要報告已生成: {summary_file}")
-            return summary_msg
+            return "ok", summary_msg
 
-        except Exception as e:
+        except Exception:
             if conn:
                 conn.close()
-            print(f"❌ 流程執行失敗: {e}")
-            raise e
+            if engine is not None:
+                prof.merge(engine.profiler, prefix="engine.")
+            raise
+
+# ==========================================
+# 環境變數設定 (main_pipeline.py 與 orchestrator.py 共用)
+# ==========================================
+def pipeline_options_from_env():
+    """ REFINE_* 環境變數 -> AlphaDataPipeline 參數 (皆可 pickle，可交給精煉子行程) """
+    # REFINE_MODE=incremental 時只精煉新交易日 (預設完整重算)
+    refine_mode = os.environ.get("REFINE_MODE", "full").lower()
+    # REFINE_MEMORY_MB 設定後改為分批串流精煉，限制峰值記憶體 (適合小型 runner)
+    memory_mb = os.environ.get("REFINE_MEMORY_MB")
+    # REFINE_WORKERS > 1 時依 StockID 分片平行精煉 (輸出與單行程一致)
+    workers = int(os.environ.get("REFINE_WORKERS", "1"))
+    # REFINE_COMPACT=1 時使用類別/int8/int16 精簡型別 (無損，寫入數值與預設相同)
+    compact = os.environ.get("REFINE_COMPACT", "0") == "1"
+    # REFINE_COLUMNAR_DIR 設定後於該目錄輸出 market=XX/year=YYYY 分區的 Parquet 副本 (需 pyarrow)
+    columnar_dir = os.environ.get("REFINE_COLUMNAR_DIR") or None
+    # REFINE_START_DATE / REFINE_END_DATE / REFINE_SYMBOLS (逗號分隔) 設定後只重跑該範圍 (完整模式下生效)
+    start_date = os.environ.get("REFINE_START_DATE") or None
+    end_date = os.environ.get("REFINE_END_DATE") or None
+    symbols = [s.strip() for s in os.environ.get("REFINE_SYMBOLS", "").split(",") if s.strip()] or None
+    # REFINE_BACKEND=sql 時以 SQLite 視窗函數在資料庫內精煉 (單行程，數據不載入 pandas)
+    backend = os.environ.get("REFINE_BACKEND", "pandas").lower()
+    if backend == "sql":
+        workers = 1
+    # REFINE_FORCE=1 時即使原始數據未變動也照常精煉與上傳
+    force = os.environ.get("REFINE_FORCE", "0") == "1"
+    # REFINE_CACHE_DIR：.db 與同步狀態的本機快取目錄；雲端版本相同時不重新下載 (預設目前目錄)
+    cache_dir = os.environ.get("REFINE_CACHE_DIR") or "."
+    # REFINE_TRANSPORT=gzip / zstd 時改上傳壓縮檔 + manifest (下載端自動辨識較新版本並串流解壓)
+    transport = os.environ.get("REFINE_TRANSPORT", "raw").lower()
+    transport = None if transport == "raw" else transport
+    # REFINE_TRANSPORT_KEEP_RAW=1 時壓縮傳輸仍另外上傳原始 .db (供直接讀取原始檔的外部程式)
+    keep_raw = os.environ.get("REFINE_TRANSPORT_KEEP_RAW", "0") == "1"
+    targeted = bool(start_date or end_date or symbols)
+    return dict(incremental=(refine_mode == "incremental" and not targeted),
+                memory_budget_mb=float(memory_mb) if memory_mb else None,
+                workers=workers, compact=compact, columnar_dir=columnar_dir,
+                start_date=start_date, end_date=end_date, symbols=symbols, backend=backend,
+                force=force, cache_dir=cache_dir, transport=transport, keep_raw=keep_raw)
+
+
+def storage_from_env(cache_dir="."):
+    """ REFINE_STORAGE_DIR 設定後改以該目錄為同步後端 (LocalDirSync)；未設定回傳 None (使用 Drive) """
+    storage_dir = os.environ.get("REFINE_STORAGE_DIR")
+    return LocalDirSync(storage_dir, cache_dir) if storage_dir else None
+
 
 if __name__ == "__main__":
     target_market = os.environ.get("MARKET_TYPE")
     if not target_market:
         print("❌ 錯誤：未設定 MARKET_TYPE")
         exit(1)
-    
-    pipeline = AlphaDataPipeline(target_market)
+
+    options = pipeline_options_from_env()
+    pipeline = AlphaDataPipeline(target_market, storage=storage_from_env(options['cache_dir']), **options)
     pipeline.run_process()
@@ -2,125 +2,229 @@
 import pandas as pd
 import numpy as np
 
+# ==========================================
+# 各市場漲停規則表 (宣告式)
+# ==========================================
+# limit:        漲停門檻 (漲幅)
+# basis:        'price' = 收盤 >= 前收 x (1 + limit)；'return' = 收盤 / 前收 - 1 >= limit
+# failed:       炸板判定門檻 failed_lu_threshold (提供給 Deep_Scan 使用)
+# boards:       代號前綴覆寫 [(前綴, limit, failed)]，例如中國創業板/科創板 20%
+# exclude_prefixes / exclude_market_types: 不判定漲停的標的 (ETF、興櫃)
+# close_at_high: 需收在最高價才算漲停 (日本強勢特徵)
+MARKET_RULES = {
+    'TW': {'limit': 0.095, 'basis': 'price', 'failed': 0.095,            # 上市櫃 10%，ETF/興櫃不判定
+           'exclude_prefixes': ('00',), 'exclude_market_types': ('ETF', '興櫃', 'ROTC')},
+    'US': {'limit': 0.098, 'basis': 'return', 'failed': 0.095},          # 無漲停限制，以 10% 作為強勢標記
+    'CN': {'limit': 0.095, 'basis': 'price', 'failed': 0.095,            # 主板 10%，創業板/科創板 20%
+           'boards': [(('30', '68'), 0.195, 0.195)]},
+    'JP': {'limit': 0.08, 'basis': 'return', 'failed': 0.075, 'close_at_high': True},
+    'KR': {'limit': 0.295, 'basis': 'price', 'failed': 0.295},           # 30% 限制
+}
+GENERIC_RULE = {'limit': 0.095, 'basis': 'return', 'failed': 0.095}     # HK 或其他市場：9.5% 為強勢標記
+
+
+def _rule(market):
+    rule = dict(GENERIC_RULE)
+    rule.update(MARKET_RULES.get(str(market).upper(), {}))
+    return rule
+
+
+def _stock_runs(ids):
+    """ StockID 欄位中連續相同代號的分段 -> (每段起點, 每段列數, 每段代號)；前綴只需在每檔代號上判斷一次 """
+    if isinstance(ids.dtype, pd.CategoricalDtype):
+        codes = ids.cat.codes.to_numpy()
+        starts = np.flatnonzero(np.r_[True, codes[1:] != codes[:-1]])
+        uniques = ids.cat.categories[codes[starts]]
+    else:
+        # pyarrow 字串直接比較 ExtensionArray；Python 字串轉成 object 陣列比較較快
+        values = ids.array if getattr(ids.dtype, 'storage', None) == 'pyarrow' else ids.to_numpy()
+        starts = np.flatnonzero(np.r_[True, np.asarray(values[1:] != values[:-1], dtype=bool)])
+        uniques = values[starts]
+    lengths = np.diff(np.r_[starts, len(ids)])
+    return starts, lengths, pd.Index(uniques)
+
+
+def _is_sorted(df, starts, uniques):
+    """ 是否已依 (StockID, 日期) 排序：每檔只出現一段、代號遞增、段內日期不遞減 """
+    if not (uniques.is_unique and uniques.is_monotonic_increasing):
+        return False
+    dates = df['日期'].to_numpy()
+    new_stock = np.zeros(len(df), dtype=bool)
+    new_stock[starts] = True
+    return bool(np.all((dates[1:] >= dates[:-1]) | new_stock[1:]))
+
+
 class MarketRuleRouter:
     """
     市場規則路由：負責數據清洗、各國漲停板判定、以及異常值剔除。
     此版本整合了：
-    1. 乒乓清洗 (Ping-pong Cleaning): 剔除減資、除權息錯誤等 40% 以上的極端數據。
-    2. 多國漲停門檻: 支援台、美、中、日、港、韓。
+    1. 乒乓清洗 (Ping-pong Cleaning): 反覆剔除減資、除權息錯誤等 40% 以上的極端數據，並修正前收。
+    2. 多國漲停門檻: 依 MARKET_RULES 表一次向量化判定 (台、美、中、日、港、韓)。
     3. 炸板門檻設定: 支援 AI 診斷所需的 failed_lu_threshold。
+    4. 混合市場: 指定 market_col 時，每列依該欄的市場代碼套用各自的規則。
     """
 
-    def __init__(self, market_type="TW"):
+    def __init__(self, market_type="TW", market_col=None):
         self.market_type = market_type.upper()
+        self.market_col = market_col # 混合市場數據中標示市場代碼的欄位 (缺值時沿用 market_type)
         # 設置 40% 為乒乓清洗門檻，這只會剔除數據異常，絕對不會刪到 10% 的漲停板
         self.PINGPONG_THRESHOLD = 0.40
+        self.MAX_CLEAN_PASSES = 10 # 反覆清洗的輪數上限 (連續異常通常 2~3 輪內收斂)
 
     @classmethod
     def get_rules(cls, market_abbr):
         return cls(market_type=market_abbr)
 
-    def apply(self, df):
-        """ 執行完整清洗與規則應用流程 """
+    def limit_rule(self):
+        """ 本市場在 MARKET_RULES 中的規則 (未列出的市場套用 GENERIC_RULE)，供 SQL 路徑轉成運算式 """
+        return _rule(self.market_type)
+
+    def apply(self, df, audit=None):
+        """ 執行完整清洗與規則應用流程 (audit 為 list 時附加本次剔除明細 DataFrame) """
         if df.empty:
             return df
 
-        # 1. 確保數據基礎排序
-        df = df.sort_values(['StockID', '日期']).reset_index(drop=True)
-        
-        # 2. 建立基礎價格欄位 (若 core_engine 尚未計算則補上)
-        if 'Prev_Close' not in df.columns:
-            df['Prev_Close'] = df.groupby('StockID')['收盤'].shift(1)
-
-        # 3. 🚨 執行【乒乓異常數據清洗】 (防止數據污染 AI 診斷)
-        df = self._clean_pingpong_data(df)
-
-        # 4. 根據市場分發規則 (計算 is_limit_up 與 failed_lu_threshold)
-        if self.market_type == "TW":
-            return self._apply_taiwan_rules(df)
-        elif self.market_type == "US":
-            return self._apply_us_rules(df)
-        elif self.market_type == "CN":
-            return self._apply_china_rules(df)
-        elif self.market_type == "KR":
-            return self._apply_korea_rules(df)
-        elif self.market_type == "JP":
-            return self._apply_japan_rules(df)
+        # 1. 確保數據基礎排序 (引擎讀入時已排序則略過整表排序副本)
+        starts, lengths, uniques = _stock_runs(df['StockID'])
+        if not _is_sorted(df, starts, uniques):
+            df = df.sort_values(['StockID', '日期']).reset_index(drop=True)
+            starts, lengths, uniques = _stock_runs(df['StockID'])
+        elif not df.index.equals(pd.RangeIndex(len(df))):
+            df = df.reset_index(drop=True)
         else:
-            return self._apply_generic_rules(df)
-
-    def _clean_pingpong_data(self, df):
-        """ 專業清洗：剔除極端異常震盪 (如未還原的減資) """
-        # 計算臨時漲跌幅
-        df['temp_ret'] = (df['收盤'] / df['Prev_Close']) - 1
-        
-        # 偵測條件：當日漲跌 > 40% 且 次日漲跌 > 40% 且 方向相反 (乒乓效應)
-        prev_ret = df['temp_ret']
-        next_ret = df.groupby('StockID')['temp_ret'].shift(-1)
-        
-        mask_pingpong = (prev_ret.abs() > self.PINGPONG_THRESHOLD) & \
-                        (next_ret.abs() > self.PINGPONG_THRESHOLD) & \
-                        (prev_ret * next_ret < 0)
-        
-        # 剔除受污染的數據點
-        initial_count = len(df)
-        df = df[~mask_pingpong].copy()
-        
-        df.drop(columns=['temp_ret'], inplace=True)
-        # 註：這只會刪除極少數的異常跳空，不會影響正常交易數據
-        return df
+            # 以下只做整欄指派 (Prev_Close / is_limit_up ...)，淺複製即可不改動呼叫端的 DataFrame
+            df = df.copy(deep=False)
+
+        # 2. 🚨 執行【乒乓異常數據清洗】 (防止數據污染 AI 診斷)，同時建立/修正 Prev_Close
+        df, removed, lengths = self._clean_pingpong_data(df, starts, lengths, uniques)
+        if audit is not None:
+            audit.append(removed)
 
-    def _apply_taiwan_rules(self, df):
-        """ 台灣市場：上市櫃 10%, 興櫃標註強勢 """
-        is_etf = df['StockID'].str.startswith('00')
-        if 'MarketType' in df.columns:
-            is_etf = is_etf | (df['MarketType'] == 'ETF')
-            is_rotc = df['MarketType'].isin(['興櫃', 'ROTC'])
+        # 3. 依規則表判定 is_limit_up 與 failed_lu_threshold (沿用已算好的每檔分段)
+        return self._apply_limit_rules(df, lengths, uniques)
+
+    def _clean_pingpong_data(self, df, starts, lengths, uniques):
+        """
+        專業清洗：剔除極端異常震盪 (如未還原的減資)，反覆執行直到沒有新的異常點。
+        偵測條件：當日漲跌 > 40% 且 次日漲跌 > 40% 且 方向相反 (乒乓效應)。
+        每輪剔除後，下一筆的前收改指向同股票前一筆保留的收盤，避免以異常價作為基準。
+        全程以 numpy 陣列與保留列位置運算，最後只在有剔除時取一次子集。
+        回傳 (清洗後 df, 剔除明細 DataFrame, 清洗後每檔列數)。
+        """
+        close = df['收盤'].to_numpy(dtype=np.float64)
+        stock = np.repeat(np.arange(len(starts)), lengths)
+        first_row = np.zeros(len(df), dtype=bool)
+        first_row[starts] = True
+        # 2a. 建立基礎價格欄位 (若 core_engine 尚未計算則補上)
+        if 'Prev_Close' in df.columns:
+            prev_close = df['Prev_Close'].to_numpy(dtype=np.float64, copy=True)
         else:
-            is_rotc = False
-
-        # 判定漲停 (10% 門檻)
-        df['is_limit_up'] = 0
-        mask_lu = (~is_etf) & (~is_rotc) & (df['收盤'] >= df['Prev_Close'] * 1.095)
-        df.loc[mask_lu, 'is_limit_up'] = 1
-        
-        # 設定炸板判定門檻 (提供給 Deep_Scan 使用)
-        df['failed_lu_threshold'] = 0.095
-        return df
+            prev_close = np.r_[np.nan, close[:-1]]
+            prev_close[first_row] = np.nan
 
-    def _apply_us_rules(self, df):
-        """ 美國市場：無漲停限制，以 10% 作為強勢標記 """
-        df['is_limit_up'] = ((df['收盤'] / df['Prev_Close'] - 1) >= 0.098).astype(int)
-        df['failed_lu_threshold'] = 0.095
-        return df
+        alive = np.arange(len(df)) # 目前保留列的位置
+        removed = []
+        for n_pass in range(1, self.MAX_CLEAN_PASSES + 1):
+            alive_close, alive_stock = close[alive], stock[alive]
+            with np.errstate(divide='ignore', invalid='ignore'):
+                ret = alive_close / prev_close[alive] - 1
+            same_next = np.r_[alive_stock[1:] == alive_stock[:-1], False]
+            next_ret = np.where(same_next, np.r_[ret[1:], np.nan], np.nan)
+            with np.errstate(invalid='ignore'):
+                hit = (np.abs(ret) > self.PINGPONG_THRESHOLD) & \
+                      (np.abs(next_ret) > self.PINGPONG_THRESHOLD) & \
+                      (ret * next_ret < 0)
+            if not hit.any():
+                break
+            rows = alive[hit]
+            removed.append(pd.DataFrame({
+                'StockID': np.asarray(uniques, dtype=object)[stock[rows]],
+                '日期': df['日期'].to_numpy()[rows],
+                '收盤': close[rows],
+                'Prev_Close': prev_close[rows],
+                'Ret': ret[hit],
+                'Next_Ret': next_ret[hit],
+                'reason': 'pingpong',
+                'clean_pass': n_pass,
+            }))
 
-    def _apply_china_rules(self, df):
-        """ 中國市場：主板 10%, 創/科 20% """
-        is_20pct = df['StockID'].str.startswith(('30', '68'))
-        df['is_limit_up'] = 0
-        mask_20 = is_20pct & (df['收盤'] >= df['Prev_Close'] * 1.195)
-        mask_10 = (~is_20pct) & (df['收盤'] >= df['Prev_Close'] * 1.095)
-        df.loc[mask_20 | mask_10, 'is_limit_up'] = 1
-        
-        df['failed_lu_threshold'] = 0.095
-        df.loc[is_20pct, 'failed_lu_threshold'] = 0.195
-        return df
+            # 剔除後：前一筆被剔除的保留列，前收改為同股票前一筆保留列的收盤 (無則為空值)
+            pred_removed = np.r_[False, hit[:-1]]
+            kept = ~hit
+            alive, pred_removed = alive[kept], pred_removed[kept]
+            new_pred = np.r_[-1, alive[:-1]]
+            fix = alive[pred_removed]
+            pred = new_pred[pred_removed]
+            valid = (pred >= 0) & (stock[np.maximum(pred, 0)] == stock[fix])
+            prev_close[fix] = np.where(valid, close[np.maximum(pred, 0)], np.nan)
 
-    def _apply_japan_rules(self, df):
-        """ 日本市場：根據漲幅與最高價判定 """
-        # 日本通常以漲幅 > 8% 且收在最高作為強勢特徵
-        df['is_limit_up'] = ((df['收盤'] / df['Prev_Close'] - 1 >= 0.08) & (df['收盤'] == df['最高'])).astype(int)
-        df['failed_lu_threshold'] = 0.075
-        return df
+        audit = pd.concat(removed, ignore_index=True) if removed else pd.DataFrame(
+            {'StockID': pd.Series(dtype=object), '日期': df['日期'].iloc[:0].to_numpy(),
+             '收盤': pd.Series(dtype=np.float64), 'Prev_Close': pd.Series(dtype=np.float64),
+             'Ret': pd.Series(dtype=np.float64), 'Next_Ret': pd.Series(dtype=np.float64),
+             'reason': pd.Series(dtype=object), 'clean_pass': pd.Series(dtype=np.int64)})
 
-    def _apply_korea_rules(self, df):
-        """ 韓國市場：30% 限制 """
-        df['is_limit_up'] = (df['收盤'] >= df['Prev_Close'] * 1.295).astype(int)
-        df['failed_lu_threshold'] = 0.295
-        return df
+        if len(alive) < len(df):
+            # 剔除受污染的數據點 (唯一一次取子集)
+            df = df.iloc[alive]
+            prev_close = prev_close[alive]
+            lengths = np.bincount(stock[alive], minlength=len(lengths))
+        # 註：這只會刪除極少數的異常跳空，不會影響正常交易數據
+        df['Prev_Close'] = prev_close
+        return df, audit, lengths
+
+    def _row_rules(self, df, lengths, uniques):
+        """
+        把規則表展開成 (limit, multiplier, price_basis, failed, close_at_high, excluded)。
+        單一市場時為純量 (直接廣播)；混合市場時依市場代碼查表成逐列陣列。
+        """
+        if self.market_col and self.market_col in df.columns:
+            markets = df[self.market_col].astype(object).where(df[self.market_col].notna(), self.market_type)
+            market_codes, market_names = pd.factorize(markets.astype(str).str.upper())
+            rules = [_rule(m) for m in market_names]
+            lookup = lambda key, default=None: np.array([r.get(key, default) for r in rules])[market_codes]
+            limit, failed = lookup('limit'), lookup('failed')
+            price_basis = lookup('basis') == 'price'
+            close_at_high = lookup('close_at_high', False).astype(bool)
+        else:
+            market_codes, rules = None, [_rule(self.market_type)]
+            rule = rules[0]
+            limit, failed = rule['limit'], rule['failed']
+            price_basis, close_at_high = rule['basis'] == 'price', rule.get('close_at_high', False)
+
+        # 代號前綴：在每檔代號上判斷一次，再依每檔列數展開
+        prefix_mask = lambda prefixes: np.repeat(uniques.str.startswith(prefixes), lengths)
+        excluded = False
+        for code, rule in enumerate(rules):
+            in_market = True if market_codes is None else market_codes == code
+            for prefixes, board_limit, board_failed in rule.get('boards', []):
+                mask = prefix_mask(prefixes) & in_market
+                limit = np.where(mask, board_limit, limit)
+                failed = np.where(mask, board_failed, failed)
+            if rule.get('exclude_prefixes'):
+                excluded = excluded | (prefix_mask(rule['exclude_prefixes']) & in_market)
+            if rule.get('exclude_market_types') and 'MarketType' in df.columns:
+                mask = df['MarketType'].isin(rule['exclude_market_types']).to_numpy()
+                excluded = excluded | (mask & in_market)
+        # 價格基準的倍數取到 6 位小數，與 1.095 / 1.195 / 1.295 等字面值完全一致
+        multiplier = np.round(1 + np.asarray(limit), 6)
+        return limit, multiplier, price_basis, failed, close_at_high, excluded
+
+    def _apply_limit_rules(self, df, lengths, uniques):
+        """ 單次向量化判定所有市場的漲停與炸板門檻 (lengths/uniques 為每檔列數與代號) """
+        limit, multiplier, price_basis, failed, close_at_high, excluded = self._row_rules(df, lengths, uniques)
+
+        close = df['收盤'].to_numpy(dtype=np.float64)
+        prev_close = df['Prev_Close'].to_numpy(dtype=np.float64)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            if np.ndim(price_basis) == 0:
+                is_lu = close >= prev_close * multiplier if price_basis else (close / prev_close - 1) >= limit
+            else:
+                is_lu = np.where(price_basis, close >= prev_close * multiplier, (close / prev_close - 1) >= limit)
+        is_lu = is_lu & ~excluded
+        if np.any(close_at_high):
+            is_lu &= ~close_at_high | (close == df['最高'].to_numpy(dtype=np.float64))
 
-    def _apply_generic_rules(self, df):
-        """ 通用規則：適用於 HK 或其他市場，預設 9.5% 為強勢標記 """
-        df['is_limit_up'] = ((df['收盤'] / df['Prev_Close'] - 1) >= 0.095).astype(int)
-        df['failed_lu_threshold'] = 0.095
+        df['is_limit_up'] = is_lu.astype(np.int64)
+        df['failed_lu_threshold'] = np.broadcast_to(np.asarray(failed, dtype=np.float64), close.shape).copy()
         return df
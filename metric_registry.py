@@ -0,0 +1,236 @@
+# -*- coding: utf-8 -*-
+import numpy as np
+from contextlib import nullcontext
+
+# ==========================================
+# 衍生欄位註冊表 (依賴圖 + 回看/前瞻宣告)
+# ==========================================
+class Metric:
+    """ 一個註冊項目：一次產出一或多個欄位 (共用中間結果的窗口欄位放在同一項) """
+
+    def __init__(self, outputs, inputs, func, lookback=0, forward=0, running=False):
+        self.outputs = tuple(outputs)
+        self.inputs = tuple(inputs)
+        self.func = func
+        self.lookback = lookback # 需往回看的交易日數 (不含輸入欄位本身的回看)
+        self.forward = forward   # 需往後看的交易日數 (增量模式要回補的天數)
+        self.running = running   # 「至今」累計最大值：增量模式需與既有歷史合併
+
+
+class MetricRegistry:
+    """
+    衍生欄位的註冊與排程：
+    1. register 宣告輸出欄位、輸入欄位與回看/前瞻天數。
+    2. resolve 依請求欄位沿依賴圖回溯，只排入需要的項目 (依註冊順序的拓撲排序)。
+    3. lookback / forward 沿依賴鏈累加，供增量模式決定讀取與改寫窗口。
+    不在註冊表內的輸入欄位 (原始價格、規則產出的 is_limit_up / Prev_Close) 視為已存在。
+    """
+
+    def __init__(self):
+        self._metrics = []
+        self._by_output = {}
+
+    def register(self, outputs, inputs=(), lookback=0, forward=0, running=False):
+        outputs = [outputs] if isinstance(outputs, str) else list(outputs)
+
+        def decorator(func):
+            metric = Metric(outputs, inputs, func, lookback, forward, running)
+            for col in outputs:
+                if col in self._by_output:
+                    raise ValueError(f"欄位重複註冊：{col}")
+                self._by_output[col] = metric
+            self._metrics.append(metric)
+            return func
+        return decorator
+
+    @property
+    def columns(self):
+        return [col for m in self._metrics for col in m.outputs]
+
+    def resolve(self, columns=None):
+        """ 回傳計算 columns 所需的項目清單 (相依項目在前)；None = 全部 """
+        if columns is None:
+            return list(self._metrics)
+        unknown = [c for c in columns if c not in self._by_output]
+        if unknown:
+            raise KeyError(f"未註冊的衍生欄位：{unknown}")
+
+        needed, visiting = set(), set()
+
+        def visit(metric):
+            if id(metric) in needed:
+                return
+            if id(metric) in visiting:
+                raise ValueError(f"衍生欄位循環依賴：{metric.outputs}")
+            visiting.add(id(metric))
+            for col in metric.inputs:
+                if col in self._by_output:
+                    visit(self._by_output[col])
+            visiting.discard(id(metric))
+            needed.add(id(metric))
+
+        for col in columns:
+            visit(self._by_output[col])
+        return [m for m in self._metrics if id(m) in needed]
+
+    def _chain(self, metric, attr, memo):
+        """ 沿依賴鏈累加 lookback / forward """
+        key = (id(metric), attr)
+        if key not in memo:
+            upstream = [self._chain(self._by_output[c], attr, memo)
+                        for c in metric.inputs if c in self._by_output]
+            memo[key] = getattr(metric, attr) + max(upstream, default=0)
+        return memo[key]
+
+    def lookback(self, columns=None):
+        memo = {}
+        return max((self._chain(m, 'lookback', memo) for m in self.resolve(columns)), default=0)
+
+    def forward(self, columns=None):
+        memo = {}
+        return max((self._chain(m, 'forward', memo) for m in self.resolve(columns)), default=0)
+
+    def forward_columns(self, columns=None):
+        """ 前瞻天數等於最長前瞻 (forward()) 的欄位：這些欄位為空值代表該列精煉時後面的交易日還不夠 """
+        memo = {}
+        horizon = self.forward(columns)
+        if horizon == 0:
+            return []
+        return [col for m in self.resolve(columns) if self._chain(m, 'forward', memo) == horizon for col in m.outputs]
+
+    def running_columns(self, columns=None):
+        return [col for m in self.resolve(columns) if m.running for col in m.outputs]
+
+    def compute(self, df, segments, columns=None, profiler=None):
+        """ 依排程逐項計算並寫回 df；segments 為共用的 SegmentedRolling 分段邊界 """
+        for metric in self.resolve(columns):
+            timer = profiler.stage(f"metric:{metric.outputs[0]}", rows=len(df)) if profiler else nullcontext()
+            with timer:
+                result = metric.func(df, segments)
+            if len(metric.outputs) == 1 and not isinstance(result, dict):
+                result = {metric.outputs[0]: result}
+            for col in metric.outputs:
+                df[col] = result[col]
+        return df
+
+
+METRICS = MetricRegistry()
+
+# ==========================================
+# 核心報酬與 AI 診斷欄位
+# ==========================================
+@METRICS.register('Ret_Day', inputs=('收盤', 'Prev_Close'), lookback=1)
+def _ret_day(df, seg):
+    return (df['收盤'] / df['Prev_Close']) - 1
+
+@METRICS.register('Ret_High', inputs=('最高', 'Prev_Close'), lookback=1)
+def _ret_high(df, seg):
+    return (df['最高'] / df['Prev_Close']) - 1
+
+@METRICS.register('Overnight_Alpha', inputs=('開盤', 'Prev_Close'), lookback=1)
+def _overnight_alpha(df, seg):
+    return (df['開盤'] / df['Prev_Close']) - 1
+
+@METRICS.register('Prev_LU', inputs=('is_limit_up',), lookback=1)
+def _prev_lu(df, seg):
+    return np.nan_to_num(seg.shift(df['is_limit_up'], 1), nan=0.0)
+
+@METRICS.register('Next_1D_Max', inputs=('Ret_High',), forward=1)
+def _next_1d_max(df, seg):
+    return seg.shift(df['Ret_High'], -1)
+
+# ==========================================
+# 連板計數
+# ==========================================
+@METRICS.register(['Seq_LU_Count', 'Seq_LU_Start'], inputs=('is_limit_up', '日期'))
+def _seq_lu(df, seg):
+    """ 連板天數與本輪連板起始日 (目前位置往回 seq-1 列，未漲停為 NaT) """
+    seq = seg.run_length(df['is_limit_up'] == 1)
+    dates = df['日期'].to_numpy()
+    start_idx = np.arange(len(seq)) - np.maximum(seq - 1, 0)
+    return {
+        'Seq_LU_Count': seq,
+        'Seq_LU_Start': np.where(seq > 0, dates[start_idx], np.datetime64('NaT')),
+    }
+
+@METRICS.register('Max_Seq_LU_Count', inputs=('Seq_LU_Count',), running=True)
+def _max_seq_lu(df, seg):
+    return seg.cummax(df['Seq_LU_Count'].to_numpy())
+
+# ==========================================
+# 區間報酬 (Period_Analysis)
+# ==========================================
+@METRICS.register(['Ret_5D', 'Ret_20D', 'Ret_200D'], inputs=('收盤',), lookback=200)
+def _period_returns(df, seg):
+    rets = seg.pct_change(df['收盤'], [5, 20, 200])
+    return {f'Ret_{d}D': ret for d, ret in rets.items()}
+
+_PERIOD_COLS = ['周累计漲跌幅(本周开盘)', '月累计漲跌幅(本月开盘)', '年累計漲跌幅(本年开盘)']
+
+@METRICS.register(_PERIOD_COLS, inputs=('日期', '開盤', '收盤'), lookback=260)
+def _period_to_date(df, seg):
+    """ 本週/本月/本年至今漲跌幅：以該期間第一個交易日的開盤價為基準 (年初最多約 260 個交易日) """
+    if len(df) == 0:
+        return {col: np.empty(0) for col in _PERIOD_COLS}
+    days = df['日期'].to_numpy().astype('datetime64[D]').astype(np.int64)
+    # 期間代碼先在日曆範圍 (數百天) 上算好，再以天數位移查表，避免逐列做日期換算
+    first_day = days.min()
+    calendar = np.arange(first_day, days.max() + 1)
+    offset = days - first_day
+    period_keys = {
+        '周累计漲跌幅(本周开盘)': ((calendar + 3) // 7)[offset],  # 1970-01-01 為週四，+3 讓週一為一週起點
+        '月累计漲跌幅(本月开盘)': calendar.astype('datetime64[D]').astype('datetime64[M]').astype(np.int64)[offset],
+        '年累計漲跌幅(本年开盘)': calendar.astype('datetime64[D]').astype('datetime64[Y]').astype(np.int64)[offset],
+    }
+    opens = df['開盤'].to_numpy(dtype=np.float64)
+    close = df['收盤'].to_numpy(dtype=np.float64)
+    result = {}
+    for col, keys in period_keys.items():
+        ret = seg.period_first(opens, keys)
+        np.divide(close, ret, out=ret)
+        ret -= 1
+        result[col] = ret
+    return result
+
+# ==========================================
+# 風險欄位 (Risk_Metrics)
+# ==========================================
+@METRICS.register(['volatility_10d', 'volatility_20d', 'volatility_50d'], inputs=('Ret_Day',), lookback=50)
+def _volatility(df, seg):
+    vols = seg.rolling_std(df['Ret_Day'], [10, 20, 50])
+    return {f'volatility_{d}d': vol * np.sqrt(252) for d, vol in vols.items()}
+
+@METRICS.register(['drawdown_after_high_10d', 'drawdown_after_high_20d', 'drawdown_after_high_50d'],
+                  inputs=('最高', '收盤'), lookback=50)
+def _drawdown(df, seg):
+    highs = seg.rolling_max(df['最高'], [10, 20, 50], min_periods=1)
+    return {f'drawdown_after_high_{d}d': (df['收盤'] / high) - 1 for d, high in highs.items()}
+
+@METRICS.register('recovery_from_dd_10d', inputs=('最低', '收盤'), lookback=10)
+def _recovery(df, seg):
+    lows = seg.rolling_min(df['最低'], [10])
+    return (df['收盤'] / lows[10]) - 1
+
+# ==========================================
+# 前瞻標籤 (回測/統計直接讀欄位，不必自我關聯)
+# ==========================================
+FORWARD_DAYS = [1, 3, 5, 10]
+
+@METRICS.register([f'Next_{d}D_Ret' for d in FORWARD_DAYS], inputs=('收盤',), forward=max(FORWARD_DAYS))
+def _forward_returns(df, seg):
+    """ 未來第 d 個交易日收盤相對今日收盤的漲跌幅 (後續不足 d 日為 NaN) """
+    close = df['收盤'].to_numpy(dtype=np.float64)
+    return {f'Next_{d}D_Ret': seg.shift(close, -d) / close - 1 for d in FORWARD_DAYS}
+
+@METRICS.register('Next_Open_Gap', inputs=('開盤', '收盤'), forward=1)
+def _next_open_gap(df, seg):
+    """ 隔日開盤相對今日收盤的跳空幅度 """
+    close = df['收盤'].to_numpy(dtype=np.float64)
+    return seg.shift(df['開盤'], -1) / close - 1
+
+@METRICS.register('Next_5D_MAE', inputs=('最低', '收盤'), forward=5)
+def _next_mae(df, seg):
+    """ 最大不利偏移：未來 5 個交易日最低價相對今日收盤 (需完整 5 日) """
+    close = df['收盤'].to_numpy(dtype=np.float64)
+    lows = seg.rolling_min(df['最低'], [5])[5]  # 第 i 列 = [i-4, i] 的最低，位移 -5 後對齊到 [i+1, i+5]
+    return seg.shift(lows, -5) / close - 1
@@ -0,0 +1,129 @@
+# -*- coding: utf-8 -*-
+"""
+多市場單一行程執行器：下載 / 精煉 / 上傳三段交錯進行
+
+    python -u orchestrator.py TW JP US CN KR HK
+    MARKET_TYPES=TW,JP python -u orchestrator.py
+
+市場 N 在精煉子行程計算時，I/O 執行緒同時下載市場 N+1、上傳市場 N-1；
+六個市場共用一次 Python 啟動與套件安裝，總耗時接近「最慢階段的合計」而非三段相加。
+精煉相關設定沿用 main_pipeline.py 的 REFINE_* 環境變數；REFINE_STORAGE_DIR 設定後改以本機目錄為同步後端。
+"""
+import argparse
+import multiprocessing
+import os
+import sys
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
+from main_pipeline import AlphaDataPipeline, pipeline_options_from_env, storage_from_env
+
+ALL_MARKETS = ["TW", "JP", "US", "CN", "KR", "HK"]
+
+
+def _refine_market(market_abbr, options):
+    """ 精煉子行程：只讀寫本機 .db (不連線雲端)，回傳 (狀態, 摘要, 分段計時) """
+    pipeline = AlphaDataPipeline(market_abbr, **options)
+    with pipeline.profiler.stage("refine"):
+        status, summary_msg = pipeline.refine()
+    return status, summary_msg, pipeline.profiler.stages
+
+# ==========================================
+# 多市場交錯執行
+# ==========================================
+class MarketOrchestrator:
+    """
+    依序處理 markets，三個階段以不同資源並行：
+    1. 下載 / 上傳：io_threads 條 I/O 執行緒 (網路或磁碟)
+    2. 精煉：refine_workers 個常駐子行程 (只啟動一次，pandas 等套件不必每個市場重新載入)
+    3. 預取上限：已開始下載但尚未精煉完成的市場最多 refine_workers + prefetch 個，避免快取目錄同時堆滿所有 .db
+    各市場仍各自寫 summary_*.txt / summary_*.json；單一市場失敗不影響其他市場。
+    """
+
+    def __init__(self, markets, storage=None, io_threads=2, refine_workers=1, prefetch=1, **options):
+        self.markets = [m.upper() for m in markets]
+        self.storage = storage  # 所有市場共用的同步後端；None = 各市場各自連線 Drive
+        self.io_threads = io_threads
+        self.refine_workers = refine_workers
+        self.prefetch = prefetch
+        self.options = options  # AlphaDataPipeline 參數 (會傳給精煉子行程，須可 pickle)
+
+    def run(self):
+        """ 回傳 {市場: (狀態, 摘要)}；狀態為 ok / skipped / failed """
+        pipelines = [AlphaDataPipeline(m, storage=self.storage, **self.options) for m in self.markets]
+        slots = threading.BoundedSemaphore(self.refine_workers + self.prefetch)
+        started = time.perf_counter()
+        # spawn：子行程不 fork 帶著 I/O 執行緒與連線的主行程
+        context = multiprocessing.get_context("spawn")
+        with ThreadPoolExecutor(self.io_threads) as io_pool, \
+                ProcessPoolExecutor(self.refine_workers, mp_context=context) as refiners, \
+                ThreadPoolExecutor(len(pipelines)) as drivers:
+            futures = []
+            for pipeline in pipelines:
+                slots.acquire()  # 依市場順序取得預取名額，前面的市場精煉完才開始下載下一個
+                futures.append(drivers.submit(self._run_market, pipeline, io_pool, refiners, slots))
+            results = {p.market_abbr: f.result() for p, f in zip(pipelines, futures)}
+        self._report(pipelines, results, time.perf_counter() - started)
+        return results
+
+    def _run_market(self, pipeline, io_pool, refiners, slots):
+        market, prof = pipeline.market_abbr, pipeline.profiler
+        try:
+            try:
+                with prof.stage("download"):
+                    io_pool.submit(pipeline.download_db).result()
+                print(f"📦 [{market}] 下載完成，等待精煉...")
+                status, summary_msg, stages = refiners.submit(_refine_market, market, self.options).result()
+            finally:
+                slots.release()
+            prof.stages.update(stages)
+            if status == "ok":
+                with prof.stage("upload"):
+                    io_pool.submit(pipeline.upload_db).result()
+        except Exception as e:
+            print(f"❌ [{market}] 流程執行失敗: {e}")
+            pipeline._write_profile("failed")
+            return "failed", str(e)
+        pipeline._write_summary(summary_msg)
+        pipeline._write_profile(status)
+        return status, summary_msg
+
+    @staticmethod
+    def _report(pipelines, results, wall):
+        """ 各市場三段耗時與總牆鐘時間 (三段相加 = 逐一執行時的下限) """
+        print("\n" + "=" * 60)
+        print(f"{'市場':<8}{'狀態':<10}{'下載(s)':>10}{'精煉(s)':>10}{'上傳(s)':>10}")
+        serial = 0.0
+        for p in pipelines:
+            times = [p.profiler.stages.get(name, {}).get('wall_s', 0.0) for name in ("download", "refine", "upload")]
+            serial += sum(times)
+            print(f"{p.market_abbr:<8}{results[p.market_abbr][0]:<10}" + "".join(f"{t:>10.2f}" for t in times))
+        print(f"⏱️ 總耗時 {wall:.2f}s (各階段逐一執行合計 {serial:.2f}s)")
+        print("=" * 60)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="多市場交錯執行 (下載 / 精煉 / 上傳重疊)")
+    parser.add_argument("markets", nargs="*", help="市場代號 (預設讀 MARKET_TYPES，逗號分隔；再無則為全部市場)")
+    parser.add_argument("--io-threads", type=int, default=int(os.environ.get("REFINE_IO_THREADS", "2")))
+    parser.add_argument("--refine-workers", type=int, default=int(os.environ.get("REFINE_PARALLEL_MARKETS", "1")),
+                        help="同時精煉的市場數 (每個市場內的分片平行仍由 REFINE_WORKERS 控制)")
+    parser.add_argument("--prefetch", type=int, default=int(os.environ.get("REFINE_PREFETCH", "1")),
+                        help="精煉中市場之外最多預先下載幾個市場")
+    args = parser.parse_args(argv)
+
+    markets = args.markets or [m.strip() for m in os.environ.get("MARKET_TYPES", "").split(",") if m.strip()]
+    options = pipeline_options_from_env()
+    orchestrator = MarketOrchestrator(markets or ALL_MARKETS, storage=storage_from_env(options['cache_dir']),
+                                      io_threads=args.io_threads, refine_workers=args.refine_workers,
+                                      prefetch=args.prefetch, **options)
+    results = orchestrator.run()
+    failed = [m for m, (status, _) in results.items() if status == "failed"]
+    if failed:
+        print(f"❌ 失敗市場: {', '.join(failed)}")
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
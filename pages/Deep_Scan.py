@@ -79,14 +79,22 @@ try:
         scan_q = f"SELECT * FROM cleaned_daily_base WHERE StockID = '{target_symbol}' ORDER BY 日期 DESC LIMIT 1"
         data_all = pd.read_sql(scan_q, conn)
         
-        # B. 歷史股性統計 (2023 至今)
-        hist_q = f"""
-        SELECT COUNT(*) as t, SUM(is_limit_up) as lu, 
-        SUM(CASE WHEN Prev_LU = 0 AND is_limit_up = 0 AND Ret_High > 0.095 THEN 1 ELSE 0 END) as failed_lu,
-        AVG(CASE WHEN Prev_LU=1 THEN Overnight_Alpha END) as ov,
-        AVG(CASE WHEN Prev_LU=1 THEN Next_1D_Max END) as nxt
-        FROM cleaned_daily_base WHERE StockID = '{target_symbol}'
-        """
+        # B. 歷史股性統計 (2023 至今)：優先讀取引擎預先彙總的 stock_behavior_stats (主鍵查詢)
+        has_stats = pd.read_sql("SELECT name FROM sqlite_master WHERE type='table' AND name='stock_behavior_stats'", conn).shape[0] > 0
+        if has_stats:
+            hist_q = f"""
+            SELECT s.trading_days as t, s.lu_count as lu, s.failed_first_lu_count as failed_lu,
+            s.avg_overnight_after_lu as ov, s.avg_next_max_after_lu as nxt
+            FROM (SELECT '{target_symbol}' as id) q LEFT JOIN stock_behavior_stats s ON s.StockID = q.id
+            """
+        else:
+            hist_q = f"""
+            SELECT COUNT(*) as t, SUM(is_limit_up) as lu, 
+            SUM(CASE WHEN Prev_LU = 0 AND is_limit_up = 0 AND Ret_High > failed_lu_threshold THEN 1 ELSE 0 END) as failed_lu,
+            AVG(CASE WHEN Prev_LU=1 THEN Overnight_Alpha END) as ov,
+            AVG(CASE WHEN Prev_LU=1 THEN Next_1D_Max END) as nxt
+            FROM cleaned_daily_base WHERE StockID = '{target_symbol}'
+            """
         hist = pd.read_sql(hist_q, conn).iloc[0]
 
         # C. 獲取產業與同業
@@ -3,12 +3,12 @@ import sqlite3
 import pandas as pd
 import plotly.express as px
 import os
-import io
 import json
 import urllib.parse
 from googleapiclient.discovery import build
-from googleapiclient.http import MediaIoBaseDownload
 from google.oauth2.service_account import Credentials
+from transport import download_warehouse
+from dashboard_sql import latest_source
 import google.genai as genai
 
 # --- 1. 頁面配置 ---
@@ -54,17 +54,8 @@ def download_missing_dbs():
         for m_abbr, db_file in db_config.items():
             if not os.path.exists(db_file):
                 with st.spinner(f"📥 正在從雲端同步 {m_abbr} 資料庫..."):
-                    query = f"name = '{db_file}' and trashed = false"
-                    results = service.files().list(q=query, fields="files(id, name)").execute()
-                    files = results.get('files', [])
-                    if files:
-                        file_id = files[0]['id']
-                        request = service.files().get_media(fileId=file_id)
-                        fh = io.FileIO(db_file, 'wb')
-                        downloader = MediaIoBaseDownload(fh, request)
-                        done = False
-                        while not done:
-                            status, done = downloader.next_chunk()
+                    # 原始 .db 與壓縮版取較新者；壓縮版邊下載邊解壓寫入磁碟
+                    if download_warehouse(service, db_file):
                         st.sidebar.success(f"✅ {m_abbr} 同步成功")
                     else:
                         st.sidebar.warning(f"⚠️ 雲端找不到 {db_file}")
@@ -107,6 +98,26 @@ with st.sidebar:
         if ready: available_markets.append(m_abbr)
 
 # --- 4. 數據抓取邏輯 ---
+@st.cache_data(ttl=600)
+def fetch_global_sector_counts(markets):
+    """ 各市場最新交易日的強勢股 (漲幅 >= 10%) 產業家數，讀取引擎預先彙總的 sector_daily """
+    all_list = []
+    for m in markets:
+        conn = sqlite3.connect(db_config[m])
+        try:
+            df = pd.read_sql("""
+                SELECT Sector, strong_count as Count FROM sector_daily
+                WHERE 日期 = (SELECT MAX(日期) FROM sector_daily) AND strong_count > 0
+            """, conn)
+            df['Market'] = m
+            all_list.append(df)
+        except:
+            # 舊版資料庫沒有 sector_daily，交由呼叫端改用個股清單分組
+            return None
+        finally:
+            conn.close()
+    return pd.concat(all_list, ignore_index=True) if all_list else pd.DataFrame(columns=['Sector', 'Count', 'Market'])
+
 @st.cache_data(ttl=600)
 def fetch_global_strong_stocks(markets):
     all_list = []
@@ -114,12 +125,12 @@ def fetch_global_strong_stocks(markets):
         db = db_config[m]
         conn = sqlite3.connect(db)
         try:
-            latest = pd.read_sql("SELECT MAX(日期) FROM cleaned_daily_base", conn).iloc[0,0]
+            # 優先讀取精煉引擎產出的最新日快照 (舊版資料庫則即時組出相同欄位)
+            latest_src = latest_source(conn)
             query = f"""
-            SELECT p.StockID, i.name as Name, i.sector as Sector, p.Ret_Day
-            FROM cleaned_daily_base p
-            LEFT JOIN stock_info i ON p.StockID = i.symbol
-            WHERE p.日期 = '{latest}' AND p.Ret_Day >= 0.1
+            SELECT StockID, Name, Sector, Ret_Day
+            FROM {latest_src}
+            WHERE Ret_Day >= 0.1
             """
             df = pd.read_sql(query, conn)
             df['Market'] = m
@@ -136,12 +147,17 @@ if available_markets:
     
     if not global_df.empty:
         global_df['Sector'] = global_df['Sector'].fillna('未分類/香港/興櫃')
+        sector_counts_df = fetch_global_sector_counts(available_markets)
+        if sector_counts_df is None:
+            sector_counts_df = global_df.groupby(['Sector', 'Market']).size().reset_index(name='Count')
+        else:
+            sector_counts_df['Sector'] = sector_counts_df['Sector'].fillna('未分類/香港/興櫃')
 
         col_l, col_r = st.columns([1.2, 1])
         
         with col_l:
             st.subheader("📊 跨國強勢產業熱點")
-            chart_df = global_df.groupby(['Sector', 'Market']).size().reset_index(name='Count')
+            chart_df = sector_counts_df
             fig = px.bar(
                 chart_df, x='Count', y='Sector', color='Market', orientation='h',
                 title="全球強勢個股產業分佈 (漲幅 > 10%)", barmode='stack',
@@ -166,7 +182,7 @@ if available_markets:
         """)
 
         # 預先準備 AI 提問詞內容
-        sector_summary = global_df.groupby(['Sector', 'Market']).size().to_string()
+        sector_summary = sector_counts_df.set_index(['Sector', 'Market'])['Count'].sort_index().to_string()
         trend_prompt = f"""你是一位宏觀投資專家，請分析今日全球漲幅超過10%的股票分佈數據：
 
 {sector_summary}
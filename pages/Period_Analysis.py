@@ -5,6 +5,7 @@ import plotly.express as px
 import google.genai as genai
 import os
 import urllib.parse
+from dashboard_sql import latest_source
 
 # 1. 頁面配置
 st.set_page_config(page_title="長周期與滾動漲跌分析", layout="wide")
@@ -50,16 +51,17 @@ conn = sqlite3.connect(target_db)
 
 # 4. 抓取最新日期的統計數據
 try:
-    query = """
-    SELECT StockID, 日期, Ret_Day, 
-           (SELECT name FROM stock_info WHERE symbol = StockID) as Name,
+    # 優先讀取精煉引擎產出的最新日快照 (舊版資料庫則即時組出相同欄位)
+    latest_src = latest_source(conn)
+
+    query = f"""
+    SELECT StockID, 日期, Ret_Day, Name,
            [周累计漲跌幅(本周开盘)] as Ret_W,
            [月累计漲跌幅(本月开盘)] as Ret_M,
            [年累計漲跌幅(本年开盘)] as Ret_Y,
            Ret_5D, Ret_20D, Ret_200D,
            volatility_20d, drawdown_after_high_20d
-    FROM cleaned_daily_base
-    WHERE 日期 = (SELECT MAX(日期) FROM cleaned_daily_base)
+    FROM {latest_src}
     """
     df = pd.read_sql(query, conn)
     
@@ -5,6 +5,7 @@ import plotly.express as px
 import google.genai as genai
 import os
 import urllib.parse
+from dashboard_sql import latest_source, list_tables
 
 # 1. 頁面配置
 st.set_page_config(page_title="風險指標深度掃描", layout="wide")
@@ -42,16 +43,17 @@ if not os.path.exists(target_db):
 conn = sqlite3.connect(target_db)
 
 try:
+    # 優先讀取精煉引擎產出的最新日快照 (舊版資料庫則即時組出相同欄位)
+    db_tables = list_tables(conn)
+    latest_src = latest_source(conn, db_tables)
+
     # 抓取風險相關欄位
-    query = """
-    SELECT StockID, 日期, 
-           (SELECT name FROM stock_info WHERE symbol = StockID) as Name,
-           (SELECT sector FROM stock_info WHERE symbol = StockID) as Sector,
+    query = f"""
+    SELECT StockID, 日期, Name, Sector,
            volatility_10d, volatility_20d, volatility_50d,
            drawdown_after_high_10d, drawdown_after_high_20d, drawdown_after_high_50d,
            recovery_from_dd_10d, [月累计漲跌幅(本月开盘)] as Ret_M
-    FROM cleaned_daily_base
-    WHERE 日期 = (SELECT MAX(日期) FROM cleaned_daily_base)
+    FROM {latest_src}
     """
     df = pd.read_sql(query, conn)
     
@@ -92,7 +94,16 @@ try:
     st.divider()
     st.subheader("🏘️ 行業平均波動與回撤")
     
-    sector_risk = df.groupby('Sector')[['volatility_20d', 'drawdown_after_high_20d']].mean().reset_index()
+    if "sector_daily" in db_tables:
+        # 引擎預先彙總的每日產業表 (最新交易日)
+        sector_risk = pd.read_sql("""
+            SELECT Sector, avg_volatility_20d as volatility_20d, avg_drawdown_20d as drawdown_after_high_20d
+            FROM sector_daily
+            WHERE 日期 = (SELECT MAX(日期) FROM sector_daily) AND Sector IS NOT NULL
+            ORDER BY Sector
+        """, conn)
+    else:
+        sector_risk = df.groupby('Sector')[['volatility_20d', 'drawdown_after_high_20d']].mean().reset_index()
     fig_sec = px.bar(sector_risk, x='Sector', y='volatility_20d', color='drawdown_after_high_20d',
                     title="各行業平均波動率 (顏色深淺代表平均回撤幅度)")
     st.plotly_chart(fig_sec, use_container_width=True)
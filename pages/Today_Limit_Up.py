@@ -5,6 +5,7 @@ import plotly.express as px
 import google.genai as genai
 import os
 import urllib.parse
+from dashboard_sql import latest_source, list_tables
 
 # --- 1. 頁面配置與樣式 ---
 st.set_page_config(page_title="全球漲停板 AI 分析儀 2.0", layout="wide")
@@ -80,16 +81,19 @@ def get_table_columns(table_name):
         return []
 
 try:
+    # 優先讀取精煉引擎產出的最新日快照 (舊版資料庫則即時組出相同欄位)
+    db_tables = list_tables(conn)
+    latest_src = latest_source(conn, db_tables)
+
     # A. 獲取最新交易日
-    latest_date = pd.read_sql("SELECT MAX(日期) FROM cleaned_daily_base", conn).iloc[0, 0]
+    latest_date = pd.read_sql(f"SELECT MAX(日期) FROM {latest_src}", conn).iloc[0, 0]
     
     # B. 抓取當日漲停股票數據
     query_today = f"""
-    SELECT p.StockID, i.name as Name, i.sector as Sector, p.收盤, p.Ret_Day, p.Seq_LU_Count, p.is_limit_up
-    FROM cleaned_daily_base p
-    LEFT JOIN stock_info i ON p.StockID = i.symbol
-    WHERE p.日期 = '{latest_date}' AND p.is_limit_up = 1
-    ORDER BY p.Seq_LU_Count DESC, p.StockID ASC
+    SELECT StockID, Name, Sector, 收盤, Ret_Day, Seq_LU_Count, is_limit_up
+    FROM {latest_src}
+    WHERE is_limit_up = 1
+    ORDER BY Seq_LU_Count DESC, StockID ASC
     """
     df_today = pd.read_sql(query_today, conn)
 
@@ -105,19 +109,32 @@ try:
         
         # 產業分佈數據
         df_today['Sector'] = df_today['Sector'].fillna('未分類')
-        sector_counts = df_today['Sector'].value_counts().reset_index()
-        sector_counts.columns = ['產業別', '漲停家數']
-        
-        # 計算產業統計
-        sector_stats = {}
-        for sector in df_today['Sector'].unique():
-            sector_stocks = df_today[df_today['Sector'] == sector]
-            avg_seq = sector_stocks['Seq_LU_Count'].mean()
-            sector_stats[sector] = {
-                'count': len(sector_stocks),
-                'avg_seq': round(avg_seq, 1),
-                'stocks': sector_stocks[['StockID', 'Name', 'Seq_LU_Count']].to_dict('records')
+        if "sector_daily" in db_tables:
+            # 引擎預先彙總的每日產業表，直接取基準日的漲停產業
+            sector_daily_today = pd.read_sql("""
+                SELECT IFNULL(Sector, '未分類') as Sector, lu_count, avg_seq_lu
+                FROM sector_daily WHERE 日期 = ? AND lu_count > 0
+                ORDER BY lu_count DESC
+            """, conn, params=(latest_date,))
+            sector_counts = sector_daily_today[['Sector', 'lu_count']].rename(columns={'Sector': '產業別', 'lu_count': '漲停家數'})
+            sector_stats = {
+                row.Sector: {'count': int(row.lu_count), 'avg_seq': round(row.avg_seq_lu, 1)}
+                for row in sector_daily_today.itertuples()
             }
+        else:
+            sector_counts = df_today['Sector'].value_counts().reset_index()
+            sector_counts.columns = ['產業別', '漲停家數']
+            
+            # 計算產業統計
+            sector_stats = {}
+            for sector in df_today['Sector'].unique():
+                sector_stocks = df_today[df_today['Sector'] == sector]
+                avg_seq = sector_stocks['Seq_LU_Count'].mean()
+                sector_stats[sector] = {
+                    'count': len(sector_stocks),
+                    'avg_seq': round(avg_seq, 1),
+                    'stocks': sector_stocks[['StockID', 'Name', 'Seq_LU_Count']].to_dict('records')
+                }
         
         col1, col2 = st.columns([1.2, 1])
         
@@ -185,6 +202,16 @@ try:
 
 請提供具體、可操作的投資建議。"""
                 
+                # 近 20 個交易日的產業漲停趨勢 (來自 sector_daily 小表)
+                if "sector_daily" in db_tables:
+                    sector_trend = pd.read_sql("""
+                        SELECT 日期, lu_count as 漲停家數, breadth as 上漲家數比 FROM sector_daily
+                        WHERE IFNULL(Sector, '未分類') = ? ORDER BY 日期 DESC LIMIT 20
+                    """, conn, params=(selected_sector,)).sort_values('日期')
+                    if not sector_trend.empty:
+                        st.caption(f"📈 {selected_sector} 近 20 日漲停家數趨勢")
+                        st.line_chart(sector_trend.set_index('日期')['漲停家數'])
+                
                 # 顯示提示詞和AI平台連結
                 st.write(f"### 📋 {selected_sector} 產業分析提示詞")
                 st.code(sector_prompt, language="text")
@@ -261,9 +288,11 @@ try:
             existing_columns = [col for col in desired_columns if col in table_columns]
             
             # 建立查詢
+            # 炸板門檻依市場/板別 (與 stock_behavior_stats 一致)；舊版資料庫沒有此欄時沿用 0.095
+            failed_threshold = "failed_lu_threshold" if "failed_lu_threshold" in table_columns else "0.095"
             select_parts = [
                 "SUM(is_limit_up) as total_lu",
-                "SUM(CASE WHEN is_limit_up = 0 AND Ret_High > 0.095 THEN 1 ELSE 0 END) as total_failed"
+                f"SUM(CASE WHEN is_limit_up = 0 AND Ret_High > {failed_threshold} THEN 1 ELSE 0 END) as total_failed"
             ]
             
             if "Prev_LU" in table_columns and "Overnight_Alpha" in table_columns:
@@ -273,17 +302,26 @@ try:
                 select_parts.append("AVG(CASE WHEN Prev_LU = 1 THEN Next_1D_Max END) as avg_max")
             
             # 檢查是否有Next_1D_Ret欄位
-            if "Next_1D_Ret" in table_columns and "Prev_LU" in table_columns:
-                select_parts.append("AVG(CASE WHEN Prev_LU = 1 AND Next_1D_Ret < 0 THEN 1 ELSE 0 END) as next_day_loss_rate")
+            if "Next_1D_Ret" in table_columns:
+                select_parts.append("AVG(CASE WHEN is_limit_up = 1 AND Next_1D_Ret IS NOT NULL "
+                                    "THEN CASE WHEN Next_1D_Ret < 0 THEN 1.0 ELSE 0.0 END END) as next_day_loss_rate")
             
             select_query = ", ".join(select_parts)
             
-            # 執行查詢
-            backtest_q = f"""
-            SELECT {select_query}
-            FROM cleaned_daily_base  
-            WHERE StockID = '{target_id}'
-            """
+            # 執行查詢：有預先彙總的股性統計表時直接以主鍵取一列
+            if "stock_behavior_stats" in db_tables:
+                backtest_q = f"""
+                SELECT s.lu_count as total_lu, s.failed_lu_count as total_failed,
+                s.avg_overnight_after_lu as avg_open, s.avg_next_max_after_lu as avg_max,
+                s.next_day_loss_rate
+                FROM (SELECT '{target_id}' as id) q LEFT JOIN stock_behavior_stats s ON s.StockID = q.id
+                """
+            else:
+                backtest_q = f"""
+                SELECT {select_query}
+                FROM cleaned_daily_base  
+                WHERE StockID = '{target_id}'
+                """
             
             bt = pd.read_sql(backtest_q, conn).iloc[0]
             
@@ -317,10 +355,9 @@ try:
             # 💡 同族群聯動
             current_sector = stock_detail['Sector']
             related_q = f"""
-            SELECT p.StockID, i.name as Name, p.is_limit_up, p.Seq_LU_Count
-            FROM cleaned_daily_base p
-            LEFT JOIN stock_info i ON p.StockID = i.symbol
-            WHERE i.sector = '{current_sector}' AND p.日期 = '{latest_date}' AND p.StockID != '{target_id}'
+            SELECT StockID, Name, is_limit_up, Seq_LU_Count
+            FROM {latest_src}
+            WHERE Sector = '{current_sector}' AND StockID != '{target_id}'
             LIMIT 15
             """
             df_related = pd.read_sql(related_q, conn)
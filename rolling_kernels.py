@@ -0,0 +1,189 @@
+# -*- coding: utf-8 -*-
+import numpy as np
+
+def _lag(values, k, fill):
+    """ 全域位移 k 列 (不分組)，以連續切片完成；組邊界由呼叫端以 pos 遮罩 """
+    n = len(values)
+    out = np.full(n, fill, dtype=values.dtype)
+    if k == 0:
+        out[:] = values
+    elif 0 < k < n:
+        out[k:] = values[:-k]
+    elif 0 < -k < n:
+        out[:k] = values[-k:]
+    return out
+
+def _window_sums(values, windows):
+    """
+    回傳 {w: 長度 n-w+1 的窗口和 (索引為窗口起點)}。
+    大窗口由已算好的小窗口拼接 (例：50 = 20 + 30, 30 = 20 + 10)，
+    加總順序只取決於窗口內數值，與陣列其他部分無關。
+    """
+    n = len(values)
+    cache = {}
+
+    def get(w):
+        if w in cache:
+            return cache[w]
+        m = n - w + 1
+        smaller = [c for c in cache if c < w]
+        if smaller:
+            c = max(smaller)
+            total = cache[c][:m] + get(w - c)[c:c + m]
+        else:
+            total = values[:m].copy()
+            for k in range(1, w):
+                total += values[k:k + m]
+        cache[w] = total
+        return total
+
+    return {w: get(w) for w in sorted(set(windows)) if w <= n}
+
+# ==========================================
+# 分段滾動運算核心 (取代 groupby.transform(lambda))
+# ==========================================
+class SegmentedRolling:
+    """
+    在已依 (StockID, 日期) 排序的陣列上，以分段邊界一次計算多個窗口的統計量。
+    語意對齊 pandas：
+    1. shift / pct_change: 不跨越股票邊界，邊界外為 NaN。
+    2. rolling_std: ddof=1，窗口內需有完整 window 筆有效值 (min_periods=window)。
+    3. rolling_max / rolling_min: 忽略 NaN，窗口內有效值數 >= min_periods 才輸出。
+    所有結果只取決於同一檔股票的數據，分片/分批計算與整批計算逐位元一致。
+    """
+
+    def __init__(self, group_keys):
+        # 類別型別 (精簡模式) 直接比較整數代碼
+        keys = group_keys.cat.codes.to_numpy() if hasattr(group_keys, 'cat') else np.asarray(group_keys)
+        n = len(keys)
+        self.n = n
+        if n == 0:
+            self.pos = np.zeros(0, dtype=np.int64)
+            self.remaining = np.zeros(0, dtype=np.int64)
+            return
+        starts = np.flatnonzero(np.r_[True, keys[1:] != keys[:-1]])
+        sizes = np.diff(np.r_[starts, n])
+        idx = np.arange(n)
+        # pos: 組內位置 (0 起算)；remaining: 組內尚餘幾列
+        self.pos = idx - np.repeat(starts, sizes)
+        self.remaining = np.repeat(starts + sizes, sizes) - idx - 1
+
+    # ---------- 位移類 ----------
+    def shift(self, values, periods=1):
+        """ 組內位移：periods > 0 取前 periods 列，periods < 0 取後 |periods| 列 """
+        values = np.asarray(values, dtype=np.float64)
+        out = _lag(values, periods, np.nan)
+        if periods >= 0:
+            out[self.pos < periods] = np.nan
+        else:
+            out[self.remaining < -periods] = np.nan
+        return out
+
+    def pct_change(self, values, periods_list):
+        """ 一次計算多個期數的漲跌幅，回傳 {periods: array} """
+        values = np.asarray(values, dtype=np.float64)
+        return {p: values / self.shift(values, p) - 1 for p in periods_list}
+
+    # ---------- 連續計數類 ----------
+    def run_length(self, flags):
+        """ 組內連續為真的長度 (cumsum-reset)；為假或換股時歸零重算 """
+        f = np.asarray(flags, dtype=bool).astype(np.int64)
+        c = np.cumsum(f)
+        # 重設點的基準值 = 該列之前的累計值；累計值單調遞增，可用 maximum.accumulate 向前填補
+        reset = (f == 0) | (self.pos == 0)
+        base = np.maximum.accumulate(np.where(reset, c - f, 0))
+        return c - base
+
+    def cummax(self, values):
+        """ 組內累計最大值 (適用非負整數，如連板天數) """
+        values = np.asarray(values, dtype=np.int64)
+        if self.n == 0:
+            return values
+        gid = np.cumsum(self.pos == 0) - 1
+        stride = int(values.max()) + 1
+        return np.maximum.accumulate(values + gid * stride) - gid * stride
+
+    # ---------- 日曆期間 ----------
+    def period_first(self, values, period_keys):
+        """
+        每列所屬 (股票, 期間) 第一列的數值 (例：本週/本月/本年第一個交易日的開盤價)。
+        period_keys 需在組內隨日期遞增；期間起點 = 換股或期間代碼改變的列，
+        取出起點數值後依各期間長度 repeat 展開，一次完成不需分組。
+        """
+        values = np.asarray(values, dtype=np.float64)
+        if self.n == 0:
+            return values.copy()
+        keys = np.asarray(period_keys)
+        start = self.pos == 0
+        start[1:] |= keys[1:] != keys[:-1]
+        starts = np.flatnonzero(start)
+        return np.repeat(values[starts], np.diff(np.r_[starts, self.n]))
+
+    # ---------- 滾動統計 ----------
+    def _window_counts(self, flags, window):
+        """ 每列窗口內 (不跨組、組首截斷) 旗標為真的個數 """
+        flags = np.asarray(flags, dtype=np.int64)
+        csum = np.cumsum(flags)
+        # 窗口下界 = max(i - window, 組首 - 1)；累計值單調遞增，取兩者累計值的較大者即可
+        lower = _lag(csum, window, 0)
+        group_base = np.maximum.accumulate(np.where(self.pos == 0, csum - flags, 0))
+        return csum - np.maximum(lower, group_base)
+
+    def rolling_std(self, values, windows, ddof=1):
+        """
+        一次計算多個窗口的滾動標準差，回傳 {window: array}。
+        窗口和以位移切片累加 (不使用全域前綴和)，結果只取決於窗口內數值。
+        """
+        values = np.asarray(values, dtype=np.float64)
+        sums = _window_sums(values, windows)
+        sq_sums = _window_sums(values * values, windows)
+        # 全平窗口 (相鄰值皆相等) 直接給 0，避免浮點殘差
+        changed = np.r_[True, values[1:] != values[:-1]]
+
+        result = {}
+        for w in windows:
+            out = np.full(self.n, np.nan)
+            if w in sums and w > ddof:
+                # 窗口和對齊到窗口終點；含 NaN 的窗口加總即為 NaN，等同 min_periods=window
+                s1 = np.r_[np.full(w - 1, np.nan), sums[w]]
+                s2 = np.r_[np.full(w - 1, np.nan), sq_sums[w]]
+                var = np.maximum((s2 - s1 * s1 / w) / (w - ddof), 0.0)
+                var[self._window_counts(changed, w - 1) == 0] = 0.0
+                full = (self.pos >= w - 1) & ~np.isnan(s1) & ~np.isnan(s2)
+                out[full] = np.sqrt(var[full])
+            result[w] = out
+        return result
+
+    def rolling_max(self, values, windows, min_periods=None):
+        return self._rolling_extreme(values, windows, min_periods, np.fmax)
+
+    def rolling_min(self, values, windows, min_periods=None):
+        return self._rolling_extreme(values, windows, min_periods, np.fmin)
+
+    def _rolling_extreme(self, values, windows, min_periods, op):
+        """
+        稀疏表倍增法：level[k][i] = 組內 [i - 2^k + 1, i] 的極值 (組首截斷)。
+        窗口 w 取 p = 2^floor(log2 w)，結果 = op(level_p[i], level_p[i - (w - p)])；
+        若 i - (w - p) 已跨組，level_p[i] 本身已涵蓋整段組首，直接使用即可。
+        """
+        values = np.asarray(values, dtype=np.float64)
+        valid = ~np.isnan(values)
+        pending = sorted(set(windows))
+        result = {}
+        level, span = values, 1
+        while pending:
+            # 以目前 level (span = 2^k) 產出所有 p == span 的窗口
+            while pending and pending[0] < span * 2:
+                w = pending.pop(0)
+                offset = w - span
+                out = level.copy()
+                if offset > 0:
+                    out = np.where(self.pos >= offset, op(level, _lag(level, offset, np.nan)), level)
+                mp = w if min_periods is None else min_periods
+                out[self._window_counts(valid, w) < mp] = np.nan
+                result[w] = out
+            if not pending:
+                break
+            level = np.where(self.pos >= span, op(level, _lag(level, span, np.nan)), level)
+            span *= 2
+        return {w: result[w] for w in windows}
@@ -0,0 +1,233 @@
+# -*- coding: utf-8 -*-
+import math
+import numpy as np
+import pandas as pd
+from metric_registry import METRICS
+
+# ==========================================
+# 衍生欄位的 SQL 運算式 (SQLite 視窗函數)
+# ==========================================
+# {欄位: (層, 型別, 運算式)}；同一層的欄位互不依賴，下一層可引用上一層的結果。
+# 窗口 w = (PARTITION BY StockID ORDER BY 日期)；以 _ 開頭的是中間欄位，不寫入目標表。
+# SQLite 每種不同的窗口框架都要對整表多掃一次，因此盡量讓欄位共用框架：
+# 以 Ret_Day 運算式直接在第 1 層計算波動率的窗口和，與回撤共用 ROWS 9/19/49 框架。
+_RET_DAY = "(收盤 / Prev_Close - 1)"
+_PERIOD_KEYS = {
+    '周累计漲跌幅(本周开盘)': "date(日期, '-6 days', 'weekday 1')",  # 該週週一
+    '月累计漲跌幅(本月开盘)': "strftime('%Y-%m', 日期)",
+    '年累計漲跌幅(本年开盘)': "strftime('%Y', 日期)",
+}
+# 波動率窗口：有效筆數、和、平方和、最大/最小 (最大 == 最小 即全平窗口，與 pandas 一樣直接給 0)
+_VOL_PARTS = {
+    f'_{part}_{d}': (1, 'REAL', f"{func} OVER (w ROWS {d - 1} PRECEDING)")
+    for d in (10, 20, 50)
+    for part, func in (('n', f"COUNT{_RET_DAY}"), ('s1', f"SUM{_RET_DAY}"),
+                       ('s2', f"SUM({_RET_DAY} * {_RET_DAY})"), ('hi', f"MAX{_RET_DAY}"), ('lo', f"MIN{_RET_DAY}"))
+}
+_VOL_SQL = ("CASE WHEN _n_{n} = {n} THEN CASE WHEN _hi_{n} = _lo_{n} THEN 0.0 "
+            "ELSE sqrt(max((_s2_{n} - _s1_{n} * _s1_{n} / {n}.0) / {d}.0, 0.0)) END * sqrt(252.0) END")
+
+METRIC_SQL = {
+    'Ret_Day': (1, 'REAL', f"{_RET_DAY}"),
+    'Ret_High': (1, 'REAL', "最高 / Prev_Close - 1"),
+    'Overnight_Alpha': (1, 'REAL', "開盤 / Prev_Close - 1"),
+    'Prev_LU': (1, 'REAL', "CAST(COALESCE(LAG(is_limit_up) OVER w, 0) AS REAL)"),
+    'Next_1D_Max': (1, 'REAL', "LEAD(最高 / Prev_Close - 1) OVER w"),
+    '_lu_grp': (1, 'INTEGER', "SUM(1 - is_limit_up) OVER w"),  # 每遇未漲停換一組，組內漲停列即為連板
+    'Ret_5D': (1, 'REAL', "收盤 / LAG(收盤, 5) OVER w - 1"),
+    'Ret_20D': (1, 'REAL', "收盤 / LAG(收盤, 20) OVER w - 1"),
+    'Ret_200D': (1, 'REAL', "收盤 / LAG(收盤, 200) OVER w - 1"),
+    **{col: (1, 'REAL', f"收盤 / FIRST_VALUE(開盤) OVER (PARTITION BY StockID, {key} ORDER BY 日期) - 1")
+       for col, key in _PERIOD_KEYS.items()},
+    **{f'drawdown_after_high_{d}d': (1, 'REAL', f"收盤 / MAX(最高) OVER (w ROWS {d - 1} PRECEDING) - 1")
+       for d in (10, 20, 50)},
+    'recovery_from_dd_10d': (1, 'REAL', "CASE WHEN COUNT(最低) OVER (w ROWS 9 PRECEDING) >= 10 "
+                                        "THEN 收盤 / MIN(最低) OVER (w ROWS 9 PRECEDING) - 1 END"),
+    **_VOL_PARTS,
+    'Seq_LU_Count': (2, 'INTEGER', "CASE WHEN is_limit_up = 1 THEN SUM(is_limit_up) OVER lu ELSE 0 END"),
+    'Seq_LU_Start': (2, 'TEXT', "CASE WHEN is_limit_up = 1 THEN MIN(CASE WHEN is_limit_up = 1 THEN 日期 END) OVER lu END"),
+    **{f'volatility_{d}d': (2, 'REAL', _VOL_SQL.format(n=d, d=d - 1)) for d in (10, 20, 50)},
+    'Max_Seq_LU_Count': (3, 'INTEGER', "MAX(Seq_LU_Count) OVER w"),
+    **{f'Next_{d}D_Ret': (1, 'REAL', f"LEAD(收盤, {d}) OVER w / 收盤 - 1") for d in (1, 3, 5, 10)},
+    'Next_Open_Gap': (1, 'REAL', "LEAD(開盤) OVER w / 收盤 - 1"),
+    'Next_5D_MAE': (1, 'REAL', "CASE WHEN COUNT(最低) OVER (w ROWS BETWEEN 1 FOLLOWING AND 5 FOLLOWING) = 5 "
+                               "THEN MIN(最低) OVER (w ROWS BETWEEN 1 FOLLOWING AND 5 FOLLOWING) / 收盤 - 1 END"),
+}
+_WINDOWS = ("WINDOW w AS (PARTITION BY StockID ORDER BY 日期), "
+            "lu AS (PARTITION BY StockID, _lu_grp ORDER BY 日期 ROWS UNBOUNDED PRECEDING)")
+
+# 規則產出前的基礎欄位 (順序與型別對齊 pandas 路徑寫出的表)
+BASE_COLUMNS = [('日期', 'TEXT'), ('StockID', 'TEXT'), ('開盤', 'REAL'), ('最高', 'REAL'), ('最低', 'REAL'),
+                ('收盤', 'REAL'), ('成交量', 'INTEGER'), ('MarketType', 'TEXT'), ('Prev_Close', 'REAL'),
+                ('is_limit_up', 'INTEGER'), ('failed_lu_threshold', 'REAL')]
+
+
+def _sql_literal(value):
+    if isinstance(value, (int, float, np.number)) and not isinstance(value, bool):
+        return repr(float(value))
+    return "'" + str(value).replace("'", "''") + "'"
+
+# ==========================================
+# 資料庫內精煉路徑
+# ==========================================
+class SqlWindowRefiner:
+    """
+    以 SQLite 視窗函數完成精煉，原始數據不離開資料庫：
+    1. 乒乓清洗：LAG/LEAD 逐輪標記異常列 (rowid 存入暫存表)，直到沒有新的異常，前收自然指向前一筆保留列。
+    2. 規則：MarketRuleRouter 的規則表轉成 CASE 運算式，判定 is_limit_up / failed_lu_threshold。
+    3. 衍生欄位：依 METRIC_SQL 分層組成 CTE，INSERT ... SELECT 直接寫入 BulkTableWriter 的目標表。
+    與 pandas 路徑逐欄一致；波動率改用平方和公式，一般誤差 ~1e-13，接近全平的窗口 (連續漲停) 約 1e-11 的絕對誤差。
+    前收為 0 的退化列：pandas 得到 inf，SQLite 除以 0 得到 NULL。
+    """
+
+    REMOVED_TABLE = "temp.sql_refine_removed"
+
+    def __init__(self, engine):
+        missing = [c for c in METRICS.columns if c not in METRIC_SQL]
+        if missing:
+            raise NotImplementedError(f"SQL 路徑尚未支援的衍生欄位：{missing}")
+        self.engine = engine
+        self.conn = engine.conn
+        self.rule = engine.rules.limit_rule()
+        self.threshold = engine.rules.PINGPONG_THRESHOLD
+        self.max_passes = engine.rules.MAX_CLEAN_PASSES
+        self.columns = BASE_COLUMNS + [(c, METRIC_SQL[c][1]) for c in METRICS.columns]
+        # 部分 SQLite 編譯未含數學函數：以 Python 補上 sqrt
+        try:
+            self.conn.execute("SELECT sqrt(4.0)")
+        except Exception:
+            self.conn.create_function("sqrt", 1, lambda x: None if x is None else math.sqrt(x), deterministic=True)
+
+    def run(self, read_window, write_window, writer):
+        """ 清洗 -> 規則 -> 衍生欄位 -> 寫入 writer，回傳 (是否讀到資料, 寫出列數) """
+        (read_from, read_to), (write_from, write_to) = read_window, write_window
+        raw_where, raw_params = self.engine._raw_filters(read_from, read_to)
+        base_sql = f"""
+            SELECT p.rowid AS rid, strftime('%Y-%m-%d %H:%M:%S', p.date) AS 日期, p.symbol AS StockID,
+                   CAST(p.open AS REAL) AS 開盤, CAST(p.high AS REAL) AS 最高, CAST(p.low AS REAL) AS 最低,
+                   CAST(p.close AS REAL) AS 收盤, p.volume AS 成交量
+            FROM stock_prices p
+            WHERE {raw_where} AND p.rowid NOT IN (SELECT rid FROM {self.REMOVED_TABLE})
+        """
+        n_raw = self.conn.execute(f"SELECT COUNT(*) FROM stock_prices WHERE {raw_where}", raw_params).fetchone()[0]
+        if n_raw == 0:
+            return False, 0
+
+        prof = self.engine.profiler
+        # 先開始寫入交易：writer 調整 temp_store 時會清掉既有的暫存表
+        writer.begin()
+        self.conn.execute(f"DROP TABLE IF EXISTS {self.REMOVED_TABLE}")
+        self.conn.execute(f"""CREATE TABLE {self.REMOVED_TABLE} (rid INTEGER PRIMARY KEY, StockID TEXT, 日期 TEXT,
+                              收盤 REAL, Prev_Close REAL, Ret REAL, Next_Ret REAL, reason TEXT, clean_pass INTEGER)""")
+        with prof.stage("sql_clean", rows=n_raw):
+            self._clean_pingpong(base_sql, raw_params)
+
+        with prof.stage("sql_refine", rows=n_raw) as rec:
+            select_sql, params = self._select_sql(base_sql, raw_params, write_from, write_to)
+            rec['rows'] = written = writer.write_select(self.columns, select_sql, params)
+        self.conn.execute(f"DROP TABLE IF EXISTS {self.REMOVED_TABLE}")
+        return True, written
+
+    # ---------- 乒乓清洗 ----------
+    def _clean_pingpong(self, base_sql, raw_params):
+        """
+        每輪以保留列的 LAG/LEAD 重算漲跌，剔除 |漲跌| > 門檻且次日反向的列 (與 pandas 路徑同一判定)。
+        剔除只影響同一檔的前後參考價，第 2 輪起只重掃上一輪有剔除的股票。
+        """
+        for n_pass in range(1, self.max_passes + 1):
+            if n_pass > 1:
+                base_sql += f" AND p.symbol IN (SELECT StockID FROM {self.REMOVED_TABLE} WHERE clean_pass = {n_pass - 1})"
+            cursor = self.conn.execute(f"""
+                INSERT INTO {self.REMOVED_TABLE}
+                SELECT rid, StockID, 日期, 收盤, Prev_Close, Ret, Next_Ret, 'pingpong', ?
+                FROM (
+                    SELECT rid, StockID, 日期, 收盤, Prev_Close,
+                           收盤 / Prev_Close - 1 AS Ret, Next_Close / 收盤 - 1 AS Next_Ret
+                    FROM (SELECT b.*, LAG(收盤) OVER w AS Prev_Close, LEAD(收盤) OVER w AS Next_Close
+                          FROM ({base_sql}) b WINDOW w AS (PARTITION BY StockID ORDER BY 日期))
+                )
+                WHERE abs(Ret) > ? AND abs(Next_Ret) > ? AND Ret * Next_Ret < 0
+            """, (n_pass, *raw_params, self.threshold, self.threshold))
+            if cursor.rowcount <= 0:
+                break
+        removed = pd.read_sql(f"SELECT StockID, 日期, 收盤, Prev_Close, Ret, Next_Ret, reason, clean_pass "
+                              f"FROM {self.REMOVED_TABLE} ORDER BY StockID, 日期", self.conn)
+        removed['日期'] = pd.to_datetime(removed['日期'])
+        self.engine.cleaning_audit.append(removed)
+
+    # ---------- 規則 ----------
+    def _rule_sql(self):
+        """ 規則表 -> (is_limit_up 運算式, failed_lu_threshold 運算式)；代號前綴覆寫以後者優先，與 pandas 一致 """
+        rule = self.rule
+
+        def prefix_sql(prefixes):
+            return "(" + " OR ".join(f"substr(StockID, 1, {len(p)}) = {_sql_literal(p)}" for p in prefixes) + ")"
+
+        def by_board(value_of):
+            cases = [f"WHEN {prefix_sql(prefixes)} THEN {_sql_literal(value_of(board))}"
+                     for prefixes, *board in reversed(rule.get('boards', []))]
+            default = _sql_literal(value_of((rule['limit'], rule['failed'])))
+            return f"(CASE {' '.join(cases)} ELSE {default} END)" if cases else default
+
+        if rule['basis'] == 'price':
+            hit = f"收盤 >= Prev_Close * {by_board(lambda b: np.round(1 + b[0], 6))}"
+        else:
+            hit = f"(收盤 / Prev_Close - 1) >= {by_board(lambda b: b[0])}"
+        excluded = []
+        if rule.get('exclude_prefixes'):
+            excluded.append(prefix_sql(rule['exclude_prefixes']))
+        if rule.get('exclude_market_types'):
+            types = ", ".join(_sql_literal(t) for t in rule['exclude_market_types'])
+            excluded.append(f"(MarketType IS NOT NULL AND MarketType IN ({types}))")
+        conds = [hit] + [f"NOT {e}" for e in excluded]
+        if rule.get('close_at_high'):
+            conds.append("收盤 = 最高")
+        is_lu = f"CASE WHEN {' AND '.join(conds)} THEN 1 ELSE 0 END"
+        return is_lu, by_board(lambda b: b[1])
+
+    def _market_type_sql(self):
+        """ 與 pandas 路徑相同：stock_info 可用時關聯 market，否則標為 Unknown """
+        info_cols = {r[1] for r in self.conn.execute("PRAGMA table_info(stock_info)")}
+        if {'symbol', 'market'} <= info_cols:
+            return "i.market", "LEFT JOIN stock_info i ON i.symbol = b.StockID"
+        return "'Unknown'", ""
+
+    # ---------- 衍生欄位 ----------
+    def _select_sql(self, base_sql, raw_params, write_from, write_to):
+        market_sql, join_sql = self._market_type_sql()
+        is_lu_sql, failed_sql = self._rule_sql()
+        layers = []
+        for level in sorted({lv for lv, _, _ in METRIC_SQL.values()}):
+            exprs = ",\n".join(f"{expr} AS [{col}]" for col, (lv, _, expr) in METRIC_SQL.items() if lv == level)
+            source = "ruled" if level == 1 else f"l{level - 1}"
+            windows = _WINDOWS if level > 1 else _WINDOWS.split(", lu AS")[0]
+            layers.append(f"l{level} AS (SELECT s.*, {exprs} FROM {source} s {windows})")
+        last = f"l{len(layers)}"
+
+        # 「至今」累計欄位接續改寫窗口之前的歷史值 (與 pandas 路徑的 carry-over 相同)
+        running = [c for c in METRICS.running_columns()]
+        existing = {r[1] for r in self.conn.execute("PRAGMA table_info(cleaned_daily_base)")}
+        carry = [c for c in running if c in existing] if write_from else []
+        prior_sql, prior_params = "", []
+        if carry:
+            prior, prior_params = self.engine._prior_running_sql(carry, write_from)
+            prior_sql = f"LEFT JOIN ({prior}) prior ON prior.StockID = o.StockID"
+        select_cols = ", ".join(f"max(o.[{c}], COALESCE(prior.[{c}], 0)) AS [{c}]" if c in carry else f"o.[{c}]"
+                                for c, _ in self.columns)
+
+        scope = self.engine._scope_where(write_from, write_to, symbols=False, alias="o.")
+        where_sql, where_params = (f"WHERE {scope[0]}", list(scope[1])) if scope else ("", [])
+        sql = f"""
+            WITH base AS ({base_sql}),
+            cleaned AS (
+                SELECT b.日期, b.StockID, b.開盤, b.最高, b.最低, b.收盤, b.成交量, {market_sql} AS MarketType,
+                       LAG(b.收盤) OVER (PARTITION BY b.StockID ORDER BY b.日期) AS Prev_Close
+                FROM base b {join_sql}
+            ),
+            ruled AS (SELECT c.*, {is_lu_sql} AS is_limit_up, {failed_sql} AS failed_lu_threshold FROM cleaned c),
+            {", ".join(layers)}
+            SELECT {select_cols} FROM {last} o {prior_sql}
+            {where_sql}
+            ORDER BY o.StockID, o.日期
+        """
+        return sql, list(raw_params) + prior_params + where_params
@@ -0,0 +1,73 @@
+# -*- coding: utf-8 -*-
+import json
+import sys
+import time
+from contextlib import contextmanager
+
+# resource 僅 Unix 提供 (GitHub runner)；Windows 本機執行時峰值記憶體記為 None
+try:
+    import resource
+except ImportError:
+    resource = None
+
+def _peak_rss_mb():
+    """ 行程至今的常駐記憶體高水位 (MB)；Linux 的 ru_maxrss 單位為 KB，macOS 為 bytes """
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak / (1024 * 1024) if sys.platform == "darwin" else peak / 1024
+
+# ==========================================
+# 分段計時器 (牆鐘 / CPU / 峰值記憶體 / 列數)
+# ==========================================
+class StageProfiler:
+    """
+    以 with profiler.stage("名稱") as rec: 包住每個階段，rec['rows'] 可填入處理列數。
+    1. 同名階段 (例如串流模式的每一批) 會累加時間與列數，並記錄呼叫次數。
+    2. peak_rss_mb 為階段結束時的行程高水位；與前一階段相比增加者即為推高峰值的階段。
+    3. CPU 時間只含本行程；平行模式子行程的運算時間反映在牆鐘時間。
+    """
+
+    def __init__(self):
+        self.stages = {}
+        self.started = time.time()
+
+    @contextmanager
+    def stage(self, name, rows=None):
+        rec = {'rows': rows}
+        wall, cpu = time.perf_counter(), time.process_time()
+        try:
+            yield rec
+        finally:
+            stats = self.stages.setdefault(name, {'calls': 0, 'wall_s': 0.0, 'cpu_s': 0.0, 'rows': None,
+                                                  'peak_rss_mb': None})
+            stats['calls'] += 1
+            stats['wall_s'] += time.perf_counter() - wall
+            stats['cpu_s'] += time.process_time() - cpu
+            if rec['rows'] is not None:
+                stats['rows'] = (stats['rows'] or 0) + int(rec['rows'])
+            stats['peak_rss_mb'] = _peak_rss_mb()
+
+    def merge(self, other, prefix=""):
+        """ 併入另一個計時器的結果 (例如 pipeline 收錄 engine 的分段) """
+        for name, stats in other.stages.items():
+            self.stages[f"{prefix}{name}"] = dict(stats)
+
+    def to_dict(self, **meta):
+        return dict(meta, started_at=time.strftime('%Y-%m-%dT%H:%M:%S', time.localtime(self.started)),
+                    stages=self.stages)
+
+    def write_json(self, path, **meta):
+        with open(path, "w", encoding="utf-8") as f:
+            json.dump(self.to_dict(**meta), f, ensure_ascii=False, indent=2)
+
+    def format_table(self, skip_prefix=None):
+        """ 精簡表格：階段 | 次數 | 牆鐘 | CPU | 峰值 RSS | 列數 (skip_prefix 可略過已另行印出的子階段) """
+        lines = [f"{'階段':<30}{'次數':>6}{'牆鐘(s)':>10}{'CPU(s)':>10}{'峰值(MB)':>10}{'列數':>12}"]
+        for name, s in self.stages.items():
+            if skip_prefix and name.startswith(skip_prefix):
+                continue
+            peak = f"{s['peak_rss_mb']:.0f}" if s['peak_rss_mb'] is not None else "-"
+            rows = f"{s['rows']:,}" if s['rows'] is not None else "-"
+            lines.append(f"{name:<30}{s['calls']:>6}{s['wall_s']:>10.2f}{s['cpu_s']:>10.2f}{peak:>10}{rows:>12}")
+        return "\n".join(lines)
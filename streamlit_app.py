@@ -5,10 +5,10 @@ import pandas as pd
 import plotly.express as px
 import os
 import json
-import io
 from google.oauth2 import service_account
 from googleapiclient.discovery import build
-from googleapiclient.http import MediaIoBaseDownload
+from transport import download_warehouse
+from dashboard_sql import latest_source
 
 # --- 1. 頁面配置 ---
 st.set_page_config(page_title="Alpha-Refinery 全球戰情室", layout="wide", page_icon="🚀")
@@ -22,17 +22,8 @@ def download_db_from_drive(db_name):
             info, scopes=['https://www.googleapis.com/auth/drive']
         )
         service = build('drive', 'v3', credentials=creds)
-        query = f"name = '{db_name}' and '{parent_id}' in parents"
-        results = service.files().list(q=query).execute()
-        items = results.get('files', [])
-        if not items: return False
-        request = service.files().get_media(fileId=items[0]['id'])
-        fh = io.BytesIO()
-        downloader = MediaIoBaseDownload(fh, request)
-        done = False
-        while not done: _, done = downloader.next_chunk()
-        with open(db_name, 'wb') as f: f.write(fh.getvalue())
-        return True
+        # 原始 .db 與壓縮版取較新者；壓縮版邊下載邊解壓寫入磁碟
+        return download_warehouse(service, db_name, parent_id=parent_id)
     except: return False
 
 # --- 3. 核心標題與「重大公告」 ---
@@ -82,19 +73,21 @@ if not os.path.exists(target_db):
 if os.path.exists(target_db):
     conn = sqlite3.connect(target_db)
     try:
+        # 優先讀取精煉引擎產出的最新日快照 (舊版資料庫則即時組出相同欄位)
+        latest_src = latest_source(conn)
+
         # 獲取最新日期
-        latest_date = pd.read_sql("SELECT MAX(日期) FROM cleaned_daily_base", conn).iloc[0,0]
+        latest_date = pd.read_sql(f"SELECT MAX(日期) FROM {latest_src}", conn).iloc[0,0]
         
         st.subheader(f"📍 當前分析市場：{market_option}")
         st.caption(f"📅 數據基準日：{latest_date} | 數據庫狀態：已連線 (SQLite)")
 
         # 查詢漲停股票
         query_today = f"""
-        SELECT p.StockID, i.name as Name, i.sector as Sector, p.收盤, p.Ret_Day, p.Seq_LU_Count
-        FROM cleaned_daily_base p
-        LEFT JOIN stock_info i ON p.StockID = i.symbol
-        WHERE p.日期 = '{latest_date}' AND p.is_limit_up = 1
-        ORDER BY p.Seq_LU_Count DESC, p.StockID ASC
+        SELECT StockID, Name, Sector, 收盤, Ret_Day, Seq_LU_Count
+        FROM {latest_src}
+        WHERE is_limit_up = 1
+        ORDER BY Seq_LU_Count DESC, StockID ASC
         """
         df_today = pd.read_sql(query_today, conn)
 
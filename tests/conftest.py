@@ -0,0 +1,91 @@
+# -*- coding: utf-8 -*-
+"""
+測試共用工具：以 benchmarks.synthetic_warehouse 在暫存目錄建立小型倉庫，
+並提供「精煉一次」與「逐表比對」兩個輔助函式。
+"""
+import contextlib
+import io
+import os
+import shutil
+import sqlite3
+import sys
+
+import pandas as pd
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from benchmarks.synthetic_warehouse import build_warehouse  # noqa: E402
+from core_engine import AlphaCoreEngine  # noqa: E402
+from market_rules import MarketRuleRouter  # noqa: E402
+
+RESULT_TABLES = ["cleaned_daily_base", "stock_behavior_stats", "sector_daily", "cleaning_audit", "cleaned_latest"]
+
+
+def refine(db_path, market="CN", **kwargs):
+    """ 對 db_path 執行一次精煉 (靜音)，回傳摘要訊息 """
+    conn = sqlite3.connect(db_path)
+    try:
+        with contextlib.redirect_stdout(io.StringIO()):
+            return AlphaCoreEngine(conn, MarketRuleRouter(market), market, **kwargs).execute()
+    finally:
+        conn.close()
+
+
+def read_sorted(db_path, table):
+    """ 讀出整張表並依主鍵排序，供跨資料庫比對 """
+    conn = sqlite3.connect(db_path)
+    try:
+        df = pd.read_sql(f"SELECT * FROM [{table}]", conn)
+    finally:
+        conn.close()
+    keys = [k for k in ("StockID", "日期", "Sector") if k in df.columns]
+    return df[sorted(df.columns)].sort_values(keys).reset_index(drop=True)
+
+
+def assert_same_tables(expected_db, actual_db, tables=RESULT_TABLES, rtol=1e-9, atol=1e-12):
+    for table in tables:
+        pd.testing.assert_frame_equal(read_sorted(expected_db, table), read_sorted(actual_db, table),
+                                      check_dtype=False, rtol=rtol, atol=atol, obj=table)
+
+
+def copy_prices(src_db, dst_db, until=None):
+    """ 複製倉庫，只保留 until (含) 以前的 stock_prices，模擬尚未下載到的新資料 """
+    shutil.copy(src_db, dst_db)
+    if until is not None:
+        conn = sqlite3.connect(dst_db)
+        conn.execute("DELETE FROM stock_prices WHERE date > ?", (f"{until} 23:59:59",))
+        conn.commit()
+        conn.close()
+
+
+@pytest.fixture(scope="session")
+def halted_warehouse(tmp_path_factory):
+    """
+    含停牌股的小型 CN 倉庫 (不注入乒乓異常)：
+    第一檔跨越增量切點停牌一個月，第二檔在回看窗口內停牌五個月。
+    回傳 (路徑, [停牌股代號])。
+    """
+    path = str(tmp_path_factory.mktemp("warehouse") / "halted.db")
+    build_warehouse(path, market="CN", n_symbols=30, n_days=520, pingpong_rate=0.0, seed=7)
+    return path, _halt(path)
+
+
+@pytest.fixture(scope="session")
+def pingpong_warehouse(tmp_path_factory):
+    """ 同上，但以較高機率注入乒乓異常 (剔除後各股列位會移動) """
+    path = str(tmp_path_factory.mktemp("warehouse") / "pingpong.db")
+    build_warehouse(path, market="CN", n_symbols=60, n_days=520, pingpong_rate=0.004, seed=7)
+    return path, _halt(path)
+
+
+def _halt(path):
+    conn = sqlite3.connect(path)
+    symbols = [r[0] for r in conn.execute("SELECT DISTINCT symbol FROM stock_prices ORDER BY symbol")]
+    conn.execute("DELETE FROM stock_prices WHERE symbol = ? AND date BETWEEN '2024-09-20' AND '2024-10-20'",
+                 (symbols[0],))
+    conn.execute("DELETE FROM stock_prices WHERE symbol = ? AND date BETWEEN '2024-02-01' AND '2024-07-01'",
+                 (symbols[1],))
+    conn.commit()
+    conn.close()
+    return symbols[:2]
@@ -0,0 +1,35 @@
+# -*- coding: utf-8 -*-
+"""
+stock_behavior_stats 的炸板次數依每列的 failed_lu_threshold (市場/板別) 判定。
+"""
+import sqlite3
+
+import pandas as pd
+
+from conftest import copy_prices, refine
+
+
+def test_failed_limit_up_uses_board_threshold(halted_warehouse, tmp_path):
+    src, _ = halted_warehouse
+    db = str(tmp_path / "stats.db")
+    copy_prices(src, db)
+    refine(db)
+    conn = sqlite3.connect(db)
+    try:
+        # 20% 板 (創業板/科創板) 漲 10%~19.5% 的日子不是炸板
+        wide = conn.execute("SELECT COUNT(*) FROM cleaned_daily_base WHERE failed_lu_threshold > 0.1 "
+                            "AND is_limit_up = 0 AND Ret_High > 0.095 AND Ret_High <= failed_lu_threshold"
+                            ).fetchone()[0]
+        expected = pd.read_sql("""
+            SELECT StockID,
+                   SUM(CASE WHEN is_limit_up = 0 AND Ret_High > failed_lu_threshold THEN 1 ELSE 0 END) AS failed,
+                   SUM(CASE WHEN Prev_LU = 0 AND is_limit_up = 0 AND Ret_High > failed_lu_threshold
+                            THEN 1 ELSE 0 END) AS failed_first
+            FROM cleaned_daily_base GROUP BY StockID ORDER BY StockID
+        """, conn)
+        stats = pd.read_sql("SELECT StockID, failed_lu_count AS failed, failed_first_lu_count AS failed_first "
+                            "FROM stock_behavior_stats ORDER BY StockID", conn)
+    finally:
+        conn.close()
+    assert wide > 0
+    pd.testing.assert_frame_equal(stats, expected, check_dtype=False)
@@ -0,0 +1,44 @@
+# -*- coding: utf-8 -*-
+"""
+列式副本：輸出筆數與加工表一致；未安裝 pyarrow 時明確註明略過，不回報「0 筆」。
+"""
+import os
+import sqlite3
+
+import pytest
+
+import columnar_store
+from conftest import copy_prices, refine
+
+
+def test_export_without_pyarrow_is_reported_as_skipped(halted_warehouse, tmp_path, monkeypatch, capsys):
+    monkeypatch.setattr(columnar_store, "HAS_PYARROW", False)
+    src, _ = halted_warehouse
+    db, out = str(tmp_path / "w.db"), str(tmp_path / "columnar")
+    copy_prices(src, db)
+    conn = sqlite3.connect(db)
+    try:
+        assert columnar_store.export_columnar(conn, out, "CN") is None
+    finally:
+        conn.close()
+    assert "略過列式副本輸出" in capsys.readouterr().out
+
+    summary = refine(db, columnar_dir=out)
+    assert "列式副本未輸出" in summary
+    assert not os.path.exists(out)
+
+
+def test_export_round_trip(halted_warehouse, tmp_path):
+    pytest.importorskip("pyarrow")
+    src, _ = halted_warehouse
+    db, out = str(tmp_path / "w.db"), str(tmp_path / "columnar")
+    copy_prices(src, db)
+    summary = refine(db, columnar_dir=out)
+    assert "列式副本未輸出" not in summary
+    conn = sqlite3.connect(db)
+    try:
+        rows = conn.execute("SELECT COUNT(*) FROM cleaned_daily_base WHERE 日期 >= '2024-06-01'").fetchone()[0]
+    finally:
+        conn.close()
+    df = columnar_store.read_columnar(out, "CN", columns=["StockID", "日期", "Ret_20D"], start="2024-06-01")
+    assert len(df) == rows
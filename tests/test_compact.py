@@ -0,0 +1,19 @@
+# -*- coding: utf-8 -*-
+"""
+精簡型別模式只改變記憶體中的表示：寫入的加工表與預設模式逐值相同 (不經 float32 失真)。
+"""
+import pytest
+
+from conftest import assert_same_tables, copy_prices, refine
+
+
+@pytest.mark.parametrize("options", [{}, {'workers': 2}, {'memory_budget_mb': 1}],
+                         ids=["single", "workers", "streaming"])
+def test_compact_persists_identical_values(halted_warehouse, tmp_path, options):
+    src, _ = halted_warehouse
+    default, compact = str(tmp_path / "default.db"), str(tmp_path / "compact.db")
+    copy_prices(src, default)
+    copy_prices(src, compact)
+    refine(default, **options)
+    refine(compact, compact=True, **options)
+    assert_same_tables(default, compact, rtol=0, atol=0)
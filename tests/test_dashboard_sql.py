@@ -0,0 +1,30 @@
+# -*- coding: utf-8 -*-
+"""
+儀表板的最新日資料來源：有 cleaned_latest 時直接讀，舊版資料庫則以子查詢組出相同資料。
+"""
+import sqlite3
+
+import pandas as pd
+
+from conftest import copy_prices, refine
+from dashboard_sql import LATEST_FALLBACK_SQL, latest_source, list_tables
+
+
+def test_latest_source_fallback_matches_snapshot(halted_warehouse, tmp_path):
+    src, _ = halted_warehouse
+    db = str(tmp_path / "latest.db")
+    copy_prices(src, db)
+    refine(db)
+    query = "SELECT StockID, 日期, Name, Sector, Ret_Day, Seq_LU_Count FROM {} ORDER BY StockID"
+    conn = sqlite3.connect(db)
+    try:
+        assert latest_source(conn) == "cleaned_latest"
+        snapshot = pd.read_sql(query.format(latest_source(conn)), conn)
+        conn.execute("DROP TABLE cleaned_latest")
+        assert "cleaned_latest" not in list_tables(conn)
+        assert latest_source(conn) == LATEST_FALLBACK_SQL
+        rebuilt = pd.read_sql(query.format(latest_source(conn)), conn)
+    finally:
+        conn.close()
+    assert len(snapshot) > 0
+    pd.testing.assert_frame_equal(snapshot, rebuilt)
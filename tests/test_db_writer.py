@@ -0,0 +1,85 @@
+# -*- coding: utf-8 -*-
+"""
+BulkTableWriter：replace 原子替換、append 範圍 upsert、update 只改指定欄位。
+"""
+import sqlite3
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from db_writer import BulkTableWriter
+
+
+@pytest.fixture
+def conn():
+    conn = sqlite3.connect(":memory:")
+    yield conn
+    conn.close()
+
+
+def _frame(ids, value=1.0):
+    return pd.DataFrame({'StockID': ids, '日期': [f"2024-01-0{i + 1} 00:00:00" for i in range(len(ids))],
+                         'Close': np.full(len(ids), value), 'Flag': np.arange(len(ids), dtype=np.int64)})
+
+
+def _rows(conn, table="t", columns="*"):
+    return conn.execute(f"SELECT {columns} FROM [{table}] ORDER BY rowid").fetchall()
+
+
+def test_replace_swaps_table_with_schema_and_indexes(conn):
+    pd.DataFrame({'x': [1]}).to_sql("t", conn, index=False)
+    writer = BulkTableWriter(conn, "t", primary_key=('StockID', '日期'))
+    writer.write(_frame(["A", "B"]))
+    writer.write(_frame(["C"], 2.0))
+    writer.commit(indexes=[("idx_t_stock", ("StockID",))])
+    assert writer.rows_written == 3
+    assert [r[0] for r in _rows(conn, columns="StockID")] == ["A", "B", "C"]
+    types = {c[1]: c[2] for c in conn.execute("PRAGMA table_info(t)")}
+    assert types == {'StockID': 'TEXT', '日期': 'TEXT', 'Close': 'REAL', 'Flag': 'INTEGER'}
+    names = {r[0] for r in conn.execute("SELECT name FROM sqlite_master WHERE type='index'")}
+    assert "idx_t_stock" in names
+    assert conn.execute("SELECT name FROM sqlite_master WHERE name='t__new'").fetchone() is None
+
+
+def test_replace_without_rows_keeps_old_table(conn):
+    pd.DataFrame({'x': [1, 2]}).to_sql("t", conn, index=False)
+    BulkTableWriter(conn, "t").commit()
+    assert _rows(conn) == [(1,), (2,)]
+
+
+def test_rollback_keeps_old_table_and_restores_pragmas(conn):
+    pd.DataFrame({'x': [1]}).to_sql("t", conn, index=False)
+    synchronous = conn.execute("PRAGMA synchronous").fetchone()[0]
+    writer = BulkTableWriter(conn, "t")
+    writer.write(pd.DataFrame({'x': [9]}))
+    writer.rollback()
+    assert _rows(conn) == [(1,)]
+    assert conn.execute("PRAGMA synchronous").fetchone()[0] == synchronous
+
+
+def test_append_deletes_scope_and_adds_missing_columns(conn):
+    _frame(["A", "B", "C"]).to_sql("t", conn, index=False)
+    writer = BulkTableWriter(conn, "t", mode="append", delete_where=("StockID = ?", ("B",)))
+    new = _frame(["B"], 5.0).assign(Extra=7.5)
+    writer.write(new)
+    writer.commit()
+    rows = conn.execute("SELECT StockID, Close, Extra FROM t ORDER BY StockID").fetchall()
+    assert rows == [("A", 1.0, None), ("B", 5.0, 7.5), ("C", 1.0, None)]
+
+
+def test_update_sets_only_given_columns(conn):
+    _frame(["A", "B", "C"]).to_sql("t", conn, index=False)
+    patch = _frame(["A", "B"], 3.0)[['StockID', '日期', 'Close']].assign(New=[np.nan, 4.0])
+    patch.loc[1, '日期'] = "2024-01-09 00:00:00"  # 沒有對應列：不插入
+    writer = BulkTableWriter(conn, "t", mode="update", key=('StockID', '日期'))
+    writer.write(patch)
+    writer.commit()
+    assert writer.rows_written == 1
+    rows = conn.execute("SELECT StockID, Close, Flag, New FROM t ORDER BY StockID").fetchall()
+    assert rows == [("A", 3.0, 0, None), ("B", 1.0, 1, None), ("C", 1.0, 2, None)]
+
+
+def test_update_requires_key(conn):
+    with pytest.raises(ValueError):
+        BulkTableWriter(conn, "t", mode="update")
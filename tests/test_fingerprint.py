@@ -0,0 +1,85 @@
+# -*- coding: utf-8 -*-
+"""
+原始數據指紋：內容不變時相同；價格、日期、代號或 stock_info 變動時不同。
+"""
+import contextlib
+import io
+import shutil
+import sqlite3
+
+import pytest
+
+from main_pipeline import AlphaDataPipeline
+
+
+@pytest.fixture
+def warehouse(halted_warehouse, tmp_path):
+    src, _ = halted_warehouse
+    path = str(tmp_path / "warehouse.db")
+    shutil.copy(src, path)
+    conn = sqlite3.connect(path)
+    yield conn
+    conn.close()
+
+
+def _fingerprint(conn):
+    return AlphaDataPipeline("CN", cache_dir=".")._raw_fingerprint(conn)
+
+
+def test_fingerprint_is_stable(warehouse):
+    assert _fingerprint(warehouse) == _fingerprint(warehouse)
+
+
+@pytest.mark.parametrize("sql", [
+    "UPDATE stock_prices SET close = close + 0.01 WHERE rowid = 1234",
+    "UPDATE stock_prices SET volume = volume + 1 WHERE rowid = 5678",
+    "UPDATE stock_prices SET date = '2023-01-01' WHERE rowid = 1",
+    "UPDATE stock_info SET sector = 'Other' WHERE rowid = 3",
+    "UPDATE stock_info SET market = 'XX' WHERE rowid = 3",
+], ids=["price", "volume", "date", "sector", "market"])
+def test_fingerprint_detects_changes(warehouse, sql):
+    before = _fingerprint(warehouse)
+    warehouse.execute(sql)
+    warehouse.commit()
+    assert _fingerprint(warehouse) != before
+
+
+def test_fingerprint_detects_swapped_values(warehouse):
+    before = _fingerprint(warehouse)
+    (a,), (b,) = warehouse.execute("SELECT close FROM stock_prices WHERE rowid IN (10, 20) ORDER BY rowid")
+    warehouse.execute("UPDATE stock_prices SET close = ? WHERE rowid = 10", (b,))
+    warehouse.execute("UPDATE stock_prices SET close = ? WHERE rowid = 20", (a,))
+    warehouse.commit()
+    assert _fingerprint(warehouse) != before
+
+
+def _edit_symbol_in_place(conn, rowid):
+    """ 代號中段改一碼：首字與長度不變 (舊版只看 unicode + length 的指紋抓不到) """
+    (symbol,) = conn.execute("SELECT symbol FROM stock_prices WHERE rowid = ?", (rowid,)).fetchone()
+    digit = "9" if symbol[3] != "9" else "8"
+    edited = symbol[:3] + digit + symbol[4:]
+    conn.execute("UPDATE stock_prices SET symbol = ? WHERE rowid = ?", (edited, rowid))
+    conn.commit()
+    return symbol, edited
+
+
+def test_fingerprint_detects_symbol_edit(warehouse):
+    before = _fingerprint(warehouse)
+    symbol, edited = _edit_symbol_in_place(warehouse, 4321)
+    assert (symbol[0], len(symbol)) == (edited[0], len(edited)) and symbol != edited
+    assert _fingerprint(warehouse) != before
+
+
+def test_symbol_edit_is_not_skipped(halted_warehouse, tmp_path):
+    src, _ = halted_warehouse
+    pipeline = AlphaDataPipeline("CN", cache_dir=str(tmp_path))
+    shutil.copy(src, pipeline.db_path)
+    with contextlib.redirect_stdout(io.StringIO()):
+        assert pipeline.refine()[0] == "ok"
+        assert pipeline.refine()[0] == "skipped"
+        conn = sqlite3.connect(pipeline.db_path)
+        try:
+            _edit_symbol_in_place(conn, 4321)
+        finally:
+            conn.close()
+        assert pipeline.refine()[0] == "ok"
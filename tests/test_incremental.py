@@ -0,0 +1,83 @@
+# -*- coding: utf-8 -*-
+"""
+增量精煉必須與完整重算逐格一致 (含停牌股)。
+"""
+import sqlite3
+
+import pytest
+
+from conftest import assert_same_tables, copy_prices, refine
+
+CUTS = ["2024-10-04", "2024-10-11", "2024-11-15", None]
+
+
+def _incremental_series(src, tmp_path, cuts=CUTS, **kwargs):
+    """ 先精煉 2024-09-30 以前的資料，再依 cuts 逐段補上新資料做增量精煉 """
+    db = str(tmp_path / "incremental.db")
+    copy_prices(src, db, until="2024-09-30")
+    refine(db)
+    for cut in cuts:
+        fresh = str(tmp_path / "fresh.db")
+        copy_prices(src, fresh, until=cut)
+        conn = sqlite3.connect(db)
+        conn.execute("ATTACH ? AS fresh", (fresh,))
+        conn.execute("DELETE FROM stock_prices")
+        conn.execute("INSERT INTO stock_prices SELECT * FROM fresh.stock_prices")
+        conn.commit()
+        conn.execute("DETACH fresh")
+        conn.close()
+        refine(db, incremental=True, **kwargs)
+    return db
+
+
+@pytest.fixture(scope="module")
+def full_rebuild(halted_warehouse, tmp_path_factory):
+    src, _ = halted_warehouse
+    db = str(tmp_path_factory.mktemp("full") / "full.db")
+    copy_prices(src, db)
+    refine(db)
+    return db
+
+
+@pytest.mark.parametrize("kwargs", [{}, {"backend": "sql"}, {"memory_budget_mb": 0.5}],
+                         ids=["pandas", "sql", "chunked"])
+def test_incremental_matches_full_rebuild_with_halted_symbols(halted_warehouse, full_rebuild, tmp_path, kwargs):
+    src, _ = halted_warehouse
+    assert_same_tables(full_rebuild, _incremental_series(src, tmp_path, **kwargs))
+
+
+def test_halted_symbol_forward_labels_are_filled(halted_warehouse, full_rebuild, tmp_path):
+    src, (halted, _) = halted_warehouse
+    db = _incremental_series(src, tmp_path)
+    conn = sqlite3.connect(db)
+    stale = conn.execute("SELECT COUNT(*) FROM cleaned_daily_base WHERE StockID = ? AND 日期 < '2024-11-01'"
+                         " AND Next_10D_Ret IS NULL", (halted,)).fetchone()[0]
+    conn.close()
+    assert stale == 0
+
+
+def test_incremental_matches_full_rebuild_after_pingpong_removal(pingpong_warehouse, tmp_path):
+    # 切點前最後一列可能在下一批數據進來後才被判定為乒乓異常而剔除
+    src, _ = pingpong_warehouse
+    full = str(tmp_path / "full.db")
+    copy_prices(src, full)
+    refine(full)
+    assert_same_tables(full, _incremental_series(src, tmp_path))
+
+
+def test_incremental_with_new_and_delisted_symbols(halted_warehouse, tmp_path):
+    # 新股在首次精煉後才上市 (整段精煉)；下市股之後沒有新數據 (窗口閒置，不讀也不改寫)；
+    # 重複同一切點時沒有新交易日，改走完整重算
+    src, _ = halted_warehouse
+    listed = str(tmp_path / "listed.db")
+    copy_prices(src, listed)
+    conn = sqlite3.connect(listed)
+    ipo, delisted = [r[0] for r in conn.execute("SELECT DISTINCT symbol FROM stock_prices ORDER BY symbol DESC LIMIT 2")]
+    conn.execute("DELETE FROM stock_prices WHERE symbol = ? AND date < '2024-10-08'", (ipo,))
+    conn.execute("DELETE FROM stock_prices WHERE symbol = ? AND date > '2024-08-01'", (delisted,))
+    conn.commit()
+    conn.close()
+    full = str(tmp_path / "full.db")
+    copy_prices(listed, full)
+    refine(full)
+    assert_same_tables(full, _incremental_series(listed, tmp_path, cuts=["2024-10-11", "2024-10-11", None]))
@@ -0,0 +1,33 @@
+# -*- coding: utf-8 -*-
+"""
+MarketRuleRouter.apply 不可改動呼叫端傳入的 DataFrame。
+"""
+import pandas as pd
+import pytest
+
+from market_rules import MarketRuleRouter
+
+
+def _prices(prev_close=False):
+    df = pd.DataFrame({
+        'StockID': ['600001.SS'] * 3 + ['600002.SS'] * 3,
+        '日期': pd.to_datetime(['2024-01-02', '2024-01-03', '2024-01-04'] * 2),
+        '開盤': [10.0, 10.5, 11.0, 20.0, 20.5, 21.0],
+        '最高': [10.6, 11.1, 11.2, 20.6, 22.6, 21.5],
+        '最低': [9.9, 10.4, 10.9, 19.9, 20.4, 20.9],
+        '收盤': [10.5, 11.0, 11.1, 20.5, 22.55, 21.2],
+    })
+    if prev_close:
+        df['Prev_Close'] = [float('nan'), 10.5, 11.0, float('nan'), 20.5, 22.55]
+    return df
+
+
+@pytest.mark.parametrize("prev_close", [False, True], ids=["no_prev_close", "prev_close"])
+def test_apply_leaves_sorted_input_untouched(prev_close):
+    df = _prices(prev_close)
+    before = df.copy()
+    out = MarketRuleRouter("CN").apply(df)
+    pd.testing.assert_frame_equal(df, before)
+    assert out is not df
+    assert {'Prev_Close', 'is_limit_up', 'failed_lu_threshold'} <= set(out.columns)
+    assert out['is_limit_up'].tolist() == [0, 0, 0, 0, 1, 0]
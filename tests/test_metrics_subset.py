@@ -0,0 +1,49 @@
+# -*- coding: utf-8 -*-
+"""
+metrics= 只重算部分欄位時，只能更新這些欄位，不可刪除其他欄位或列。
+"""
+import sqlite3
+
+import pytest
+
+from conftest import RESULT_TABLES, assert_same_tables, copy_prices, refine
+
+
+@pytest.fixture(scope="module")
+def full_rebuild(halted_warehouse, tmp_path_factory):
+    src, _ = halted_warehouse
+    db = str(tmp_path_factory.mktemp("metrics") / "full.db")
+    copy_prices(src, db)
+    refine(db)
+    return db
+
+
+def _damage(db, columns, since="0000"):
+    """ 把 since 之後的指定欄位清成空值，模擬需要重算的欄位 """
+    conn = sqlite3.connect(db)
+    conn.execute(f"UPDATE cleaned_daily_base SET {', '.join(f'[{c}] = NULL' for c in columns)} WHERE 日期 >= ?",
+                 (since,))
+    conn.commit()
+    conn.close()
+
+
+@pytest.mark.parametrize("kwargs", [{}, {"memory_budget_mb": 0.5}, {"start_date": "2024-06-03"}],
+                         ids=["whole", "chunked", "start_date"])
+def test_metrics_subset_updates_only_requested_columns(full_rebuild, tmp_path, kwargs):
+    db = str(tmp_path / "subset.db")
+    copy_prices(full_rebuild, db)
+    _damage(db, ["Ret_20D", "volatility_10d"], since=kwargs.get("start_date", "0000"))
+    msg = refine(db, metrics=["Ret_20D", "volatility_10d"], **kwargs)
+    assert "更新" in msg
+    assert_same_tables(full_rebuild, db, tables=RESULT_TABLES)
+
+
+def test_metrics_subset_leaves_other_columns_alone(full_rebuild, tmp_path):
+    db = str(tmp_path / "subset.db")
+    copy_prices(full_rebuild, db)
+    _damage(db, ["Ret_5D"])
+    refine(db, metrics=["Ret_20D"])
+    conn = sqlite3.connect(db)
+    filled = conn.execute("SELECT COUNT(Ret_5D), COUNT(Ret_20D), COUNT(*) FROM cleaned_daily_base").fetchone()
+    conn.close()
+    assert filled[0] == 0 and filled[1] > 0 and filled[2] > 0
@@ -0,0 +1,64 @@
+# -*- coding: utf-8 -*-
+"""
+指定範圍重跑 (start_date / end_date) 的改寫窗口必須依各股自己的交易列規劃。
+"""
+import sqlite3
+
+import pandas as pd
+import pytest
+
+from conftest import assert_same_tables, copy_prices, read_sorted, refine
+
+START, END = "2024-10-15", "2024-11-08"
+
+
+def _restate_prices(db, symbol, start, end):
+    """ 模擬回補修正：該股 start ~ end 的價格整體上調 1% """
+    conn = sqlite3.connect(db)
+    conn.execute("UPDATE stock_prices SET open = open * 1.01, high = high * 1.01, low = low * 1.01, "
+                 "close = close * 1.01 WHERE symbol = ? AND date BETWEEN ? AND ?",
+                 (symbol, start, f"{end} 23:59:59"))
+    conn.commit()
+    conn.close()
+
+
+@pytest.fixture(scope="module")
+def refined_then_restated(halted_warehouse, tmp_path_factory):
+    """ (先以舊價格完整精煉、再修正價格的 db, 以修正後價格完整重算的 db, 停牌股) """
+    src, (halted, _) = halted_warehouse
+    base = tmp_path_factory.mktemp("rerun")
+    stale, full = str(base / "stale.db"), str(base / "full.db")
+    copy_prices(src, stale)
+    refine(stale)
+    _restate_prices(stale, halted, START, END)
+    copy_prices(stale, full)
+    refine(full)
+    return stale, full, halted
+
+
+def test_rerun_from_start_date_matches_full_rebuild(refined_then_restated, tmp_path):
+    # start_date 落在停牌期間：停牌前最後幾筆的前瞻欄位也必須改寫
+    stale, full, _ = refined_then_restated
+    db = str(tmp_path / "rerun.db")
+    copy_prices(stale, db)
+    refine(db, start_date=START)
+    assert_same_tables(full, db, tables=["cleaned_daily_base", "stock_behavior_stats", "cleaned_latest"])
+
+
+def test_rerun_with_end_date_matches_full_rebuild_up_to_end(refined_then_restated, tmp_path):
+    stale, full, _ = refined_then_restated
+    db = str(tmp_path / "rerun.db")
+    copy_prices(stale, db)
+    refine(db, start_date=START, end_date=END)
+    expected, actual = read_sorted(full, "cleaned_daily_base"), read_sorted(db, "cleaned_daily_base")
+    keep = lambda df: df[df['日期'] <= f"{END} 23:59:59"].reset_index(drop=True)
+    assert len(expected) == len(actual)
+    pd.testing.assert_frame_equal(keep(expected), keep(actual), check_dtype=False, rtol=1e-9, atol=1e-12)
+
+
+def test_rerun_symbols_only_matches_full_rebuild(refined_then_restated, tmp_path):
+    stale, full, halted = refined_then_restated
+    db = str(tmp_path / "rerun.db")
+    copy_prices(stale, db)
+    refine(db, symbols=[halted])
+    assert_same_tables(full, db, tables=["cleaned_daily_base", "stock_behavior_stats", "cleaned_latest"])
@@ -0,0 +1,92 @@
+# -*- coding: utf-8 -*-
+"""
+SegmentedRolling 與 pandas groupby 參考實作逐值比對 (含 NaN、單列股票、長短不一的分段)。
+"""
+import numpy as np
+import pandas as pd
+import pytest
+
+from rolling_kernels import SegmentedRolling
+
+
+@pytest.fixture(scope="module")
+def frame():
+    rng = np.random.default_rng(3)
+    sizes = [1, 2, 5, 37, 260, 90, 3]
+    df = pd.DataFrame({
+        'StockID': np.repeat([f"S{i:02d}" for i in range(len(sizes))], sizes),
+        'value': rng.normal(100, 5, sum(sizes)),
+        'flag': rng.random(sum(sizes)) < 0.4,
+    })
+    df.loc[rng.random(len(df)) < 0.05, 'value'] = np.nan
+    # 全平段落 (連續漲停時波動率應為 0)
+    df.loc[200:230, 'value'] = 42.0
+    return df
+
+
+@pytest.fixture(params=["object", "category"])
+def seg(frame, request):
+    keys = frame['StockID'].astype(request.param)
+    return SegmentedRolling(keys)
+
+
+def _groups(frame):
+    return frame.groupby('StockID', sort=False)
+
+
+@pytest.mark.parametrize("periods", [1, 3, -1, -5])
+def test_shift(frame, seg, periods):
+    expected = _groups(frame)['value'].shift(periods).to_numpy()
+    np.testing.assert_array_equal(seg.shift(frame['value'], periods), expected)
+
+
+def test_pct_change(frame, seg):
+    result = seg.pct_change(frame['value'], [1, 5, 20])
+    for p, out in result.items():
+        expected = frame['value'] / _groups(frame)['value'].shift(p) - 1
+        np.testing.assert_allclose(out, expected.to_numpy(), rtol=1e-15)
+
+
+def test_run_length(frame, seg):
+    flag = frame['flag'].astype(int)
+    block = (flag != _groups(frame)['flag'].shift().astype(float)).cumsum()
+    expected = flag.groupby([frame['StockID'], block]).cumsum()
+    np.testing.assert_array_equal(seg.run_length(frame['flag']), expected.to_numpy())
+
+
+def test_cummax(frame, seg):
+    values = seg.run_length(frame['flag'])
+    expected = pd.Series(values).groupby(frame['StockID'].to_numpy()).cummax()
+    np.testing.assert_array_equal(seg.cummax(values), expected.to_numpy())
+
+
+def test_period_first(frame, seg):
+    period = np.arange(len(frame)) // 7  # 組內遞增的期間代碼 (模擬週/月編號)
+    values = frame['value'].fillna(-1.0)
+    expected = values.groupby([frame['StockID'], period]).transform('first')
+    np.testing.assert_array_equal(seg.period_first(values, period), expected.to_numpy())
+
+
+@pytest.mark.parametrize("windows", [[10, 20, 50]])
+def test_rolling_std(frame, seg, windows):
+    result = seg.rolling_std(frame['value'], windows)
+    for w in windows:
+        expected = _groups(frame)['value'].transform(lambda s: s.rolling(w).std()).to_numpy()
+        np.testing.assert_allclose(result[w], expected, rtol=1e-9, atol=1e-9)
+
+
+@pytest.mark.parametrize("min_periods", [None, 1])
+def test_rolling_extremes(frame, seg, min_periods):
+    windows = [1, 2, 5, 10, 20, 50]
+    highs = seg.rolling_max(frame['value'], windows, min_periods=min_periods)
+    lows = seg.rolling_min(frame['value'], windows, min_periods=min_periods)
+    for w in windows:
+        roll = lambda s, how: getattr(s.rolling(w, min_periods=min_periods), how)()
+        np.testing.assert_array_equal(highs[w], _groups(frame)['value'].transform(roll, 'max').to_numpy())
+        np.testing.assert_array_equal(lows[w], _groups(frame)['value'].transform(roll, 'min').to_numpy())
+
+
+def test_empty():
+    seg = SegmentedRolling(pd.Series([], dtype=object))
+    assert len(seg.shift(np.array([]), 1)) == 0
+    assert seg.rolling_std(np.array([]), [5])[5].shape == (0,)
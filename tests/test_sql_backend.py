@@ -0,0 +1,21 @@
+# -*- coding: utf-8 -*-
+"""
+SQL 視窗函數路徑與 pandas 路徑的完整精煉結果一致 (浮點容許平方和公式的抵銷誤差)。
+"""
+import pytest
+
+from benchmarks.synthetic_warehouse import build_warehouse
+from conftest import RESULT_TABLES, assert_same_tables, copy_prices, refine
+
+
+@pytest.mark.parametrize("market", ["CN", "TW", "US"])
+def test_sql_backend_matches_pandas(market, tmp_path):
+    src = str(tmp_path / "src.db")
+    build_warehouse(src, market=market, n_symbols=40, n_days=300, pingpong_rate=0.003, seed=11)
+    pandas_db, sql_db = str(tmp_path / "pandas.db"), str(tmp_path / "sql.db")
+    copy_prices(src, pandas_db)
+    copy_prices(src, sql_db)
+    refine(pandas_db, market=market)
+    refine(sql_db, market=market, backend="sql")
+    # 接近全平的窗口 (例如連續漲停) 波動率趨近 0，平方和公式的抵銷誤差約 1e-11
+    assert_same_tables(pandas_db, sql_db, tables=RESULT_TABLES, atol=1e-9)
@@ -0,0 +1,170 @@
+# -*- coding: utf-8 -*-
+"""
+同步層：壓縮傳輸預設只送壓縮檔 + manifest (keep_raw 時另更新原始 .db)，下載端取壓縮版；未變動時略過上傳。
+"""
+import hashlib
+import itertools
+import os
+import re
+
+import pytest
+
+from drive_sync import DriveSync, LocalDirSync
+from transport import artifact_name, manifest_name
+
+CODEC = "gzip"
+NAME = "cn_stock_warehouse.db"
+
+
+class _Request:
+    def __init__(self, fn, data=None):
+        self.fn, self.data = fn, data
+
+    def execute(self):
+        return self.fn()
+
+    def next_chunk(self):
+        return None, self.fn()
+
+
+class FakeDrive:
+    """ Drive v3 files() 的最小替身 (記憶體內)；modifiedTime 以遞增序號模擬 """
+
+    def __init__(self):
+        self.store, self.uploads = {}, []
+        self._clock = itertools.count(1)
+
+    def add(self, name, data, parents=None):
+        file_id = f"id{len(self.store)}"
+        self.store[file_id] = {'id': file_id, 'name': name, 'data': data, 'parents': parents,
+                               'modifiedTime': f"{next(self._clock):08d}"}
+        return file_id
+
+    def by_name(self, name):
+        return next(f for f in self.store.values() if f['name'] == name)
+
+    def files(self):
+        return self
+
+    def _meta(self, f):
+        return {'id': f['id'], 'name': f['name'], 'md5Checksum': hashlib.md5(f['data']).hexdigest(),
+                'modifiedTime': f['modifiedTime'], 'size': str(len(f['data'])), 'parents': f['parents'],
+                'trashed': False}
+
+    def list(self, q, fields):
+        names = re.findall(r"name = '([^']+)'", q)
+        return _Request(lambda: {'files': [self._meta(f) for f in self.store.values() if f['name'] in names]})
+
+    def get(self, fileId, fields):
+        return _Request(lambda: self._meta(self.store[fileId]))
+
+    def get_media(self, fileId):
+        return _Request(lambda: self.store[fileId]['data'], self.store[fileId]['data'])
+
+    def update(self, fileId, media_body, fields):
+        def fn():
+            f = self.store[fileId]
+            with open(media_body._filename, "rb") as fh:
+                f['data'] = fh.read()
+            f['modifiedTime'] = f"{next(self._clock):08d}"
+            self.uploads.append(f['name'])
+            return self._meta(f)
+        return _Request(fn)
+
+    def create(self, body, media_body, fields):
+        def fn():
+            with open(media_body._filename, "rb") as fh:
+                file_id = self.add(body['name'], fh.read(), body.get('parents'))
+            self.uploads.append(body['name'])
+            return self._meta(self.store[file_id])
+        return _Request(fn)
+
+
+class _Downloader:
+    """ MediaIoBaseDownload 的替身：分塊寫出 _Request.data """
+
+    def __init__(self, fh, request, chunksize=64 * 1024):
+        self.fh, self.data, self.chunksize, self.pos = fh, request.data, chunksize, 0
+
+    def next_chunk(self):
+        self.fh.write(self.data[self.pos:self.pos + self.chunksize])
+        self.pos += self.chunksize
+        return None, self.pos >= len(self.data)
+
+
+@pytest.fixture(autouse=True)
+def fake_downloads(monkeypatch):
+    import drive_sync
+    import transport
+    monkeypatch.setattr(drive_sync, "MediaIoBaseDownload", _Downloader)
+    monkeypatch.setattr(transport, "MediaIoBaseDownload", _Downloader)
+
+
+@pytest.fixture
+def warehouse(halted_warehouse):
+    with open(halted_warehouse[0], "rb") as f:
+        return f.read()
+
+
+def _touch(path):
+    with open(path, "ab") as f:
+        f.write(b"\0" * 4096)
+
+
+def _uploaded_bytes(out):
+    return int(re.search(r"本次上傳 \d+ 個檔案，共 [\d.]+ MB \(([\d,]+) bytes\)", out).group(1).replace(",", ""))
+
+
+@pytest.mark.parametrize("keep_raw", [False, True], ids=["artifact_only", "keep_raw"])
+def test_drive_upload_with_codec(warehouse, tmp_path, capsys, keep_raw):
+    drive = FakeDrive()
+    drive.add(NAME, warehouse, parents=["folder"])
+    sync = DriveSync(drive, str(tmp_path / "worker"))
+    assert sync.download(NAME)
+    _touch(sync.local_path(NAME))
+    with open(sync.local_path(NAME), "rb") as f:
+        refined = f.read()
+
+    capsys.readouterr()
+    assert sync.upload(NAME, codec=CODEC, keep_raw=keep_raw)
+    artifact = drive.by_name(artifact_name(NAME, CODEC))
+    manifest = drive.by_name(manifest_name(NAME))
+    if keep_raw:
+        assert drive.uploads == [artifact_name(NAME, CODEC), NAME, manifest_name(NAME)]
+        assert drive.by_name(NAME)['data'] == refined
+    else:
+        assert drive.uploads == [artifact_name(NAME, CODEC), manifest_name(NAME)]
+        assert drive.by_name(NAME)['data'] == warehouse
+    sent = [artifact, manifest] + ([drive.by_name(NAME)] if keep_raw else [])
+    assert _uploaded_bytes(capsys.readouterr().out) == sum(len(f['data']) for f in sent)
+    assert artifact['parents'] == ["folder"]
+    assert not sync.upload(NAME, codec=CODEC, keep_raw=keep_raw)
+
+    # 另一台機器：manifest 比原始 .db 新，走壓縮版並解壓出相同內容
+    reader = DriveSync(drive, str(tmp_path / "reader"))
+    assert reader.download(NAME)
+    with open(reader.local_path(NAME), "rb") as f:
+        assert f.read() == refined
+
+
+@pytest.mark.parametrize("keep_raw", [False, True], ids=["artifact_only", "keep_raw"])
+def test_local_dir_upload_with_codec(warehouse, tmp_path, capsys, keep_raw):
+    root, cache = tmp_path / "root", tmp_path / "cache"
+    root.mkdir()
+    (root / NAME).write_bytes(warehouse)
+    sync = LocalDirSync(str(root), str(cache))
+    assert sync.download(NAME)
+    _touch(sync.local_path(NAME))
+
+    capsys.readouterr()
+    assert sync.upload(NAME, codec=CODEC, keep_raw=keep_raw)
+    expected = (cache / NAME).read_bytes() if keep_raw else warehouse
+    assert (root / NAME).read_bytes() == expected
+    sent = [root / artifact_name(NAME, CODEC), root / manifest_name(NAME)] + ([root / NAME] if keep_raw else [])
+    assert _uploaded_bytes(capsys.readouterr().out) == sum(os.path.getsize(p) for p in sent)
+    assert os.path.getmtime(root / manifest_name(NAME)) >= os.path.getmtime(root / NAME)
+    assert not sync.upload(NAME, codec=CODEC, keep_raw=keep_raw)
+
+    other = LocalDirSync(str(root), str(tmp_path / "other"))
+    assert other.download(NAME)
+    assert (tmp_path / "other" / NAME).read_bytes() == (cache / NAME).read_bytes()
@@ -0,0 +1,49 @@
+# -*- coding: utf-8 -*-
+"""
+壓縮傳輸：壓縮 -> 串流解壓還原相同內容，manifest 與內容不符時拒絕替換。
+"""
+import os
+
+import pytest
+
+from drive_sync import file_md5
+from transport import artifact_name, check_codec, compress_file, decompress_file
+
+
+@pytest.fixture
+def source(tmp_path):
+    path = tmp_path / "cn_stock_warehouse.db"
+    path.write_bytes(os.urandom(1 << 16) + b"\0" * (3 << 20))  # 跨越多個 CHUNK_BYTES 區塊
+    return str(path)
+
+
+@pytest.mark.parametrize("codec", ["gzip", "zstd"])
+def test_round_trip(source, tmp_path, codec):
+    if codec == "zstd":
+        pytest.importorskip("zstandard")
+    artifact = str(tmp_path / artifact_name(os.path.basename(source), codec))
+    manifest = compress_file(source, artifact, codec)
+    assert manifest['codec'] == codec
+    assert manifest['raw_md5'] == file_md5(source)
+    assert manifest['raw_size'] == os.path.getsize(source)
+    assert manifest['artifact_size'] == os.path.getsize(artifact) < manifest['raw_size']
+
+    restored = str(tmp_path / "restored.db")
+    assert decompress_file(artifact, restored, manifest) == manifest['raw_size']
+    assert file_md5(restored) == manifest['raw_md5']
+
+
+def test_checksum_mismatch_keeps_destination(source, tmp_path):
+    artifact = str(tmp_path / artifact_name(os.path.basename(source), "gzip"))
+    manifest = compress_file(source, artifact, "gzip")
+    restored = tmp_path / "restored.db"
+    restored.write_bytes(b"old")
+    with pytest.raises(ValueError):
+        decompress_file(artifact, str(restored), dict(manifest, raw_md5="0" * 32))
+    assert restored.read_bytes() == b"old"
+    assert not os.path.exists(f"{restored}.part")
+
+
+def test_unknown_codec_is_rejected():
+    with pytest.raises(ValueError):
+        check_codec("lz4")
@@ -0,0 +1,190 @@
+# -*- coding: utf-8 -*-
+import hashlib
+import json
+import os
+import time
+import zlib
+
+from googleapiclient.http import MediaIoBaseDownload
+
+# zstandard 為選用套件：未安裝時只能使用 gzip (標準函式庫)
+try:
+    import zstandard
+    HAS_ZSTD = True
+except ImportError:
+    zstandard = None
+    HAS_ZSTD = False
+
+# ==========================================
+# 壓縮傳輸格式 (壓縮檔 + manifest)
+# ==========================================
+# 雲端上 xx_stock_warehouse.db 的壓縮版本：
+#   xx_stock_warehouse.db.gz / .zst      串流壓縮的資料庫
+#   xx_stock_warehouse.db.manifest.json  {codec, artifact, raw_md5, raw_size, ...}
+# manifest 在壓縮檔上傳完成後才更新；讀取端比較 manifest 與原始 .db 的 modifiedTime，取較新者。
+CODECS = {'gzip': '.gz', 'zstd': '.zst'}
+DEFAULT_LEVELS = {'gzip': 6, 'zstd': 10}
+MIMETYPES = {'gzip': 'application/gzip', 'zstd': 'application/zstd'}
+CHUNK_BYTES = 8 * 1024 * 1024
+
+
+def manifest_name(name):
+    return f"{name}.manifest.json"
+
+
+def artifact_name(name, codec):
+    return f"{name}{CODECS[codec]}"
+
+
+def check_codec(codec):
+    if codec not in CODECS:
+        raise ValueError(f"未知的壓縮格式：{codec} (可用 {', '.join(CODECS)})")
+    if codec == 'zstd' and not HAS_ZSTD:
+        raise ImportError("zstd 壓縮需要 zstandard：pip install zstandard")
+
+
+def _compressor(codec, level):
+    if codec == 'gzip':
+        return zlib.compressobj(level, zlib.DEFLATED, 16 + zlib.MAX_WBITS)  # 16 + MAX_WBITS = gzip 標頭
+    return zstandard.ZstdCompressor(level=level).compressobj()
+
+
+def _decompressor(codec):
+    if codec == 'gzip':
+        return zlib.decompressobj(16 + zlib.MAX_WBITS)
+    return zstandard.ZstdDecompressor().decompressobj()
+
+
+def compress_file(src, dst, codec, level=None):
+    """ 串流壓縮 src -> dst (先寫 .part 再改名)，回傳 manifest (含原始檔與壓縮檔的 md5 / 大小) """
+    check_codec(codec)
+    level = DEFAULT_LEVELS[codec] if level is None else level
+    raw_md5, artifact_md5 = hashlib.md5(), hashlib.md5()
+    raw_size = artifact_size = 0
+    compressor = _compressor(codec, level)
+    partial = f"{dst}.part"
+    with open(src, "rb") as fin, open(partial, "wb") as fout:
+        for block in iter(lambda: fin.read(CHUNK_BYTES), b""):
+            raw_md5.update(block)
+            raw_size += len(block)
+            out = compressor.compress(block)
+            if out:
+                artifact_md5.update(out)
+                artifact_size += len(out)
+                fout.write(out)
+        out = compressor.flush()
+        artifact_md5.update(out)
+        artifact_size += len(out)
+        fout.write(out)
+    os.replace(partial, dst)
+    return {
+        'name': os.path.basename(src),
+        'artifact': os.path.basename(dst),
+        'codec': codec,
+        'level': level,
+        'raw_md5': raw_md5.hexdigest(),
+        'raw_size': raw_size,
+        'artifact_md5': artifact_md5.hexdigest(),
+        'artifact_size': artifact_size,
+        'created_at': time.strftime('%Y-%m-%dT%H:%M:%S'),
+    }
+
+
+class DecompressingWriter:
+    """
+    可交給 MediaIoBaseDownload 的檔案物件：收到的壓縮區塊即時解壓寫入 path，
+    不需先把壓縮檔落地或整份放進記憶體；同時累計解壓後的 md5 / 大小供 manifest 驗證。
+    """
+
+    def __init__(self, path, codec):
+        check_codec(codec)
+        self._out = open(path, "wb")
+        self._decompressor = _decompressor(codec)
+        self.md5 = hashlib.md5()
+        self.size = 0
+
+    def write(self, data):
+        self._emit(self._decompressor.decompress(data))
+        return len(data)
+
+    def close(self):
+        if self._out.closed:
+            return
+        self._emit(self._decompressor.flush())
+        self._out.close()
+
+    def _emit(self, block):
+        if block:
+            self.md5.update(block)
+            self.size += len(block)
+            self._out.write(block)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def _verified_replace(writer, partial, dest, manifest):
+    if writer.md5.hexdigest() != manifest['raw_md5']:
+        os.remove(partial)
+        raise ValueError(f"❌ 解壓後的 md5 與 manifest 不符：{manifest['artifact']}")
+    os.replace(partial, dest)
+    return writer.size
+
+
+def download_artifact(service, file_id, dest, manifest):
+    """ 下載壓縮檔並串流解壓到 dest (先寫 .part)；解壓結果須與 manifest 的 raw_md5 相符 """
+    partial = f"{dest}.part"
+    with DecompressingWriter(partial, manifest['codec']) as writer:
+        downloader = MediaIoBaseDownload(writer, service.files().get_media(fileId=file_id))
+        done = False
+        while not done:
+            status, done = downloader.next_chunk()
+    return _verified_replace(writer, partial, dest, manifest)
+
+
+def decompress_file(src, dest, manifest):
+    """ 本機壓縮檔串流解壓到 dest (LocalDirSync 使用)；驗證方式同 download_artifact """
+    partial = f"{dest}.part"
+    with DecompressingWriter(partial, manifest['codec']) as writer, open(src, "rb") as fin:
+        for block in iter(lambda: fin.read(CHUNK_BYTES), b""):
+            writer.write(block)
+    return _verified_replace(writer, partial, dest, manifest)
+
+# ==========================================
+# 儀表板共用：下載最新版本 (原始 .db 或壓縮檔)
+# ==========================================
+def download_warehouse(service, name, dest=None, parent_id=None):
+    """
+    雲端上原始 .db 與壓縮版 manifest 取 modifiedTime 較新者下載到 dest (預設與 name 同名)，
+    壓縮版邊下載邊解壓。找不到任何版本時回傳 False。
+    """
+    dest = dest or name
+    scope = f" and '{parent_id}' in parents" if parent_id else ""
+    query = f"(name = '{name}' or name = '{manifest_name(name)}') and trashed = false{scope}"
+    files = service.files().list(q=query, fields="files(id, name, modifiedTime)").execute().get('files', [])
+    raw = next((f for f in files if f['name'] == name), None)
+    packed = next((f for f in files if f['name'] == manifest_name(name)), None)
+    if raw is None and packed is None:
+        return False
+
+    if packed is not None and (raw is None or packed['modifiedTime'] >= raw['modifiedTime']):
+        manifest = json.loads(service.files().get_media(fileId=packed['id']).execute())
+        query = f"name = '{manifest['artifact']}' and trashed = false{scope}"
+        artifacts = service.files().list(q=query, fields="files(id, name)").execute().get('files', [])
+        if artifacts:
+            download_artifact(service, artifacts[0]['id'], dest, manifest)
+            return True
+        if raw is None:
+            return False
+
+    partial = f"{dest}.part"
+    with open(partial, "wb") as fh:
+        downloader = MediaIoBaseDownload(fh, service.files().get_media(fileId=raw['id']))
+        done = False
+        while not done:
+            status, done = downloader.next_chunk()
+    os.replace(partial, dest)
+    return True